@@ -1,5 +1,6 @@
 import numpy as np
 import os
+import sys
 
 # conversion factor from Å to m
 ang2m = 1e-10
@@ -7,6 +8,10 @@ ang2m = 1e-10
 # getting the directory where the script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
+# the TAPSim node file reader/writer is shared with pyvaporate (7_pyevaporate)
+sys.path.insert(0, os.path.join(script_dir, '..', '..', '..', '7_pyevaporate'))
+from pyvaporate.nodes import make_nodes, parse_table, write_node_file
+
 # file paths relative to the script directory
 material_file_path = os.path.join(script_dir, '..', 'output', 'Material.txt')
 vacuum_file_path = os.path.join(script_dir, '..', 'output', 'Vaccum.txt')
@@ -19,37 +24,29 @@ input_files = [
     (fixed_file_path, 2)
 ]
 
-combinedNode = []
+coords, ids = [], []
 
 # reading each LAMMPS dump file to extract lattice positions, convert units and
 # assign IDs relevant to the TAPSim NODE file requirements
 for filename, point_id in input_files:
     with open(filename, 'r') as file:
-        lines = file.readlines()
-
-    # finding the line where the atom data starts
-    atom_data_start = lines.index('ITEM: ATOMS x y z type\n') + 1
-
-    # processing atom data now
-    for line in lines[atom_data_start:]:
-        parts = line.split()
-        x, y, z = map(float, parts[:3])
+        text = file.read()
 
-        # converting Å to m
-        x *= ang2m
-        y *= ang2m
-        z *= ang2m
+    # the atom data starts after the 'ITEM: ATOMS' line
+    atom_header = 'ITEM: ATOMS x y z type\n'
+    atoms = parse_table(text[text.index(atom_header)+len(atom_header):], 4)
 
-        # appending data in the format required by TAPSim (scientific notation + ID)
-        combinedNode.append(f'{x:.8E}\t{y:.8E}\t{z:.8E}\t{point_id}'.strip())
+    # converting Å to m
+    coords.append(atoms[:, :3]*ang2m)
+    ids.append(np.full(len(atoms), point_id))
+coords = np.concatenate(coords)
 
 # total number of data points
-total_points = len(combinedNode)
+total_points = len(coords)
 
-# writing the combined data to the NODE file in ASCII format
+# writing the combined data to the NODE file in the format required by TAPSim
+# (tab separated, scientific notation + ID)
 output_file = 'NODE.txt'
-with open(output_file, 'w') as file:
-    file.write(f'ASCII {total_points} 0 0\n')
-    file.write('\n'.join(combinedNode).strip())
+write_node_file(output_file, make_nodes(coords, np.concatenate(ids)), fmt='%.8E')
 
-print(f'Combined data written to {output_file} with {total_points} points.')
\ No newline at end of file
+print(f'Combined data written to {output_file} with {total_points} points.')
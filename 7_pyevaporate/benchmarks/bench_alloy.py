@@ -0,0 +1,52 @@
+# Benchmark for the alloy substitution in pyvaporate.alloy.
+# Substitutes 30% solute into BCC emitters of increasing size, with and
+# without a Warren-Cowley short-range-order target, and reports the time
+# and the alpha that was reached.
+#
+# Usage: python benchmarks/bench_alloy.py [radius ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+from ase.lattice.cubic import BodyCenteredCubic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyvaporate.alloy import (substitute_alloy, neighbor_bonds, order_alloy,
+                              warren_cowley)
+from pyvaporate.build import build_nodes
+
+RADII = [25, 50, 100, 200]
+TARGET = -0.1
+
+
+def main(radii):
+    print("{:>8} {:>10} {:>12} {:>10} {:>12} {:>12} {:>10}".format(
+        "radius", "atoms", "random (s)", "alpha", "bonds (s)", "order (s)",
+        "alpha"))
+    unit = BodyCenteredCubic(size=(1, 1, 1), symbol="Fe")
+    for radius in radii:
+        coords, ids = build_nodes(unit.cell.array, unit.get_positions(), 10,
+                                  radius, radius/2, 25)
+        sites = np.flatnonzero(ids >= 10)
+        ids = ids[sites]
+
+        t = time.perf_counter()
+        substitute_alloy(ids, {"Cr": 0.3}, seed=0)
+        t_random = time.perf_counter()-t
+
+        t = time.perf_counter()
+        bonds = neighbor_bonds(coords[sites]*1e10)
+        t_bonds = time.perf_counter()-t
+        alpha_random = warren_cowley(ids, bonds, 10, 20)
+
+        t = time.perf_counter()
+        alpha = order_alloy(ids, bonds, 10, 20, TARGET, seed=0)
+        t_order = time.perf_counter()-t
+        print("{:8} {:10} {:12.3f} {:10.4f} {:12.3f} {:12.3f} {:10.4f}".format(
+            radius, len(ids), t_random, alpha_random, t_bonds, t_order, alpha))
+
+
+if __name__ == "__main__":
+    main([float(r) for r in sys.argv[1:]] or RADII)
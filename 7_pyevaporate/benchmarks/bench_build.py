@@ -0,0 +1,85 @@
+# Benchmark for the emitter builders in pyvaporate.build.
+# Times the vectorized region classification against the original
+# per-point loop and the full `build_emitter_from_scratch` call for a
+# range of emitter radii, to show how the build scales with tip size.
+#
+# Usage: python benchmarks/bench_build.py [radius ...]
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ase.lattice.cubic import BodyCenteredCubic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyvaporate.build import classify_points, build_emitter_from_scratch
+
+RADII = [25, 50, 100, 200, 300]
+LOOP_LIMIT = 2000000  # skip the per-point loop above this many points
+
+
+def loop_classify(pts, emitter_radius, emitter_side_height, vacuum_radius):
+    """
+    The per-point classification loop the builders used before
+    `classify_points`, kept here as the benchmark baseline.
+    """
+    R = emitter_radius + vacuum_radius
+    cx = np.mean([pt[0] for pt in pts])
+    cy = np.mean([pt[1] for pt in pts])
+    min_z = min([pt[2] for pt in pts])
+    emitter_points, vacuum_points, bottom_points = [], [], []
+    for pt in pts:
+        pt = [pt[0], pt[1], pt[2]-min_z]
+        r2 = (pt[0]-cx)**2+(pt[1]-cy)**2
+        d2 = r2+(pt[2]-emitter_side_height)**2
+        if pt[2] < 1e-5 and r2 < R**2:
+            bottom_points.append([pt[0]*1e-10, pt[1]*1e-10, 0.0, 2])
+        elif (pt[2] < emitter_side_height and r2 < emitter_radius**2) or \
+                d2 < emitter_radius**2:
+            emitter_points.append([i*1e-10 for i in pt]+[10])
+        elif (pt[2] < emitter_side_height and r2 < R**2) or d2 < R**2:
+            vacuum_points.append([i*1e-10 for i in pt]+[0])
+    return emitter_points + vacuum_points + bottom_points
+
+
+def lattice_points(radius, side_height, vacuum_radius=25):
+    R = radius + vacuum_radius
+    cell = BodyCenteredCubic(size=(1, 1, 1), symbol="W").cell.lengths()
+    size = tuple(int(np.ceil(d/c))+1 for d, c in
+                 zip((2*R, 2*R, side_height+R), cell))
+    return BodyCenteredCubic(size=size, symbol="W").get_positions()
+
+
+def main(radii):
+    print("{:>8} {:>12} {:>10} {:>12} {:>12} {:>12}".format(
+        "radius", "points", "nodes", "loop (s)", "numpy (s)", "build (s)"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for radius in radii:
+            side_height = radius/2
+            pts = lattice_points(radius, side_height)
+
+            t = time.perf_counter()
+            coords, ids = classify_points(pts, radius, side_height, 25)
+            t_numpy = time.perf_counter()-t
+
+            if len(pts) <= LOOP_LIMIT:
+                t = time.perf_counter()
+                loop_classify(pts, radius, side_height, 25)
+                t_loop = "{:12.3f}".format(time.perf_counter()-t)
+            else:
+                t_loop = "{:>12}".format("-")
+
+            t = time.perf_counter()
+            build_emitter_from_scratch(
+                "W", "BCC", (0, 0, 1), filename=os.path.join(tmp, "emitter.txt"),
+                emitter_radius=radius, emitter_side_height=side_height
+            )
+            t_build = time.perf_counter()-t
+            print("{:8} {:12} {:10} {} {:12.3f} {:12.3f}".format(
+                radius, len(pts), len(ids), t_loop, t_numpy, t_build))
+
+
+if __name__ == "__main__":
+    main([float(r) for r in sys.argv[1:]] or RADII)
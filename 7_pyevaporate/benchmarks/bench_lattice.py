@@ -0,0 +1,86 @@
+# Benchmark and consistency check for the crop-aware lattice tiler in
+# pyvaporate.build. For each basis, the emitter nodes are generated both
+# from the full rectangular ASE supercell and with `build_nodes`, which
+# only tiles unit cells that can touch the emitter/vacuum envelope. The
+# script checks that both give the same node set and reports the time
+# and peak (traced) memory of each path.
+#
+# Usage: python benchmarks/bench_lattice.py [radius]
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from ase.build import bulk, make_supercell
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyvaporate.build import (LATTICES, build_nodes, classify_points,
+                              supercell_dimensions)
+
+CASES = [
+    ("bcc", "W", [(0, 0, 1), (1, -1, 0), (1, 1, 0)]),
+    ("fcc", "Al", [(1, 0, 0), (0, 1, 0), (0, 0, 1)]),
+    ("fcc", "Al", [(1, -1, 0), (1, 1, -2), (1, 1, 1)]),
+    ("sc", "Po", [(1, 0, 0), (0, 1, 0), (0, 0, 1)]),
+    ("uc_file", "NiAl", None),
+]
+
+
+def node_set(coords, ids):
+    rounded = np.round(coords*1e16).astype(np.int64)  # 1e-6 Angstrom
+    return set(zip(*rounded.T, ids))
+
+
+def measure(function):
+    tracemalloc.start()
+    t = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter()-t
+    peak = tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main(radius):
+    side_height = radius/2
+    print("{:>8} {:>12} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9} {:>5}".format(
+        "basis", "z", "points", "nodes", "full (s)", "full (MB)",
+        "tiled (s)", "tiled (MB)", "same"))
+    for basis, element, directions in CASES:
+        if basis == "uc_file":
+            atoms = bulk("NiAl", "cesiumchloride", a=2.88, cubic=True)
+            atoms.positions += 0.3
+            ids = np.where(np.array(atoms.get_chemical_symbols()) == "Ni", 10, 20)
+            wrap, z = True, "-"
+        else:
+            atoms = LATTICES[basis](size=(1, 1, 1), directions=directions,
+                                    symbol=element)
+            ids, wrap = 10, False
+            z = "".join(str(d) for d in directions[2])
+        cell, positions = atoms.cell.array, atoms.get_positions()
+        size = supercell_dimensions(cell, positions, radius, side_height, 25)
+
+        def full():
+            if wrap:
+                pts = make_supercell(atoms, np.diag(size)).get_positions()
+                pt_ids = np.tile(ids, np.prod(size))
+            else:
+                pts = LATTICES[basis](size=size, directions=directions,
+                                      symbol=element).get_positions()
+                pt_ids = 10
+            return len(pts), classify_points(pts, radius, side_height, 25,
+                                             emitter_ids=pt_ids)
+
+        (n_points, reference), t_full, m_full = measure(full)
+        tiled, t_tiled, m_tiled = measure(lambda: build_nodes(
+            cell, positions, ids, radius, side_height, 25, wrap=wrap))
+        same = node_set(*reference) == node_set(*tiled)
+        print("{:>8} {:>12} {:10} {:10} {:9.3f} {:9.1f} {:9.3f} {:9.1f} {:>5}".format(
+            basis, z, n_points, len(tiled[1]), t_full, m_full, t_tiled,
+            m_tiled, str(same)))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 30.)
@@ -0,0 +1,79 @@
+# Benchmark for the incrementally updated neighbor list in
+# pyvaporate.neighbors. Builds the BCC tungsten emitters of
+# bench_surface.py, then runs evaporation steps the way call_lammps does:
+# `events` atoms at the apex are removed, the atoms within 10 Angstroms of
+# them move (relaxation), and the surface, the subdomain around the
+# evaporated sites and the coordination numbers are queried. Reports the
+# time of the initial build, the mean time of an incremental step, and the
+# time of recomputing the same from scratch (a new k-d tree).
+#
+# Usage: python benchmarks/bench_neighbors.py [n_atoms ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyvaporate.evaluate import CN_CUTOFF
+from pyvaporate.neighbors import NeighborList
+from pyvaporate.surface import surface_from_neighbors
+
+from bench_surface import bcc_emitter
+
+SIZES = [100000, 1000000]
+STEPS = 5
+EVENTS = 50
+RADIUS = 10.0
+
+
+def evaporation_step(neighbors, rng):
+    """
+    Remove EVENTS apex atoms, move the atoms around them and query the
+    neighbor list like a coupling step does.
+    """
+    alive = np.flatnonzero(neighbors.alive)
+    apex = alive[np.argpartition(neighbors.positions[alive, 2], -4*EVENTS)[-4*EVENTS:]]
+    sites = rng.choice(apex, EVENTS, replace=False)
+    neighbors.remove(sites)
+    region, _ = neighbors.within(sites, RADIUS)
+    # mostly small relaxation displacements, a few atoms hop
+    shift = rng.normal(0.0, 0.05, (len(region), 3))
+    shift[rng.random(len(region)) < 0.02] *= 10
+    neighbors.move(region, neighbors.positions[region] + shift)
+    neighbors.coordination(CN_CUTOFF)
+    surface = surface_from_neighbors(neighbors)
+    keep = neighbors.alive.copy()
+    neighbors.compact(keep)
+    return len(region), len(surface)
+
+
+def main(sizes):
+    print("{:>10} {:>9} {:>9} {:>9} {:>11}".format(
+        "atoms", "build (s)", "step (s)", "region", "scratch (s)"))
+    rng = np.random.default_rng(0)
+    for n_atoms in sizes:
+        positions, _ = bcc_emitter(n_atoms)
+        t = time.perf_counter()
+        neighbors = NeighborList(positions, cutoff=CN_CUTOFF)
+        t_build = time.perf_counter()-t
+        neighbors.coordination(CN_CUTOFF)
+        neighbors.coordination()
+
+        t = time.perf_counter()
+        for _ in range(STEPS):
+            n_region, _ = evaporation_step(neighbors, rng)
+        t_step = (time.perf_counter()-t)/STEPS
+
+        t = time.perf_counter()
+        scratch = NeighborList(neighbors.positions, cutoff=CN_CUTOFF)
+        scratch.coordination(CN_CUTOFF)
+        surface_from_neighbors(scratch)
+        t_scratch = time.perf_counter()-t
+        print("{:10d} {:9.2f} {:9.3f} {:9d} {:11.2f}".format(
+            len(positions), t_build, t_step, n_region, t_scratch))
+
+
+if __name__ == "__main__":
+    main([int(float(n)) for n in sys.argv[1:]] or SIZES)
@@ -0,0 +1,74 @@
+# Benchmark for the node file reader/writer in pyvaporate.nodes.
+# Writes and reads back a TAPSim node file of 1M and 10M random nodes,
+# once with pyvaporate.nodes and once with the per-line string code the
+# builders and pyvaporate.call used before ("\t".join(str(i) ...) to
+# write, readlines() and split() to read).
+#
+# Usage: python benchmarks/bench_nodes.py [n_nodes ...]
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyvaporate.nodes import make_nodes, read_node_file, write_node_file
+
+SIZES = [1000000, 10000000]
+
+
+def legacy_write(filename, pts):
+    with open(filename, "w") as e:
+        e.write("ASCII {} 0 0\n".format(len(pts)))
+        for pt in pts:
+            e.write("	".join([str(i) for i in pt]))
+            e.write("\n")
+        e.write("# 10=W\n")
+
+
+def legacy_read(filename):
+    lines = open(filename).readlines()
+    nodes = []
+    for line in lines[1:-1]:
+        sl = line.split()
+        nodes.append([float(sl[0]), float(sl[1]), float(sl[2]), sl[3], sl[4]])
+    return nodes
+
+
+def main(sizes):
+    print("{:>10} {:>14} {:>14} {:>14} {:>14} {:>10}".format(
+        "nodes", "old write (s)", "new write (s)", "old read (s)",
+        "new read (s)", "MB"))
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "mesh.txt")
+        for n in sizes:
+            coords = rng.random((n, 3))*1e-8
+            ids = rng.choice([0, 2, 10], n)
+            nodes = make_nodes(coords, ids, np.zeros(n, dtype=int))
+
+            pts = [[x, y, z, i, 0] for (x, y, z), i in
+                   zip(coords.tolist(), ids.tolist())]
+            t = time.perf_counter()
+            legacy_write(filename, pts)
+            t_old_write = time.perf_counter()-t
+            del pts
+            t = time.perf_counter()
+            legacy_read(filename)
+            t_old_read = time.perf_counter()-t
+
+            t = time.perf_counter()
+            write_node_file(filename, nodes, {"10": "W"})
+            t_new_write = time.perf_counter()-t
+            size = os.path.getsize(filename)/1e6
+            t = time.perf_counter()
+            read_node_file(filename)
+            t_new_read = time.perf_counter()-t
+            print("{:10} {:14.2f} {:14.2f} {:14.2f} {:14.2f} {:10.0f}".format(
+                n, t_old_write, t_new_write, t_old_read, t_new_read, size))
+
+
+if __name__ == "__main__":
+    main([int(float(n)) for n in sys.argv[1:]] or SIZES)
@@ -0,0 +1,114 @@
+# End-to-end benchmark of a pyvaporate run with the stand-in meshgen,
+# tapsim and lmp executables of benchmarks/fake (see fakes.py there),
+# which write correctly formatted output without doing any physics. Runs
+# `yaml_run` on tungsten emitters of the given radii (Angstroms) and
+# reports, from the run's telemetry, the mean wall time of a coupling
+# step, the part of it spent in the binaries (tapsim and lammps spans,
+# including their configured latency) and the rest: the Python glue
+# overhead per step, with the span that takes most of it.
+#
+# Usage: python benchmarks/bench_run.py [radius ...] [--steps=N]
+#            [--events=N] [--latency=SECONDS] [--max-glue=SECONDS] [--keep]
+#
+# With --max-glue, the exit status is 1 if the glue of any size exceeds
+# that many seconds per step, for use as a regression check in CI.
+
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyvaporate import SETUP
+from pyvaporate.run import yaml_run
+from pyvaporate.telemetry import read_spans
+
+FAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake")
+RADII = [20, 40, 60]
+STEPS = 5
+EVENTS = 20
+BINARIES = ["tapsim", "lammps"]
+
+
+def bench_setup(radius, steps, events):
+    """
+    Configuration of a run of `steps` steps of `events` events on a W
+    emitter of `radius` Angstroms, with the fake binaries.
+    """
+    setup = copy.deepcopy(SETUP)
+    setup["emitter"]["radius"] = radius
+    setup["emitter"]["side_height"] = radius/2
+    setup["emitter"]["seed"] = 0
+    setup["evaporation"].update(
+        meshgen_bin=os.path.join(FAKE, "meshgen"), tapsim_bin=os.path.join(FAKE, "tapsim"),
+        events_per_step=events, total_events=steps*events)
+    setup["lammps"]["bin"] = os.path.join(FAKE, "lmp")
+    setup["cleanup"] = True
+    return setup
+
+
+def glue(spans):
+    """
+    Mean wall time of the steps after step 0, of their binaries and of
+    the rest, and the span (other than the binaries) taking most of it.
+    """
+    steps = [s for s in spans if s["span"] == "step" and s["step"] != "0"]
+    binaries = [s for s in spans if s["span"] in BINARIES and s["step"] != "0"]
+    n = max(len(steps), 1)
+    step = sum(s["wall"] for s in steps)/n
+    binary = sum(s["wall"] for s in binaries)/n
+    others = {}
+    for s in spans:
+        if s["span"] not in BINARIES + ["step", "postprocess"] and s["step"] != "0":
+            others[s["span"]] = others.get(s["span"], 0.0) + s["wall"]
+    top = max(others, key=others.get) if others else "-"
+    return step, binary, step-binary, top, others.get(top, 0.0)/n
+
+
+def main(args):
+    options = dict(a[2:].split("=", 1) if "=" in a else (a[2:], "") for a in args
+                   if a.startswith("--"))
+    radii = [float(a) for a in args if not a.startswith("--")] or RADII
+    steps = int(options.get("steps", STEPS))
+    events = int(options.get("events", EVENTS))
+    max_glue = float(options["max-glue"]) if "max-glue" in options else None
+    if "latency" in options:
+        os.environ["PYVAPORATE_FAKE_LATENCY"] = options["latency"]
+
+    print("{:>7} {:>8} {:>6} {:>9} {:>9} {:>9} {:>10} {:>9}  {}".format(
+        "radius", "atoms", "steps", "total (s)", "step (s)", "bins (s)",
+        "glue (s)", "ms/katom", "top glue span (s)"))
+    failed = False
+    for radius in radii:
+        root = tempfile.mkdtemp(prefix="bench_run_")
+        try:
+            config = os.path.join(root, "setup.yaml")
+            with open(config, "w") as f:
+                yaml.safe_dump(bench_setup(radius, steps, events), f)
+            t = time.perf_counter()
+            yaml_run(config, os.path.join(root, "run"))
+            total = time.perf_counter()-t
+            with open(os.path.join(root, "run", "metrics.csv")) as f:
+                f.readline()
+                atoms = int(f.readline().split(",")[1])
+            step, binary, overhead, top, top_wall = glue(read_spans(os.path.join(root, "run")))
+            print("{:7.0f} {:8d} {:6d} {:9.2f} {:9.3f} {:9.3f} {:10.3f} {:9.2f}  {} {:.3f}".format(
+                radius, atoms, steps, total, step, binary, overhead,
+                1e6*overhead/max(atoms, 1), top, top_wall))
+            failed |= max_glue is not None and overhead > max_glue
+        finally:
+            if "keep" in options:
+                print("  kept {}".format(root))
+            else:
+                shutil.rmtree(root)
+    if failed:
+        print("Glue overhead above {} s per step".format(max_glue))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,74 @@
+# Benchmark for the coordinate-based surface detector in pyvaporate.surface.
+# Builds BCC tungsten emitters (a cylinder with a hemispherical cap, side
+# height = radius/2) of roughly 1e5, 1e6 and 1e7 atoms and times
+# `find_surface` on them, split into the cKDTree build and the query.
+# Also reports the number of surface atoms and how deep below the ideal
+# envelope the deepest one lies, as a sanity check.
+#
+# Usage: python benchmarks/bench_surface.py [n_atoms ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyvaporate.surface import find_surface
+
+SIZES = [100000, 1000000, 10000000]
+A = 3.165  # W lattice parameter, Angstroms
+DENSITY = 2/A**3
+
+
+def bcc_emitter(n_atoms):
+    """
+    BCC emitter of about `n_atoms` atoms and the depth of every atom
+    below the envelope.
+    """
+    # volume = pi R^3 (1/2 + 2/3) for side height R/2
+    radius = (n_atoms/DENSITY/(np.pi*(0.5+2/3)))**(1/3)
+    height = radius/2
+    n = int(np.ceil(radius/A))
+    grid = np.arange(-n, n+1)*A
+    zgrid = np.arange(0, int(np.ceil((height+radius)/A))+1)*A
+    chunks = []
+    for shift in (0.0, A/2):
+        x, y = np.meshgrid(grid+shift, grid+shift, indexing="ij")
+        x, y = x.ravel(), y.ravel()
+        r = np.hypot(x, y)
+        inside = r <= radius
+        x, y, r = x[inside], y[inside], r[inside]
+        for z in zgrid+shift:
+            keep = r <= (radius if z <= height else
+                         np.sqrt(max(radius**2-(z-height)**2, 0)))
+            if keep.any():
+                chunks.append(np.column_stack((x[keep], y[keep],
+                                               np.full(keep.sum(), z))))
+    positions = np.concatenate(chunks)
+    r = np.hypot(positions[:, 0], positions[:, 1])
+    z = positions[:, 2]
+    depth = np.where(z <= height, radius-r,
+                     radius-np.sqrt(r**2+(z-height)**2))
+    return positions, depth
+
+
+def main(sizes):
+    print("{:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+        "atoms", "surface", "tree (s)", "query (s)", "total (s)", "depth (A)"))
+    for n_atoms in sizes:
+        positions, depth = bcc_emitter(n_atoms)
+        t = time.perf_counter()
+        tree = cKDTree(positions)
+        t_tree = time.perf_counter()-t
+        t = time.perf_counter()
+        surface = find_surface(positions, tree=tree)
+        t_query = time.perf_counter()-t
+        print("{:10d} {:10d} {:9.2f} {:9.2f} {:9.2f} {:9.2f}".format(
+            len(positions), len(surface), t_tree, t_query, t_tree+t_query,
+            depth[surface].max()))
+
+
+if __name__ == "__main__":
+    main([int(float(n)) for n in sys.argv[1:]] or SIZES)
@@ -0,0 +1,117 @@
+# Check of the persistent in-process LAMMPS backend ("library", see
+# pyvaporate.md) against the lmp binary ("binary"), without LAMMPS: runs
+# the same short evaporation twice with the fake binaries of
+# benchmarks/fake, once with the fake lmp executable and once with the
+# fake LAMMPS Python module (benchmarks/fake/lammps.py), which keeps the
+# atoms by LAMMPS ID between steps. The emitters of every step must
+# agree, and the library must have read the emitter only once, i.e.
+# kept in step through the deletions by ID, the scatter/gather order and
+# the steps without relaxation (adaptive schedule).
+#
+# Usage: python benchmarks/check_library.py [radius] [--steps=N] [--events=N]
+#
+# The exit status is 1 if any configuration disagrees.
+
+import copy
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake")
+sys.path.insert(0, FAKE)  # the fake lammps module
+import lammps
+from bench_run import bench_setup
+from pyvaporate.run import yaml_run
+from pyvaporate.state import EmitterState
+
+RADIUS = 20
+STEPS = 6
+EVENTS = 20
+
+
+def configurations(radius, steps, events):
+    """
+    The setups to check, by name: relaxing every step, an adaptive
+    schedule that skips relaxations, and a coordination class 0 that
+    spans CN 0 to 2.
+    """
+    base = bench_setup(radius, steps, events)
+    base["cleanup"] = False
+    adaptive = copy.deepcopy(base)
+    adaptive["lammps"]["schedule"].update(adaptive=True, max_cn_drop=4,
+                                          max_events=3*events)
+    binned = copy.deepcopy(base)
+    binned["emitter"]["cn_bins"] = [0, 3, 6, 9]
+    binned["emitter"]["elements"]["W"]["e_fields"] = {0: 57e-9, 1: 27e-9, 2: 57e-9, 3: 87e-9}
+    return {"every step": base, "adaptive": adaptive, "cn_bins": binned}
+
+
+def run(setup, backend, root):
+    """
+    Run `setup` with the LAMMPS `backend` in `root`/`backend`. Returns
+    the run directory.
+    """
+    setup = copy.deepcopy(setup)
+    setup["lammps"]["backend"] = backend
+    config = os.path.join(root, backend + ".yaml")
+    with open(config, "w") as f:
+        yaml.safe_dump(setup, f)
+    directory = os.path.join(root, backend)
+    yaml_run(config, directory)
+    return directory
+
+
+def compare(binary, library, steps):
+    """
+    Largest position difference (Angstroms) between the relaxed
+    emitters of the two runs, and the steps whose atoms or IDs differ.
+    """
+    largest, wrong = 0.0, []
+    for step in range(steps+1):
+        a = EmitterState.from_file(os.path.join(binary, str(step), "relaxed_emitter.txt"))
+        b = EmitterState.from_file(os.path.join(library, str(step), "relaxed_emitter.txt"))
+        if len(a) != len(b) or not np.array_equal(a.ids, b.ids):
+            wrong.append(step)
+            continue
+        largest = max(largest, float(np.abs(a.positions-b.positions).max())*1e10)
+    return largest, wrong
+
+
+def main(args):
+    options = dict(a[2:].split("=", 1) if "=" in a else (a[2:], "") for a in args
+                   if a.startswith("--"))
+    radius = float(([a for a in args if not a.startswith("--")] or [RADIUS])[0])
+    steps = int(options.get("steps", STEPS))
+    events = int(options.get("events", EVENTS))
+
+    print("{:<12} {:>6} {:>8} {:>10} {:>8} {:>12}  {}".format(
+        "setup", "steps", "relaxed", "read_data", "deletes", "max dx (A)", "result"))
+    failed = False
+    for name, setup in configurations(radius, steps, events).items():
+        root = tempfile.mkdtemp(prefix="check_library_")
+        try:
+            binary = run(setup, "binary", root)
+            library = run(setup, "library", root)
+            commands = lammps.INSTANCES[-1].commands
+            relaxed = sum(c.startswith("minimize") for c in commands)
+            loads = sum(c.startswith("read_data") for c in commands)
+            deletes = sum(c.startswith("delete_atoms") for c in commands)
+            largest, wrong = compare(binary, library, steps)
+            ok = not wrong and largest < 1e-6 and loads == 1
+            print("{:<12} {:>6} {:>8} {:>10} {:>8} {:>12.1e}  {}".format(
+                name, steps, relaxed, loads, deletes, largest,
+                "ok" if ok else "FAILED" + (" at steps {}".format(wrong) if wrong else "")))
+            failed |= not ok
+        finally:
+            shutil.rmtree(root)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
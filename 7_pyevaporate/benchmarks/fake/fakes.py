@@ -0,0 +1,163 @@
+# Shared code of the stand-in meshgen, tapsim and lmp executables in this
+# directory, and of the stand-in LAMMPS Python module (lammps.py). They
+# read and write the files pyvaporate exchanges with the real binaries,
+# in the same formats, but do no physics, so that a whole run (python
+# benchmarks/bench_run.py) takes seconds on any machine.
+#
+# Their latency and the size of the bulk files they write are set with
+# environment variables, for all binaries or per binary (the name in
+# upper case, e.g. PYVAPORATE_FAKE_TAPSIM_LATENCY):
+#
+#     PYVAPORATE_FAKE_LATENCY           seconds every call sleeps (0)
+#     PYVAPORATE_FAKE_LATENCY_PER_ATOM  seconds it sleeps per atom (0)
+#     PYVAPORATE_FAKE_VACUUM_NODES      vacuum nodes meshgen adds (0)
+#     PYVAPORATE_FAKE_TRAJECTORY_KB     size of the trajectory_data file
+#                                       tapsim writes (0: none)
+#     PYVAPORATE_FAKE_LOG_KB            size of the log.lammps lmp writes (1)
+
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+PREFIX = "PYVAPORATE_FAKE_"
+
+
+def setting(binary, name, default=0.0):
+    """
+    The setting `name` of `binary` from the environment: the
+    PYVAPORATE_FAKE_<BINARY>_<NAME> variable, else
+    PYVAPORATE_FAKE_<NAME>, else `default`.
+    """
+    for variable in [PREFIX + binary.upper() + "_" + name, PREFIX + name]:
+        if os.environ.get(variable, "") != "":
+            return float(os.environ[variable])
+    return default
+
+
+def wait(binary, n_atoms):
+    """
+    Sleep for the configured latency of `binary` with `n_atoms` atoms.
+    """
+    seconds = setting(binary, "LATENCY") + setting(binary, "LATENCY_PER_ATOM")*n_atoms
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def option(args, name, default=None):
+    """
+    Value of the --`name`=value argument in `args`.
+    """
+    for arg in args:
+        if arg.startswith("--{}=".format(name)):
+            return arg.split("=", 1)[1]
+    return default
+
+
+def fail(message):
+    sys.stderr.write(message + "\n")
+    sys.exit(1)
+
+
+def read_nodes(filename):
+    """
+    Coordinates (meters) and IDs of the nodes of a TAPSim node file,
+    skipping its header and comments.
+    """
+    with open(filename) as f:
+        header = f.readline().split()
+        if not header or header[0] != "ASCII":
+            fail("{}: not an ASCII node file".format(filename))
+        table = np.loadtxt(f, comments="#", ndmin=2)
+    if table.size == 0:
+        return np.empty((0, 3)), np.empty(0, dtype=int)
+    return table[:, :3], table[:, 3].astype(int)
+
+
+def write_nodes(filename, coords, ids):
+    """
+    Write a TAPSim ASCII node file (tab separated x y z id).
+    """
+    with open(filename, "w") as f:
+        f.write("ASCII {} 0 0\n".format(len(ids)))
+        values = np.column_stack((coords, ids))
+        f.write(("%.9e\t%.9e\t%.9e\t%d\n"*len(ids)) % tuple(values.ravel().tolist()))
+
+
+def write_padding(filename, kilobytes, columns=9, seed=0):
+    """
+    Write about `kilobytes` of numeric rows with `columns` columns.
+    """
+    rows = int(kilobytes*1024/(columns*16))
+    if rows <= 0:
+        return
+    values = np.random.default_rng(seed).random((rows, columns))
+    with open(filename, "w") as f:
+        f.write(("\t".join(["%.8e"]*columns) + "\n")*rows % tuple(values.ravel().tolist()))
+
+
+def surface(coords, spacing=3.0):
+    """
+    Boolean mask of the topmost atoms of `coords` (Angstroms): the
+    highest one in each `spacing` wide column, and the ones less than
+    `spacing` below it.
+    """
+    if len(coords) == 0:
+        return np.zeros(0, dtype=bool)
+    cells = np.floor(coords[:, :2]/spacing).astype(np.int64)
+    _, column = np.unique(cells, axis=0, return_inverse=True)
+    column = column.ravel()
+    top = np.full(column.max()+1, -np.inf)
+    np.maximum.at(top, column, coords[:, 2])
+    return coords[:, 2] > top[column]-spacing
+
+
+def read_data(filename):
+    """
+    IDs, types and positions (Angstroms) of the Atoms section of a
+    LAMMPS data file, sorted by ID, and its box.
+    """
+    box = []
+    with open(filename) as f:
+        for line in f:
+            if line.split()[-2:] in (["xlo", "xhi"], ["ylo", "yhi"], ["zlo", "zhi"]):
+                box.append(line.split()[:2])
+            if line.strip() == "Atoms":
+                break
+        table = np.loadtxt(f, ndmin=2)
+    if table.size == 0:
+        table = np.empty((0, 5))
+    order = np.argsort(table[:, 0], kind="stable")
+    table = table[order]
+    return table[:, 0].astype(int), table[:, 1].astype(int), table[:, 2:5], box
+
+
+def read_ids(tokens):
+    """
+    The LAMMPS IDs of an ID list of a group command: "1:500 502 504:900".
+    """
+    ids = [np.arange(int(t.split(":")[0]), int(t.split(":")[-1])+1) for t in tokens]
+    return np.concatenate(ids) if ids else np.empty(0, dtype=int)
+
+
+def relax(positions, frozen):
+    """
+    "Relaxed" copy of `positions` (Angstroms): the atoms not in the mask
+    `frozen` moved by a small distance that only depends on where they
+    are, so it is the same whatever IDs and order LAMMPS gives them.
+    """
+    positions = positions.copy()
+    moving = np.flatnonzero(~frozen)
+    positions[moving] += 0.01*np.sin(positions[moving].sum(axis=1))[:, None]
+    return positions
+
+
+def coordination(positions, cutoff):
+    """
+    Number of neighbors of each atom within `cutoff` (coord/atom).
+    """
+    if len(positions) == 0:
+        return np.zeros(0, dtype=int)
+    return cKDTree(positions).query_ball_point(positions, cutoff, return_length=True) - 1
@@ -0,0 +1,103 @@
+# Stand-in for the LAMMPS Python module (see fakes.py), for the "library"
+# LAMMPS backend of pyvaporate (pyvaporate.md.LammpsLibrary):
+#
+#     from lammps import lammps    # with benchmarks/fake first on sys.path
+#
+# A `lammps` instance keeps the atoms in arrays indexed by their LAMMPS ID
+# (tag) and understands the commands LammpsLibrary sends: read_data,
+# group ... id, delete_atoms, fix/unfix of the frozen group and minimize,
+# which "relaxes" the atoms like the fake lmp binary. The other commands
+# are only recorded. Gathering or scattering an atom that was deleted, or
+# was never read, raises an error instead of returning stale values.
+
+import numpy as np
+
+from fakes import wait, read_data, read_ids, relax, coordination
+
+# every instance created, for checks that inspect their commands
+INSTANCES = []
+
+
+class lammps:
+
+    def __init__(self, cmdargs=None):
+        self.cmdargs = list(cmdargs or [])
+        self.commands = []
+        self.clear()
+        INSTANCES.append(self)
+
+    def clear(self):
+        self.x = np.zeros((1, 3))
+        self.type = np.zeros(1, dtype=int)
+        self.alive = np.zeros(1, dtype=bool)  # by tag; tag 0 is never used
+        self.cnum = np.zeros(1)
+        self.groups = {}
+        self.frozen = None
+        self.cutoff = 3.0
+
+    def command(self, line):
+        self.commands.append(line)
+        words = line.split()
+        if words[0] == "clear":
+            self.clear()
+        elif words[0] == "read_data":
+            tags, types, positions, _ = read_data(words[1])
+            size = tags.max()+1 if len(tags) else 1
+            self.clear()
+            self.x, self.type = np.zeros((size, 3)), np.zeros(size, dtype=int)
+            self.alive, self.cnum = np.zeros(size, dtype=bool), np.zeros(size)
+            self.x[tags], self.type[tags], self.alive[tags] = positions, types, True
+        elif words[0] == "group" and words[2] == "id":
+            self.groups[words[1]] = self.check(read_ids(words[3:]))
+        elif words[0] == "group" and words[2] == "delete":
+            if self.frozen == words[1]:
+                raise RuntimeError("Group {} is used by a fix".format(words[1]))
+            del self.groups[words[1]]
+        elif words[0] == "delete_atoms":
+            self.alive[self.groups[words[2]]] = False
+        elif words[0] == "fix" and words[3] == "setforce":
+            self.frozen = words[2]
+        elif words[0] == "unfix" and words[1] == "frozen":
+            self.frozen = None
+        elif words[0] == "compute" and "coord/atom" in words:
+            self.cutoff = float(words[words.index("cutoff")+1])
+        elif words[0] == "minimize":
+            self.minimize()
+
+    def check(self, tags):
+        """
+        `tags` (an array), after making sure all these atoms exist.
+        """
+        tags = np.asarray(tags, dtype=int)
+        known = (tags > 0) & (tags < len(self.alive))
+        known[known] = self.alive[tags[known]]
+        if not known.all():
+            raise RuntimeError("No atoms with IDs {}".format(tags[~known][:10]))
+        return tags
+
+    def minimize(self):
+        tags = np.flatnonzero(self.alive)
+        wait("lmp", len(tags))
+        frozen = np.zeros(len(tags), dtype=bool)
+        if self.frozen is not None:
+            frozen = np.isin(tags, self.groups[self.frozen])
+        self.x[tags] = relax(self.x[tags], frozen)
+        self.cnum[tags] = coordination(self.x[tags], self.cutoff)
+
+    def values(self, name):
+        return {"x": self.x, "type": self.type, "c_cnum": self.cnum}[name]
+
+    def gather_atoms_subset(self, name, dtype, count, n, ids):
+        tags = self.check(np.ctypeslib.as_array(ids)[:n])
+        return self.values(name)[tags].reshape(n*count)
+
+    def gather_subset(self, name, dtype, count, n, ids):
+        return self.gather_atoms_subset(name, dtype, count, n, ids)
+
+    def scatter_atoms_subset(self, name, dtype, count, n, ids, data):
+        tags = self.check(np.ctypeslib.as_array(ids)[:n])
+        values = np.ctypeslib.as_array(data)[:n*count]
+        self.values(name)[tags] = values.reshape((n, count) if count > 1 else n)
+
+    def close(self):
+        pass
@@ -29,7 +29,9 @@ SETUP = {
             "z": [1,1,0], "y": "auto", "x": "auto"
         },
         "radius": 100,
-        "side_height": 50
+        "side_height": 50,
+        "seed": "none",
+        "cn_bins": "none"
     },
     "evaporation": {
         "tapsim_bin": "~/bin/tapsim",
@@ -39,11 +41,31 @@ SETUP = {
     },
     "lammps": {
         "bin": "~/bin/lmp",
+        "backend": "binary",
         "read_file": "none",
         "potentials_location": "~/software/lammps/potentials/library.meam",
+        "subdomain": {
+            "radius": "none", "buffer": 6.0
+        },
+        "schedule": {
+            "adaptive": False, "min_events": 0, "max_events": "none",
+            "max_cn_drop": 2, "broken_bonds": "none", "apex_recession": "none"
+        },
         "minimize": {
             "surface_only": "true", "etol": 1e-8, "ftol": 1e-8,
             "maxiter": 1000, "maxeval": 1000, "temperature": 50
         }
+    },
+    "cache": {
+        "location": "none", "max_size_gb": 20
+    },
+    "retention": {
+        "keep_last": "none", "keep_every": "none"
+    },
+    "store": {
+        "format": "none", "file": "run.h5", "keyframe_every": 20, "compression": 4
+    },
+    "postprocess": {
+        "workers": 1, "max_pending": 2, "compress": False
     }
 }
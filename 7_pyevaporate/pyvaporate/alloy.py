@@ -0,0 +1,132 @@
+# This file is part of the PyVaporate package and handles the random
+# substitution of emitter atoms that turns a pure emitter into an alloy,
+# optionally with a target amount of chemical short-range order.
+
+from pyvaporate.neighbors import nearest_neighbor_distance
+
+from scipy.spatial import cKDTree
+
+import math
+import numpy as np
+
+
+def substitute_alloy(ids, alloy, host_id=10, seed=None):
+    """
+    Randomly substitute emitter nodes (ID `host_id`) with the solute
+    elements in `alloy` = {"element": concentration}. Solutes get the
+    IDs 20, 30, 40 etc. in the order they appear in `alloy`, and each
+    one replaces floor(concentration * number of emitter atoms) sites.
+
+    The sites are drawn from a single permutation of the emitter sites
+    made with a `numpy.random.Generator` seeded with `seed`, so the
+    same seed always gives the same alloy. `ids` is modified in place.
+    Returns {"element": ID} for the solutes.
+    """
+    rng = np.random.default_rng(seed)
+    sites = rng.permutation(np.flatnonzero(ids == host_id))
+    alloy_ids = {}
+    alloy_id = 20
+    start = 0
+    for elt in alloy:
+        n = math.floor(alloy[elt]*len(sites))
+        ids[sites[start:start+n]] = alloy_id
+        alloy_ids[elt] = alloy_id
+        start += n
+        alloy_id += 10
+    return alloy_ids
+
+
+def neighbor_bonds(positions, cutoff=None):
+    """
+    Return the (n_bonds, 2) array of index pairs of `positions`
+    (Angstroms) closer than `cutoff`. By default the cutoff sits between
+    the first and second neighbor shells: 1.07 times the typical
+    nearest-neighbor distance, which is below the second shell of both
+    BCC (1.15) and FCC (1.41) lattices.
+    """
+    tree = cKDTree(positions)
+    if cutoff is None:
+        cutoff = 1.07*nearest_neighbor_distance(tree, positions)
+    return tree.query_pairs(cutoff, output_type="ndarray")
+
+
+def warren_cowley(ids, bonds, a, b):
+    """
+    First-shell Warren-Cowley short-range-order parameter
+    alpha_AB = 1 - p(B|A) / c_B for the species IDs `a` and `b`, where
+    p(B|A) is the fraction of the neighbors of A atoms that are B, and
+    c_B the fraction of atoms (`ids`) that are B. alpha < 0 means
+    ordering (A-B bonds preferred), alpha > 0 clustering.
+    """
+    i, j = ids[bonds[:, 0]], ids[bonds[:, 1]]
+    n_ab = np.count_nonzero(((i == a) & (j == b)) | ((i == b) & (j == a)))
+    z_a = np.count_nonzero(i == a) + np.count_nonzero(j == a)
+    c_b = np.count_nonzero(ids == b)/len(ids)
+    if z_a == 0 or c_b == 0:
+        return 0.0
+    return 1 - n_ab/z_a/c_b
+
+
+def order_alloy(ids, bonds, a, b, target, seed=None, tolerance=0.005,
+                max_iterations=1000, max_stalls=20):
+    """
+    Swap A (ID `a`) and B (ID `b`) atoms in `ids` until the Warren-Cowley
+    parameter of the pair (see `warren_cowley`) is within `tolerance` of
+    `target`. Composition is unchanged. `bonds` is the neighbor list
+    from `neighbor_bonds`; `ids` is modified in place.
+
+    Every iteration draws a batch of disjoint A/B pairs, computes the
+    change in the number of A-B bonds each swap would cause from the
+    per-atom neighbor counts, and applies the useful swaps, largest
+    first, until the expected change covers the remaining gap. The batch
+    is reverted and halved if it overshoots, and the search stops after
+    `max_stalls` batches in a row without any useful swap (the target
+    may be out of reach). Returns the final alpha.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(ids)
+    rows = np.concatenate((bonds[:, 0], bonds[:, 1]))
+    cols = np.concatenate((bonds[:, 1], bonds[:, 0]))
+    degree = np.bincount(rows, minlength=n)
+    c_b = np.count_nonzero(ids == b)/n
+
+    alpha = warren_cowley(ids, bonds, a, b)
+    batch = max(1, np.count_nonzero(ids == b)//10)
+    stalls = 0
+    for _ in range(max_iterations):
+        if abs(alpha-target) <= tolerance or batch < 1:
+            break
+        a_sites, b_sites = np.flatnonzero(ids == a), np.flatnonzero(ids == b)
+        k = min(batch, len(a_sites), len(b_sites))
+        if k == 0:
+            break
+        i = rng.choice(a_sites, k, replace=False)
+        j = rng.choice(b_sites, k, replace=False)
+
+        n_a = np.bincount(rows, weights=ids[cols] == a, minlength=n)
+        n_b = np.bincount(rows, weights=ids[cols] == b, minlength=n)
+        delta = n_a[i] - n_b[i] + n_b[j] - n_a[j]
+
+        # bonds A-B needed to reach the target with the current A degrees
+        z_a = degree[ids == a].sum()
+        n_ab = (1-alpha)*z_a*c_b
+        needed = (1-target)*z_a*c_b - n_ab
+        useful = np.flatnonzero(delta*np.sign(needed) > 0)
+        if len(useful) == 0:
+            stalls += 1
+            if stalls == max_stalls:
+                break
+            continue
+        stalls = 0
+        useful = useful[np.argsort(-np.abs(delta[useful]))]
+        covered = np.cumsum(np.abs(delta[useful]))
+        useful = useful[:np.searchsorted(covered, abs(needed))+1]
+
+        ids[i[useful]], ids[j[useful]] = b, a
+        new_alpha = warren_cowley(ids, bonds, a, b)
+        if abs(new_alpha-target) >= abs(alpha-target):
+            ids[i[useful]], ids[j[useful]] = a, b
+            batch //= 2
+        else:
+            alpha = new_alpha
+    return alpha
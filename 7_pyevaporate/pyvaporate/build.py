@@ -3,12 +3,207 @@
 
 from ase.lattice.cubic import SimpleCubic, FaceCenteredCubic, BodyCenteredCubic
 # imports predefined cubic crystalstructures from ASE
-from ase.build import make_supercell # tool for expanding unit cells into larger supercells
 from ase.io import read as ase_read # library for reading atomic structure files like .xyz, .cif
+from ase.geometry import wrap_positions
+
+from pyvaporate.alloy import substitute_alloy, neighbor_bonds, order_alloy
+from pyvaporate.nodes import make_nodes, write_node_file
 
 import math
 import numpy as np
-from random import randint
+
+# region IDs used by TAPSim for the non-atom nodes
+VACUUM_ID = 0
+BOTTOM_ID = 2
+
+LATTICES = {
+    "bcc": BodyCenteredCubic, "fcc": FaceCenteredCubic, "sc": SimpleCubic
+}
+
+
+def classify_points(pts, emitter_radius, emitter_side_height, vacuum_radius,
+                    emitter_ids=10, center=None, min_z=None):
+    """
+    Sort lattice points (in Angstroms) into the bottom, emitter and
+    vacuum regions of a cylinder-plus-hemisphere emitter in a single
+    vectorized pass.
+
+    bottom -> z = 0 plane, ID = 2
+    emitter -> inside cylindrical emitter region, ID = `emitter_ids`
+               (a single ID or one ID per point, e.g. for alloys)
+    vacuum -> inside cylindrical vacuum region, ID = 0
+
+    The structure is centered horizontally and shifted so that the
+    bottom atoms rest at z = 0. `center` (x, y) and `min_z` default to
+    the mean position and lowest point of `pts`; pass them in when
+    `pts` is only one chunk of a larger lattice (see `tile_lattice`).
+
+    Points outside the vacuum envelope are dropped. Returns
+    `(coords, ids)`, where `coords` is an (n, 3) array in meters (TAPSim
+    convention) and `ids` an int16 array, ordered emitter points first,
+    then vacuum, then bottom.
+    """
+    pts = np.asarray(pts, dtype=float)
+    R = emitter_radius + vacuum_radius
+
+    if center is None:
+        cx, cy = np.mean(pts[:, 0]), np.mean(pts[:, 1])
+    else:
+        cx, cy = center
+    if min_z is None:
+        min_z = np.min(pts[:, 2])
+
+    x, y = pts[:, 0], pts[:, 1]
+    z = pts[:, 2] - min_z
+    r2 = (x-cx)**2 + (y-cy)**2
+    d2 = r2 + (z-emitter_side_height)**2
+    below_cap = z < emitter_side_height
+
+    bottom = (z < 1e-5) & (r2 < R**2)
+    emitter = ~bottom & (
+        (below_cap & (r2 < emitter_radius**2)) | (d2 < emitter_radius**2)
+    )
+    vacuum = ~bottom & ~emitter & ((below_cap & (r2 < R**2)) | (d2 < R**2))
+    z[bottom] = 0.0
+
+    coords = np.column_stack((x, y, z))*1e-10
+    emitter_ids = np.broadcast_to(
+        np.asarray(emitter_ids, dtype=np.int16), (len(pts),)
+    )
+    coords = np.concatenate(
+        (coords[emitter], coords[vacuum], coords[bottom])
+    )
+    ids = np.concatenate((
+        emitter_ids[emitter],
+        np.full(np.count_nonzero(vacuum), VACUUM_ID, dtype=np.int16),
+        np.full(np.count_nonzero(bottom), BOTTOM_ID, dtype=np.int16)
+    ))
+    return coords, ids
+
+
+def supercell_dimensions(cell, basis, emitter_radius, emitter_side_height,
+                         vacuum_radius):
+    """
+    Number of unit cell repetitions along each cell vector needed to
+    cover the (2R) x (2R) x (side_height + R) box around the emitter and
+    its vacuum cylinder. The spacing along each axis is taken from the
+    basis positions, falling back to the cell vector length for bases
+    with a single atom at the origin (e.g. simple cubic).
+    """
+    R = emitter_radius + vacuum_radius
+    extents = (2*R, 2*R, emitter_side_height+R)
+    spacings = np.max(basis, axis=0)
+    lengths = np.linalg.norm(cell, axis=1)
+    return tuple(
+        int(math.ceil(extent/(spacing if spacing > 1e-8 else length)))+1
+        for extent, spacing, length in zip(extents, spacings, lengths)
+    )
+
+
+def tile_lattice(cell, basis, size, emitter_radius, emitter_side_height,
+                 vacuum_radius, slab_layers=8):
+    """
+    Generate the points of a `size` supercell of (`cell`, `basis`) that
+    can fall inside the emitter or vacuum envelope, without building
+    the whole rectangular supercell.
+
+    Unit cell translations are produced `slab_layers` layers (along the
+    third cell vector) at a time, and any translation whose cell lies
+    entirely outside the envelope cylinder or above the hemispherical
+    cap is skipped, so peak memory is set by one slab. The supercell
+    center and lowest z are computed analytically, so each chunk can
+    be passed straight to `classify_points`.
+
+    Returns `(center, min_z, chunks)`, where `chunks` yields
+    `(pts, which)` pairs of positions (Angstroms) and the index of the
+    basis atom each point came from.
+    """
+    cell = np.asarray(cell, dtype=float)
+    basis = np.asarray(basis, dtype=float)
+    R = emitter_radius + vacuum_radius
+    n = np.asarray(size)
+
+    # mean and minimum over all points of the full supercell
+    center = basis.mean(axis=0) + ((n-1)/2.) @ cell
+    min_z = basis[:, 2].min() + np.minimum(0, (n-1)*cell[:, 2]).sum()
+
+    # bounding cylinder of the basis around its own center
+    basis_center = basis.mean(axis=0)
+    basis_radius = np.sqrt(
+        ((basis[:, :2]-basis_center[:2])**2).sum(axis=1)
+    ).max()
+    basis_min_z = basis[:, 2].min()
+    max_r = R + basis_radius + 1e-6
+
+    i, j = np.meshgrid(np.arange(n[0]), np.arange(n[1]), indexing="ij")
+    layer = i.ravel()[:, None]*cell[0] + j.ravel()[:, None]*cell[1]
+
+    def chunks():
+        for k0 in range(0, n[2], slab_layers):
+            k = np.arange(k0, min(k0+slab_layers, n[2]))
+            translations = (
+                layer[None, :, :] + k[:, None, None]*cell[2]
+            ).reshape(-1, 3)
+            r = np.hypot(
+                translations[:, 0]+basis_center[0]-center[0],
+                translations[:, 1]+basis_center[1]-center[1]
+            )
+            z = translations[:, 2]+basis_min_z-min_z
+            translations = translations[
+                (r < max_r) & (z < emitter_side_height+R)
+            ]
+            if len(translations) == 0:
+                continue
+            pts = (translations[:, None, :] + basis[None, :, :]).reshape(-1, 3)
+            which = np.tile(np.arange(len(basis)), len(translations))
+            yield pts, which
+
+    return center[:2], min_z, chunks()
+
+
+def build_nodes(cell, basis, basis_ids, emitter_radius, emitter_side_height,
+                vacuum_radius, wrap=False, slab_layers=8):
+    """
+    Tile a unit cell (`cell` vectors and `basis` positions in Angstroms)
+    over the emitter envelope and classify the resulting points. The
+    supercell size is the one the builders have always used (see
+    `supercell_dimensions`). `basis_ids` is the emitter ID of each basis
+    atom (or a single ID). If `wrap` is true, the basis is first wrapped
+    into the unit cell, as `ase.build.make_supercell` would do.
+
+    Returns `(coords, ids)` as described in `classify_points`.
+    """
+    basis = np.asarray(basis, dtype=float)
+    size = supercell_dimensions(
+        cell, basis, emitter_radius, emitter_side_height, vacuum_radius
+    )
+    if wrap:
+        basis = wrap_positions(basis, cell)
+    basis_ids = np.broadcast_to(
+        np.asarray(basis_ids, dtype=np.int16), (len(basis),)
+    )
+
+    center, min_z, chunks = tile_lattice(
+        cell, basis, size, emitter_radius, emitter_side_height,
+        vacuum_radius, slab_layers=slab_layers
+    )
+    regions = ([], [], [])  # emitter, vacuum, bottom
+    for pts, which in chunks:
+        coords, ids = classify_points(
+            pts, emitter_radius, emitter_side_height, vacuum_radius,
+            emitter_ids=basis_ids[which], center=center, min_z=min_z
+        )
+        n_emitter = np.count_nonzero(ids >= 10)
+        n_vacuum = np.count_nonzero(ids == VACUUM_ID)
+        bounds = (0, n_emitter, n_emitter+n_vacuum, len(ids))
+        for region, start, end in zip(regions, bounds[:-1], bounds[1:]):
+            region.append((coords[start:end], ids[start:end]))
+
+    chunks = [chunk for region in regions for chunk in region]
+    if not chunks:
+        return np.empty((0, 3)), np.empty(0, dtype=np.int16)
+    return (np.concatenate([c for c, _ in chunks]),
+            np.concatenate([i for _, i in chunks]))
 
 # Function to generate emitter file from scratch
 # "alloy" = {"element": concentration}
@@ -17,7 +212,7 @@ from random import randint
 def build_emitter_from_scratch(element, basis, z_axis, filename="emitter.txt",
                                x_axis="auto", y_axis="auto", emitter_radius=100,
                                emitter_side_height=50, vacuum_radius=25,
-                               alloy={}):
+                               alloy={}, seed=None, sro={}, log=print):
     """
     Build an emitter (set of nodes, TAPSim style) based on an
     element, basis, orientation, and dimensions.
@@ -25,6 +220,11 @@ def build_emitter_from_scratch(element, basis, z_axis, filename="emitter.txt",
     alloy = {"element": concentration}, where element = element symbol and 
                                         concentration = concentration of element in the alloy
                                         e.g {"Al": 0.5, "Ga": 0.5}
+    seed = seed for the random alloy substitution (same seed, same emitter)
+    sro = {"element": alpha}, target Warren-Cowley short-range-order parameter
+                              between the host `element` and an alloy element
+                              e.g {"Ga": -0.1}
+    log = function the reached Warren-Cowley parameters are reported to
     """
 
     IDS = {element: "10"}
@@ -38,148 +238,40 @@ def build_emitter_from_scratch(element, basis, z_axis, filename="emitter.txt",
             x_axis = tuple(np.cross(z_axis, (0, 1, 0)))
         y_axis = tuple(np.cross(z_axis, x_axis))
 
-    R = emitter_radius + vacuum_radius # total cylindrical radius
-
-    if basis.lower() == "bcc": # generate a cubic lattice based on the specified basis
-        lattice = BodyCenteredCubic(
-            size=(1, 1, 1), # a 1x1x1 unit cell is created first to calculate lattice spacings
-            directions=[x_axis, y_axis, z_axis],
-            symbol=element
-        )
-        pts = lattice.get_positions()
-        supercell_dimensions = ( # supercell expands to fully cover the emitter + vaccum cylinder
-            int(math.ceil((2*R)/max([pt[0] for pt in pts])))+1,
-            int(math.ceil((2*R)/max([pt[1] for pt in pts])))+1,
-            int(math.ceil((emitter_side_height+R)/max([pt[2] for pt in pts])))+1
-        )
-        lattice = BodyCenteredCubic( # final supercell
-            size=supercell_dimensions,
-            directions=[x_axis, y_axis, z_axis],
-            symbol=element
-        )
-    elif basis.lower() == "fcc":
-        lattice = FaceCenteredCubic(
-            size=(1, 1, 1),
-            directions=[x_axis, y_axis, z_axis],
-            symbol=element
-        )
-        pts = lattice.get_positions()
-        supercell_dimensions = (
-            int(math.ceil((2*R)/max([pt[0] for pt in pts])))+1,
-            int(math.ceil((2*R)/max([pt[1] for pt in pts])))+1,
-            int(math.ceil((emitter_side_height+R)/max([pt[2] for pt in pts])))+1
-        )
-        lattice = FaceCenteredCubic(
-            size=supercell_dimensions,
-            directions=[x_axis, y_axis, z_axis],
-            symbol=element
-        )
-    elif basis.lower() == "sc":
-        lattice = SimpleCubic(
-            size=(1, 1, 1),
-            directions=[x_axis, y_axis, z_axis],
-            symbol=element
-        )
-        pts = lattice.get_positions()
-        supercell_dimensions = (
-            int(math.ceil((2*R)/max([pt[0] for pt in pts])))+1,
-            int(math.ceil((2*R)/max([pt[1] for pt in pts])))+1,
-            int(math.ceil((emitter_side_height+R)/max([pt[2] for pt in pts])))+1
-        )
-        lattice = SimpleCubic(
-            size=supercell_dimensions,
-            directions=[x_axis, y_axis, z_axis],
-            symbol=element
-        )
-
-    pts = lattice.get_positions()
-    
-    # center point calculation
-    """
-    finds the central horizontal coordinates and the lowest z-position to shift the structure
-    such that the bottom atoms rest at z = 0
-    """
-    cx = np.mean([pt[0] for pt in pts])
-    cy = np.mean([pt[1] for pt in pts])
-    min_z = min([pt[2] for pt in pts])
-
-    # classification of points into emitter, vacuum, and bottom regions
-    """
-    bottom -> z = 0 plane, ID = 2
-    emitter -> inside cylindrical emitter region, ID = 10 (default) or can vary for alloys
-    vaccum -> inside cylindrical vacuum region, ID = 0
-    all the positions are converted to meters (1e-10) to match TAPSim conventions.
-    """
-    emitter_points, vacuum_points, bottom_points = [], [], []
-    number = 0
-    for pt in pts:
-        pt = [pt[0], pt[1], pt[2]-min_z]
-        if (pt[2] < 1e-5 and (pt[0]-cx)**2+(pt[1]-cy)**2<R**2):
-            pt = [pt[0], pt[1], 0.0]
-            pt = [i*1e-10 for i in pt]
-            pt.append(2)  # bottom ID
-            number += 1
-            bottom_points.append(pt)
-        elif (pt[2]<emitter_side_height and (pt[0]-cx)**2+(pt[1]-cy)**2\
-                <emitter_radius**2):
-            pt = [i*1e-10 for i in pt]
-            pt.append(IDS[element])  # emitter ID
-            number += 1
-            emitter_points.append(pt)
-        elif (pt[0]-cx)**2+(pt[1]-cy)**2+(pt[2]-emitter_side_height)**2\
-                <emitter_radius**2:
-            pt = [i*1e-10 for i in pt]
-            pt.append(IDS[element])  # emitter ID
-            number += 1
-            emitter_points.append(pt)
-        elif (pt[2]<emitter_side_height and (pt[0]-cx)**2+(pt[1]-cy)**2<R**2):
-            pt = [i*1e-10 for i in pt]
-            pt.append(0)  # vacuum ID
-            number += 1
-            vacuum_points.append(pt)
-        elif (pt[0]-cx)**2+(pt[1]-cy)**2+(pt[2]-emitter_side_height)**2<R**2:
-            pt = [i*1e-10 for i in pt]
-            pt.append(0)  # vacuum ID
-            number += 1
-            vacuum_points.append(pt)
+    lattice = LATTICES[basis.lower()](
+        size=(1, 1, 1), # a 1x1x1 unit cell is created first to calculate lattice spacings
+        directions=[x_axis, y_axis, z_axis],
+        symbol=element
+    )
+    coords, ids = build_nodes(
+        lattice.cell.array, lattice.get_positions(), int(IDS[element]),
+        emitter_radius, emitter_side_height, vacuum_radius
+    )
 
     # alloy substitution
     """
     randomly substitutes some emitter atoms to form an alloy
     alloy elements get unique IDs = 20, 30, 40 etc.
+    an optional Warren-Cowley target (`sro`) per alloy element is then
+    reached by swapping host and solute atoms between neighbor sites
     """
-    alloy_id = 20
-    all_substitution_indices = []
-    for elt in alloy:
-        substitution_indices = []
-        conc = alloy[elt]
-        num_atoms = len(emitter_points)
-        num_substitution_atoms = math.floor(conc*num_atoms)
-        j = 0
-        while j < num_substitution_atoms:
-            x = randint(0, num_atoms-1)
-            if x not in all_substitution_indices:
-                substitution_indices.append(x)
-                all_substitution_indices.append(x)
-                j += 1
-        for i in substitution_indices:
-            emitter_points[i][3] = alloy_id
-        IDS[elt] = str(alloy_id)
-        alloy_id += 10
-
-    # writing outputfile
-    with open(filename, "w") as e:
-        n_nodes = number
-        e.write("ASCII {} 0 0\n".format(n_nodes))
-        for pt in emitter_points + vacuum_points + bottom_points:
-                # It's required that the coordinates be
-                # separated by a tab character (^I), not
-                # by regular spaces.
-                e.write("	".join([str(i) for i in pt]))
-                e.write("\n")
-        comment = ["#"]
-        comment += [" {}={}".format(IDS[elt], elt) for elt in IDS]
-        e.write("{}\n".format(" ".join(comment)))
+    alloy_ids = substitute_alloy(ids, alloy, host_id=int(IDS[element]),
+                                 seed=seed)
+    for elt in alloy_ids:
+        IDS[elt] = str(alloy_ids[elt])
+    if sro:
+        sites = np.flatnonzero(ids >= 10)
+        emitter_ids = ids[sites]
+        bonds = neighbor_bonds(coords[sites]*1e10)
+        for elt in sro:
+            alpha = order_alloy(emitter_ids, bonds, int(IDS[element]),
+                                alloy_ids[elt], sro[elt], seed=seed)
+            log("Warren-Cowley alpha {}-{}: {:.4f} (target {})".format(
+                element, elt, alpha, sro[elt]))
+        ids[sites] = emitter_ids
+
+    write_node_file(filename, make_nodes(coords, ids),
+                    {IDS[elt]: elt for elt in IDS})
 
 
 def build_emitter_from_file(uc_file, filename="emitter.txt", z_axis=(0,0,1),
@@ -198,73 +290,22 @@ def build_emitter_from_file(uc_file, filename="emitter.txt", z_axis=(0,0,1),
             x_axis = tuple(np.cross(z_axis, (0, 1, 0)))
         y_axis = tuple(np.cross(z_axis, x_axis))
 
-    R = emitter_radius + vacuum_radius
-
     atoms = ase_read(uc_file)
-    pts = atoms.get_positions()
 
     IDS = {}
     elt_id = 10
-    for e in set(atoms.get_chemical_symbols()):
+    for e in dict.fromkeys(atoms.get_chemical_symbols()):  # in order of appearance
         IDS[e] = str(elt_id)
         elt_id += 10
 
-    supercell_dimensions = (
-        (int(math.ceil((2*R)/max([pt[0] for pt in pts])))+1, 0, 0),
-        (0, int(math.ceil((2*R)/max([pt[1] for pt in pts])))+1, 0),
-        (0, 0, int(math.ceil((emitter_side_height+R)/max([pt[2] for pt in pts])))+1)
+    basis_ids = np.array(
+        [IDS[s] for s in atoms.get_chemical_symbols()], dtype=np.int16
+    )
+    coords, ids = build_nodes(
+        atoms.cell.array, atoms.get_positions(), basis_ids,
+        emitter_radius, emitter_side_height, vacuum_radius,
+        wrap=True
     )
 
-    atoms = make_supercell(atoms, supercell_dimensions)
-    pts = atoms.get_positions()
-
-    cx = np.mean([pt[0] for pt in pts])
-    cy = np.mean([pt[1] for pt in pts])
-    min_z = min([pt[2] for pt in pts])
-
-    emitter_points, vacuum_points, bottom_points = [], [], []
-    number = 0
-    for atom in atoms:
-        pt = atom.position
-        pt = [pt[0], pt[1], pt[2]-min_z]
-        if (pt[2] < 1e-5 and (pt[0]-cx)**2+(pt[1]-cy)**2<R**2):
-            pt = [pt[0], pt[1], 0.0]
-            pt = [i*1e-10 for i in pt]
-            pt.append(2)  # bottom ID
-            number += 1
-            bottom_points.append(pt)
-        elif (pt[2]<emitter_side_height and (pt[0]-cx)**2+(pt[1]-cy)**2\
-                <emitter_radius**2):
-            pt = [i*1e-10 for i in pt]
-            pt.append(IDS[atom.symbol])  # emitter ID
-            number += 1
-            emitter_points.append(pt)
-        elif (pt[0]-cx)**2+(pt[1]-cy)**2+(pt[2]-emitter_side_height)**2\
-                <emitter_radius**2:
-            pt = [i*1e-10 for i in pt]
-            pt.append(IDS[atom.symbol])  # emitter ID
-            number += 1
-            emitter_points.append(pt)
-        elif (pt[2]<emitter_side_height and (pt[0]-cx)**2+(pt[1]-cy)**2<R**2):
-            pt = [i*1e-10 for i in pt]
-            pt.append(0)  # vacuum ID
-            number += 1
-            vacuum_points.append(pt)
-        elif (pt[0]-cx)**2+(pt[1]-cy)**2+(pt[2]-emitter_side_height)**2<R**2:
-            pt = [i*1e-10 for i in pt]
-            pt.append(0)  # vacuum ID
-            number += 1
-            vacuum_points.append(pt)
-
-    with open(filename, "w") as e:
-        n_nodes = number
-        e.write("ASCII {} 0 0\n".format(n_nodes))
-        for pt in emitter_points + vacuum_points + bottom_points:
-                # It's required that the coordinates be
-                # separated by a tab character (^I), not
-                # by regular spaces.
-                e.write("	".join([str(i) for i in pt]))
-                e.write("\n")
-        comment = ["#"]
-        comment += [" {}={}".format(IDS[elt], elt) for elt in IDS]
-        e.write("{}\n".format(" ".join(comment)))
+    write_node_file(filename, make_nodes(coords, ids),
+                    {IDS[elt]: elt for elt in IDS})
@@ -0,0 +1,176 @@
+# This file is part of the PyVaporate package and keeps a local,
+# content-addressed cache of built emitters and meshgen output, so that
+# runs which only differ in evaporation or LAMMPS settings can skip the
+# emitter build and meshgen.
+
+from pyvaporate.call import executable
+from pyvaporate.files import link_or_copy
+from pyvaporate.mgn import mgn_ini_lines
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# files of the "0" directory stored per cache entry
+CACHED_FILES = ["emitter.txt", "mesh.txt", "mesh_template.cfg"]
+# version of the emitter builders' output; bump it whenever build.py,
+# alloy.py or the node file writer change the files they write, so that
+# entries of the old builders are no longer hit. 2: coordinates written
+# with pyvaporate.nodes.COORDINATE_FORMAT instead of their full repr
+BUILDER_VERSION = 2
+
+
+def file_digest(filename):
+    """
+    sha256 hex digest of the contents of `filename`.
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def binary_digest(path):
+    """
+    sha256 digest of the contents of the binary `path` (looked up on
+    the PATH if it is a bare command name), or of its name if it cannot
+    be read.
+    """
+    filename = executable(path)
+    if os.path.isfile(filename):
+        return file_digest(filename)
+    return hashlib.sha256(path.encode()).hexdigest()
+
+
+def cache_key(setup):
+    """
+    Hash of everything the emitter build and meshgen depend on:
+    elements and alloy composition, basis, orientation, radius,
+    side_height, seed, cn_bins (which set the IDs in the mesh.txt
+    comment), the contents of any source node_file/uc_file, the
+    contents of the meshgen binary, `mgn_ini_lines` and
+    `BUILDER_VERSION`. Evaporation fields, masses, charges and LAMMPS
+    settings only enter mesh.cfg, which is always rewritten, and so are
+    not part of the key.
+    """
+    emitter = setup["emitter"]
+    source = {}
+    for kind in ["node_file", "uc_file"]:
+        path = emitter["source"][kind]
+        source[kind] = "none" if path == "none" else file_digest(
+            os.path.expanduser(path)
+        )
+    inputs = {
+        "elements": [
+            [e, emitter["elements"][e].get("fract_occ"),
+             "none" if emitter["elements"][e].get("sro") is None
+             else emitter["elements"][e]["sro"]]
+            for e in emitter["elements"]
+        ],
+        "basis": emitter["basis"],
+        "orientation": emitter["orientation"],
+        "radius": emitter["radius"],
+        "side_height": emitter["side_height"],
+        "seed": "none" if emitter.get("seed") is None else emitter["seed"],
+        "cn_bins": emitter.get("cn_bins", "none"),
+        "source": source,
+        "meshgen_bin": binary_digest(setup["evaporation"]["meshgen_bin"]),
+        "meshgen_ini": mgn_ini_lines,
+        "builder_version": BUILDER_VERSION,
+    }
+    serialized = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+class EmitterCache:
+    """
+    Directory of cache entries, one subdirectory per cache key holding
+    the files in `CACHED_FILES`. Entries are hardlinked into the run
+    directory on a hit and are read-only, so they must never be written
+    to in place. The modification time of an entry records its last
+    use; when the cache grows beyond `max_size_gb`, the least recently
+    used entries are deleted.
+    """
+
+    def __init__(self, location, max_size_gb=20):
+        self.location = os.path.abspath(os.path.expanduser(location))
+        self.max_size = max_size_gb*1e9
+        os.makedirs(self.location, exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.location, key)
+
+    def restore(self, key, directory="."):
+        """
+        Hardlink the files of entry `key` into `directory`. Returns
+        False on a cache miss.
+        """
+        entry = self.entry(key)
+        if not all(os.path.isfile(os.path.join(entry, f)) for f in CACHED_FILES):
+            return False
+        for f in CACHED_FILES:
+            link_or_copy(os.path.join(entry, f), os.path.join(directory, f))
+        os.utime(entry)
+        return True
+
+    def store(self, key, directory="."):
+        """
+        Copy the `CACHED_FILES` of `directory` into entry `key`, then
+        evict old entries if the cache is over its size limit.
+        """
+        if os.path.isdir(self.entry(key)):
+            return
+        tmp = tempfile.mkdtemp(dir=self.location, prefix=".tmp-")
+        for f in CACHED_FILES:
+            shutil.copyfile(os.path.join(directory, f), os.path.join(tmp, f))
+            os.chmod(os.path.join(tmp, f), 0o444)
+        try:
+            os.rename(tmp, self.entry(key))
+        except OSError:  # stored concurrently by another run
+            shutil.rmtree(tmp)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used entries (never `keep`) until the
+        cache fits in its size limit.
+        """
+        entries = []
+        for d in os.scandir(self.location):
+            if d.is_dir() and not d.name.startswith("."):
+                size = sum(f.stat().st_size for f in os.scandir(d.path))
+                entries.append((d.stat().st_mtime, size, d.path, d.name))
+        total = sum(e[1] for e in entries)
+        for _, size, path, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            if name != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+
+def detach(directory="."):
+    """
+    Remove the `CACHED_FILES` from `directory`. They may be hardlinks
+    into the cache from an earlier run (even one with the cache since
+    disabled), and rebuilding them in place would write through into
+    the cache entry.
+    """
+    for f in CACHED_FILES:
+        path = os.path.join(directory, f)
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+def emitter_cache(setup):
+    """
+    The `EmitterCache` configured in the "cache" section of `setup`,
+    or None if caching is disabled (location: none).
+    """
+    config = setup.get("cache", {})
+    if config.get("location", "none") == "none":
+        return None
+    return EmitterCache(config["location"], config.get("max_size_gb", 20))
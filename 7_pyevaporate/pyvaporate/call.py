@@ -7,106 +7,158 @@ Here's the typical workflow of the script:
 - convert data between TAPSim and LAMMPS formats
 """
 import subprocess
+import shutil
+import threading
 import os
 
-from pyvaporate.evaluate import assign_ids_by_cn
+import numpy as np
+
+from pyvaporate.evaluate import (assign_ids_by_cn, cn_bins, class_fields, id_stride,
+                                 CN_CUTOFF)
+from pyvaporate.mesh import MeshUpdater
 from pyvaporate.mgn import mgn_ini_lines, mesh_cfg_lines
+from pyvaporate.neighbors import NeighborList
+from pyvaporate.nodes import parse_table, format_nodes, write_node_file
+from pyvaporate.state import EmitterState
+from pyvaporate.subdomain import local_subdomain, merge_subdomain
+from pyvaporate.surface import find_surface, surface_from_neighbors
+from pyvaporate.tapsim import binary_output
+from pyvaporate.telemetry import span
 
 from monty.serialization import loadfn
 
+# vacuum nodes of the original meshes (see `vacuum_block`)
+VACUUM_BLOCKS = {}
+VACUUM_CACHE_SIZE = 8
+VACUUM_LOCK = threading.Lock()
+
+
+def in_directory(directory, filename):
+    """
+    Absolute path of `filename` in `directory`.
+    """
+    return os.path.abspath(os.path.join(directory, os.path.expanduser(filename)))
+
+
+def executable(path):
+    """
+    Absolute path of the binary `path`, looked up on the PATH if it is
+    a bare command name.
+    """
+    path = os.path.expanduser(path)
+    if os.sep not in path:
+        return shutil.which(path) or path
+    return os.path.abspath(path)
 
-def call_meshgen(setup, node_file):
+
+def call_meshgen(setup, node_file, directory="."):
     """
     1. Run the `meshgen` script (part of TAPSim) to generate a mesh file from the node file.
     2. Writes the meshgen.ini (default configuration to avoid interactive prompts)
     3. Adds a comment to `mesh.txt` listing element IDs and their corresponding names.
-    4. Writes the `mesh.cfg` file with the evaporaton properties.
+    4. Writes the `mesh.cfg` file with the evaporaton properties (meshgen's own
+       template is kept as `mesh_template.cfg`).
+    All files are in `directory`, which meshgen runs in.
     """
-    write_meshgen_ini()
+    write_meshgen_ini(directory)
 
     _ = subprocess.check_output(
-        [setup["evaporation"]["meshgen_bin"], node_file, "mesh.txt",
-         "--create-config-template=mesh.cfg", "--write-ascii"]
+        [executable(setup["evaporation"]["meshgen_bin"]),
+         in_directory(directory, node_file), in_directory(directory, "mesh.txt"),
+         "--create-config-template={}".format(
+             in_directory(directory, "mesh_template.cfg")),
+         "--write-ascii"], cwd=directory
     )
-    with open("mesh.txt", "a") as m:
+    with open(in_directory(directory, "mesh.txt"), "a") as m:
         comment = "#"
         for ID in setup["id_dict"]:
             comment += " {}={}".format(ID, setup["id_dict"][ID])
         m.write(comment)
 
-    write_mesh_cfg(setup)
+    write_mesh_cfg(setup, directory)
 
-def call_tapsim(setup):
+def call_tapsim(setup, state=None, directory=".", telemetry=None):
     """
     Run the TAPSim program, starting with building a voronoi mesh for
     an emitter (node) file and then running a set number of
     evaporation steps before stopping.
-    """
-
-    _ = subprocess.check_output(
-        [setup["evaporation"]["tapsim_bin"], "evaporation", "mesh.cfg", "mesh.txt",
-         "--event-limit={}".format(setup["evaporation"]["events_per_step"]), "--write-ascii"]
-    )
-    update_mesh()
 
+    TAPSim writes its output as text (--write-ascii), unless
+    `binary_output` is set in the evaporation section together with a
+    confirmed `binary_layout` (see `pyvaporate.tapsim.binary_output`);
+    the results are read in either form.
+
+    If the `EmitterState` of `mesh.txt` is passed in, the evaporated
+    atoms are marked in it in memory; otherwise `updated_mesh.txt` is
+    written. TAPSim runs in `directory`, which holds its input and
+    output files. The TAPSim run and the mesh update are recorded as
+    spans of `telemetry` (see `pyvaporate.telemetry`).
+    Returns the `MeshUpdater`.
+    """
 
-def update_mesh():
+    command = [executable(setup["evaporation"]["tapsim_bin"]), "evaporation",
+               in_directory(directory, "mesh.cfg"), in_directory(directory, "mesh.txt"),
+               "--event-limit={}".format(setup["evaporation"]["events_per_step"])]
+    if not binary_output(setup):
+        command.append("--write-ascii")
+    with span(telemetry, "tapsim", directory, ["mesh.txt"]):
+        _ = subprocess.check_output(command, cwd=directory)
+    with span(telemetry, "update_mesh", directory):
+        if state is None:
+            return update_mesh(directory=directory)
+        updater = MeshUpdater(state)
+        updater.update(directory)
+    return updater
+
+
+def update_mesh(updater=None, directory="."):
     """
     Remove evaporated nodes from the TAPSim mesh.
-    1. reads the `mesh.txt` (the current state of the emitter)
-    2. scans the results_data files (TAPSim output), which lists the evaporated atoms
-    3. updates the `mesh.txt` to mark evaporated atoms by setting their type to 0.
+    1. reads the `mesh.txt` (the current state of the emitter), unless
+       an existing `MeshUpdater` for it is passed in
+    2. scans the results_data files (TAPSim output), which lists the evaporated atoms,
+       skipping the ones already applied by `updater`
+    3. updates the mesh to mark evaporated atoms by setting their type to 0.
     4. writes an `updated_mesh.txt` file.
+    Returns the `MeshUpdater`, so repeated calls in the same directory
+    only parse new results. Files are in `directory`.
     """
-    emitter_lines = open("mesh.txt").readlines()
-    results_files = [f for f in os.listdir(os.getcwd()) if "results_data" in f]
-    remove_ids = []
-    for f in results_files:
-        results_lines = open(f).readlines()
-        results_lines = results_lines[results_lines.index("ASCII\n")+1:]
-        remove_ids += [line.split()[2] for line in results_lines]
-    new_emitter_lines = []
-    i = 1
-    for line in emitter_lines[1:-1]:
-        sl = line.split()
-        if str(i) in remove_ids:
-            sl = [sl[0], sl[1], sl[2], "0", "0"]
-        new_line = "{}\n".format("	".join(sl))
-        new_emitter_lines.append(new_line)
-        i += 1
-    with open("updated_mesh.txt", "w") as ue:
-        ue.write(emitter_lines[0])
-        for line in new_emitter_lines:
-            ue.write(line)
-        ue.write(emitter_lines[-1])
-
-
-def write_meshgen_ini():
+    if updater is None:
+        updater = MeshUpdater(in_directory(directory, "mesh.txt"))
+    updater.update(directory)
+    updater.write(in_directory(directory, "updated_mesh.txt"))
+    return updater
+
+
+def write_meshgen_ini(directory="."):
     """
     Write the default meshgen.ini file so that
     meshgen doesn't ask for it mid-run and
     interrupt the python process.
     """
-    with open("meshgen.ini", "w") as mgn:
+    with open(in_directory(directory, "meshgen.ini"), "w") as mgn:
         for line in mgn_ini_lines:
             mgn.write(line)
 
 
-def write_mesh_cfg(setup):
+def write_mesh_cfg(setup, directory="."):
     """
     Writes a `mesh.cfg` file describing the physical 
     and evaporation properties for each element type.
     This is what TAPSim uses to determine how atoms evaporate.
+    Every coordination class gets an ID, with the field of its e_fields
+    key or of the nearest lower one (see `pyvaporate.evaluate.class_fields`).
     """
-    with open("mesh.cfg", "w") as cfg:
+    n_classes = len(cn_bins(setup))
+    with open(in_directory(directory, "mesh.cfg"), "w") as cfg:
         for line in mesh_cfg_lines:
             cfg.write(line)
         for elt in setup["emitter"]["elements"]:
             charge = setup["emitter"]["elements"][elt]["charge"]
             mass = setup["emitter"]["elements"][elt]["mass"]
-            for e_field in setup["emitter"]["elements"][elt]["e_fields"]:
+            fields = class_fields(setup["emitter"]["elements"][elt]["e_fields"], n_classes)
+            for e_field, f in enumerate(fields):
                 cfg.write("\n")
-                f = setup["emitter"]["elements"][elt]["e_fields"][e_field]
                 base_id = [
                     i for i in setup["id_dict"] if setup["id_dict"][i] == elt
                 ][0]
@@ -125,41 +177,166 @@ def write_mesh_cfg(setup):
                 cfg.write("EVAPORATION_ACTIVATION_ENERGY = 1.00000e+00\n")
 
 
-def call_lammps(n_nodes, setup):
+def call_lammps(n_nodes, setup, state=None, md=None, directory=".", log=print,
+                relax=True, telemetry=None):
     """
     Convert a TAPSim emitter node file to a LAMMPS
     structure (Only the actual atoms, not the vacuum nodes,
     etc) and then make a call to LAMMPS to relax it.
     1. prepares the emitter (after evaporation) for LAMMPS relaxation
-    2. converts the `updated_mesh.txt` to a LAMMPS data file
+    2. converts the `EmitterState` (by default read from `updated_mesh.txt`)
+       to a LAMMPS data file
     3. runs LAMMPS to relax the structure
     4. re-assigns coordination numbers to atoms after relaxation
-    5. converts the relaxed LAMMPS structure back to a TAPSim emitter node file
-    6. adds the vacuum nodes back to the emitter node file
+    5. converts the relaxed LAMMPS structure back to a TAPSim emitter
+    6. adds the vacuum nodes back to the emitter and writes `relaxed_emitter.txt`
+    Returns the `EmitterState` of the relaxed emitter.
+
+    Steps 2 and 3 run the `lmp` binary, unless a persistent in-process
+    LAMMPS (`md`, see `pyvaporate.md.lammps_backend`) is given. If a
+    subdomain radius is set in the lammps section, only the atoms around
+    the sites evaporated in `state` are relaxed (see
+    `pyvaporate.subdomain.local_subdomain`) and merged back. If `state`
+    carries a `NeighborList`, it is used for the surface, the subdomain
+    and the coordination numbers, updated around the atoms that moved
+    and handed on to the returned state. The returned state also
+    records the `parents` of its atoms.
+
+    Without `relax` (see `pyvaporate.schedule.RelaxationScheduler`),
+    LAMMPS is not called: the evaporated atoms are only taken out (also
+    of `md`) and the coordination numbers, and so the IDs, of the
+    others updated.
+
+    All files are read and written in `directory` (the step directory;
+    the original mesh is taken from ../0), progress messages go to
+    `log` and the phases are recorded as spans of `telemetry`.
     """
 
-    convert_emitter_to_lammps(find_surface_atoms(), setup)
-    write_lammps_input_file(setup)
-
-    _ = subprocess.check_output([setup["lammps"]["bin"], "-l", "log.lammps",
-                                 "-i", "in.emitter_relax"])
-    assign_ids_by_cn("relaxed_emitter.lmp")
-    convert_lammps_to_emitter(n_nodes)
-    add_original_vacuum_nodes()
+    if state is None:
+        state = EmitterState.from_file(in_directory(directory, "updated_mesh.txt"))
+    bins = cn_bins(setup)
+    stride = id_stride(bins)
+    neighbors = state.neighbors
+    nodes = np.flatnonzero(state.atoms | state.evaporated)
+    if neighbors is not None and len(neighbors) != len(nodes):
+        neighbors = state.neighbors = None  # not the list of this emitter
+    if neighbors is not None:
+        neighbors.remove(np.flatnonzero(state.evaporated[nodes]))
+    region, subdomain = None, False
+    if relax:
+        with span(telemetry, "surface", directory):
+            region, surface_numbers = local_subdomain(
+                state, find_surface_atoms(state, directory), setup)
+        subdomain = region is not None
+    if not relax:
+        # the atoms stay where they are, in the form of read_lammps_dump
+        region = np.flatnonzero(state.atoms)
+        relaxed = EmitterState(state.positions[region], state.ids[region]//stride)
+        if neighbors is None:
+            relaxed.cn = NeighborList(relaxed.positions*1e10, cutoff=CN_CUTOFF
+                                      ).coordination(CN_CUTOFF)[0]
+    elif not subdomain:
+        region = np.flatnonzero(state.atoms)
+        relaxed = relax_atoms(state, surface_numbers, setup, md, directory,
+                              telemetry)
+    else:
+        # the buffer shell around the subdomain is always held in place
+        lammps = dict(setup["lammps"])
+        lammps["minimize"] = dict(lammps["minimize"], surface_only=True)
+        relaxed = relax_atoms(state.subset(region), surface_numbers,
+                              dict(setup, lammps=lammps), md, directory,
+                              telemetry)
+
+    with span(telemetry, "coordination", directory):
+        if neighbors is not None and len(relaxed) == len(region):
+            # coordination numbers over the whole emitter, also for the
+            # atoms at the edge of a subdomain
+            rows = np.searchsorted(nodes, region)
+            neighbors.move(rows, snap_to_base(relaxed.positions)*1e10)
+            relaxed.cn = neighbors.coordination(CN_CUTOFF)[0][rows]
+        else:
+            neighbors = None
+        assign_ids_by_cn(relaxed, bins)
+    kept = relaxed.ids % stride != 0
+    if md is not None:
+        # the atoms convert_lammps_to_emitter drops leave LAMMPS as well
+        if relax:
+            md.discard(kept)
+        else:
+            md.drop(state, kept)
+    keep = None
+    if len(relaxed) == len(region):
+        # atoms carried on, among the atoms the step started with
+        keep = state.atoms[nodes]
+        keep[np.searchsorted(nodes, region)[~kept]] = False
+    with span(telemetry, "to_emitter", directory, ["relaxed_emitter.txt"]):
+        emitter = convert_lammps_to_emitter(n_nodes, relaxed, stride, directory, log)
+        if subdomain:
+            emitter = merge_subdomain(state, region, kept, emitter)
+        state = add_original_vacuum_nodes(emitter, directory=directory)
+    if keep is not None:
+        state.parents = np.flatnonzero(keep)
+    if neighbors is not None:
+        neighbors.compact(keep)
+        state.neighbors = neighbors
+    return state
+
+
+def relax_atoms(state, surface_numbers, setup, md=None, directory=".",
+                telemetry=None):
+    """
+    Relax the atoms of `state` with the `lmp` binary, or with the
+    in-process LAMMPS `md`, with the LAMMPS files in `directory`.
+    Returns the relaxed atoms, in the order of `state`, as an
+    `EmitterState` in the form of `read_lammps_dump`. The conversions
+    and the LAMMPS run are recorded as spans of `telemetry`.
+    """
+    if md is not None:
+        with span(telemetry, "lammps", directory):
+            return md.relax(state, surface_numbers, setup, directory)
+
+    with span(telemetry, "to_lammps", directory, ["data.emitter"]):
+        fixed_indices = convert_emitter_to_lammps(surface_numbers, setup, state, directory)
+        write_lammps_input_file(setup, fixed_indices, directory)
+
+    with span(telemetry, "lammps", directory, ["relaxed_emitter.lmp"]):
+        _ = subprocess.check_output(
+            [executable(setup["lammps"]["bin"]),
+             "-l", in_directory(directory, "log.lammps"),
+             "-i", in_directory(directory, "in.emitter_relax")], cwd=directory
+        )
+    with span(telemetry, "from_lammps", directory):
+        relaxed = read_lammps_dump(in_directory(directory, "relaxed_emitter.lmp"))
+    # the dump is sorted by LAMMPS ID, which puts the fixed atoms first
+    order, _ = fixed_first_order(np.count_nonzero(state.atoms), surface_numbers)
+    if len(relaxed) == len(order):
+        relaxed = relaxed.subset(np.argsort(order))
+    return relaxed
 
 
-def find_surface_atoms():
+def find_surface_atoms(state=None, directory="."):
     """
-    Read from the TAPSim-generated surface_data file
-    which atoms are at the emitter's surface. This is
+    Find which atoms are at the emitter's surface. This is
     convenient if these are the only atoms you want to
     allow to relax in LAMMPS (surface_only: true in your
     setup.yaml) to speed up the relaxation.
+
+    For an `EmitterState`, the surface is detected from the atom
+    coordinates (see `pyvaporate.surface.find_surface`). Otherwise it
+    is read from the latest TAPSim-generated surface_data file in
+    `directory`.
+    Returns the 1-based numbers of the surface atoms, counted over the
+    emitter atoms (nodes with ID > 3).
     """
 
-    surface_files = [f for f in os.listdir(os.getcwd()) if "surface_data" in f]
+    if state is not None:
+        if state.neighbors is not None:
+            return surface_from_neighbors(state.neighbors)+1
+        return find_surface(state.positions[state.atoms]*1e10)+1
+
+    surface_files = sorted(f for f in os.listdir(directory) if "surface_data" in f)
     if len(surface_files):
-        surface_file = surface_files[-1]
+        surface_file = in_directory(directory, surface_files[-1])
         surface_lines = open(surface_file).readlines()
         surface_numbers = []
         for line in surface_lines[5:]:
@@ -173,38 +350,32 @@ def find_surface_atoms():
     return surface_numbers
 
 
-def convert_emitter_to_lammps(surface_numbers, setup):
+def convert_emitter_to_lammps(surface_numbers, setup, state=None, directory="."):
+    """
+    Convert a TAPSim emitter (an `EmitterState`, by default read from
+    `updated_mesh.txt`) to a LAMMPS structure file, data.emitter in
+    `directory`. Returns the LAMMPS IDs of the atoms that are not in
+    `surface_numbers`.
     """
-    Convert a TAPSim emitter node file to a LAMMPS
-    structure file.
-    """
-
-    emitter_lines = open("updated_mesh.txt").readlines()
-    atom_lines = [l for l in emitter_lines[1:-1] if l.split()[-2] not in
-                  ["0", "1", "2", "3"]]
-    atom_types = [t.split("=")[0][0] for t in emitter_lines[-1].split()[1:]]
-    atom_names = [t.split("=")[1] for t in emitter_lines[-1].split()[1:]]
-
-    atom_coords = []
-    n = 1
-    for line in atom_lines:
-        split_line = line.split()
-        atom_coords.append(
-            [str(n), split_line[-2][0]]+
-            [str(float(x)*1e10) for x in split_line[:3]]
-        )
-        n += 1
-
-    x_coords = [float(a[2]) for a in atom_coords]
-    y_coords = [float(a[3]) for a in atom_coords]
-    z_coords = [float(a[4]) for a in atom_coords]
-    xlim = (min(x_coords)-10, max(x_coords)+10)
-    ylim = (min(y_coords)-10, max(y_coords)+10)
-    zlim = (min(z_coords)-10, max(z_coords)+10)
 
-    with open("data.emitter", "w") as dat:
+    if state is None:
+        state = EmitterState.from_file(in_directory(directory, "updated_mesh.txt"))
+    id_names = state.id_names
+    atoms = state.subset(state.atoms)
+    order, n_fixed = fixed_first_order(len(atoms), surface_numbers)
+    atoms = atoms.subset(order)
+    atom_types = [ID[0] for ID in id_names]
+    atom_names = [id_names[ID] for ID in id_names]
+
+    numbers = np.arange(1, len(atoms)+1)
+    coords = atoms.positions*1e10
+    xlim = (coords[:, 0].min()-10, coords[:, 0].max()+10)
+    ylim = (coords[:, 1].min()-10, coords[:, 1].max()+10)
+    zlim = (coords[:, 2].min()-10, coords[:, 2].max()+10)
+
+    with open(in_directory(directory, "data.emitter"), "w") as dat:
         dat.write("LAMMPS Emitter\n\n")
-        dat.write("{} atoms\n\n".format(len(atom_lines)))
+        dat.write("{} atoms\n\n".format(len(atoms)))
         dat.write("{} atom types\n\n".format(len(atom_types)))
         dat.write("{} {} xlo xhi\n".format(xlim[0], xlim[1]))
         dat.write("{} {} ylo yhi\n".format(ylim[0], ylim[1]))
@@ -216,77 +387,151 @@ def convert_emitter_to_lammps(surface_numbers, setup):
                 setup["emitter"]["elements"][atom_names[i]]["mass"])
             )
         dat.write("\nAtoms\n\n")
-        fixed_indices = []
-        for atom in atom_coords:
-            if atom[0] not in surface_numbers:
-                fixed_indices.append(atom[0])
-            dat.write("{}\n".format(" ".join(atom)))
-    with open("fixed_indices.txt", "w") as fi:
-        for index in fixed_indices:
-            fi.write("{}\n".format(index))
-
-
-def convert_lammps_to_emitter(n_nodes):
-    """
-    Convert a relaxed LAMMPS structure file back to
-    a TAPSim emitter node file.
-    """
-
-    xyz_lines = open("relaxed_emitter.lmp").readlines()
-    with open("relaxed_emitter.txt", "w") as e:
-        e.write("ASCII {} 0 0\n".format(n_nodes))
-        i = 1
-        for line in xyz_lines[9:]:
-            sl = line.split()
-            x = str(float(sl[0])*1e-10)
-            y = str(float(sl[1])*1e-10)
-            z = float(sl[2])*1e-10
-
-            # Check if the z-coordinate is beyond e-10 precision limit
-            if abs(z) < 1e-10:
-                z = 0.0  # Set to zero if beyond e-10 precision limit
-                z = str(z)
-            else:
-                z = str(z)
-            atom_type = sl[3]
-            n_lost = 0
-            if atom_type[-1] == "0":
-                n_lost += 1
-            else:
-                e.write("{}\n".format("	".join([x, y, z, "10", "0"])))
-            i += 1
-    print("{} atoms lost from surface".format(n_lost))
-
-
-def add_original_vacuum_nodes():
+        values = np.column_stack((numbers, atoms.ids//id_stride(cn_bins(setup)), coords))
+        dat.write(("%d %d %r %r %r\n"*len(atoms)) % tuple(values.ravel().tolist()))
+    return numbers[:n_fixed]
+
+
+def fixed_first_order(n_atoms, surface_numbers):
+    """
+    Order in which to number `n_atoms` emitter atoms for LAMMPS: the
+    atoms not in `surface_numbers` (1-based atom numbers), which are
+    held in place during a surface-only relaxation, come first.
+    Returns the order (0-based atom indices) and the number of fixed
+    atoms.
+    """
+    fixed = ~np.isin(np.arange(1, n_atoms+1), np.array(surface_numbers, dtype=int))
+    order = np.concatenate((np.flatnonzero(fixed), np.flatnonzero(~fixed)))
+    return order, np.count_nonzero(fixed)
+
+
+def id_ranges(ids):
+    """
+    Compact LAMMPS ID list for an increasing array of atom IDs, with
+    each run of consecutive IDs written as a range: "1:500 502 504:900".
+    """
+    ids = np.asarray(ids, dtype=int)
+    if len(ids) == 0:
+        return ""
+    breaks = np.flatnonzero(np.diff(ids) != 1)
+    starts = ids[np.concatenate(([0], breaks+1))]
+    ends = ids[np.concatenate((breaks, [len(ids)-1]))]
+    return " ".join(
+        str(a) if a == b else "{}:{}".format(a, b) for a, b in zip(starts, ends)
+    )
+
+
+def read_lammps_dump(lammps_file="relaxed_emitter.lmp"):
+    """
+    Read the x y z type c_cnum dump LAMMPS writes after the relaxation
+    into an `EmitterState` (positions in meters). The IDs are the
+    LAMMPS atom types, before `assign_ids_by_cn` turns them back into
+    element IDs.
+    """
+
+    with open(lammps_file) as f:
+        for _ in range(9):  # dump header
+            f.readline()
+        table = parse_table(f, 5)  # x y z type c_cnum
+    return EmitterState(table[:, :3]*1e-10, table[:, 3].astype(int),
+                        table[:, 4].astype(int))
+
+
+def convert_lammps_to_emitter(n_nodes, relaxed=None, stride=10, directory=".",
+                              log=print):
+    """
+    Convert a relaxed LAMMPS structure (an `EmitterState` with IDs
+    assigned by `assign_ids_by_cn`, or by default the
+    `relaxed_emitter.lmp` file) back to a TAPSim emitter, dropping the
+    atoms left without neighbors (coordination class 0). The others
+    keep their IDs, which give TAPSim their element and coordination
+    class. `stride` is the element ID spacing (see
+    `pyvaporate.evaluate.id_stride`).
+    Returns the emitter `EmitterState`; `relaxed_emitter.txt` is only
+    written when reading from file. Files are in `directory`, and the
+    number of lost atoms goes to `log`.
+    """
+
+    write = relaxed is None
+    if relaxed is None:
+        relaxed = read_lammps_dump(in_directory(directory, "relaxed_emitter.lmp"))
+    lost = relaxed.ids % stride == 0
+    coords = snap_to_base(relaxed.positions[~lost])
+    emitter = EmitterState(coords, relaxed.ids[~lost])
+    if write:
+        emitter.write(in_directory(directory, "relaxed_emitter.txt"))
+    log("{} atoms lost from surface".format(np.count_nonzero(lost)))
+    return emitter
+
+
+def snap_to_base(coords):
+    """
+    Copy of `coords` (meters) with the z-coordinates beyond the e-10
+    precision limit set to zero.
+    """
+    coords = coords.copy()
+    coords[np.abs(coords[:, 2]) < 1e-10, 2] = 0.0
+    return coords
+
+
+def vacuum_block(original_mesh):
+    """
+    The vacuum, top, bottom and side nodes (ID <= 3) of the mesh file
+    `original_mesh` (an absolute path): their `EmitterState`, the
+    {"ID": "element"} map of the mesh and their lines, formatted for a
+    node file (see `pyvaporate.nodes.write_node_file`). They never
+    change during a run, so the mesh is only parsed again once the file
+    changes; the last few meshes are kept.
+    """
+    stat = os.stat(original_mesh)
+    key = (original_mesh, stat.st_size, stat.st_mtime_ns)
+    with VACUUM_LOCK:
+        if key in VACUUM_BLOCKS:
+            return VACUUM_BLOCKS[key]
+    original = EmitterState.from_file(original_mesh)
+    vacuum = original.subset(original.ids <= 3)
+    block = (vacuum, original.id_names,
+             (len(vacuum), format_nodes(vacuum.to_nodes())))
+    with VACUUM_LOCK:
+        VACUUM_BLOCKS[key] = block
+        while len(VACUUM_BLOCKS) > VACUUM_CACHE_SIZE:
+            VACUUM_BLOCKS.pop(next(iter(VACUUM_BLOCKS)))
+    return block
+
+
+def add_original_vacuum_nodes(emitter=None, original_mesh="../0/mesh.txt",
+                              directory="."):
     """
     Add the vaccuum, etc. nodes back to a TAPSim
-    emitter node file created from a LAMMPS structure,
-    which neither needs nor has these nodes.
+    emitter created from a LAMMPS structure (an `EmitterState`, or
+    by default `relaxed_emitter.txt`), which neither needs nor has
+    these nodes. Writes `relaxed_emitter.txt` and returns its
+    `EmitterState`. Relative paths are relative to `directory`.
+
+    The nodes are taken, already formatted, from `vacuum_block`, so
+    only the emitter atoms are formatted every step.
     """
-    original_emitter_lines = open("../0/mesh.txt").readlines()
-    original_vacuum_lines = [
-        l for l in original_emitter_lines[1:] if l[0] == "#" or
-        l.split()[3] in [str(i) for i in range(4)]
-    ]
+    vacuum, id_names, block = vacuum_block(in_directory(directory, original_mesh))
 
-    emitter_lines = open("relaxed_emitter.txt").readlines()
-    emitter_lines = [
-        l for l in emitter_lines[1:-1] if l.split()[3] not in
-        ["0", "2"]
-    ]
-    n_nodes = len(emitter_lines)+len(original_vacuum_lines)-1
+    if emitter is None:
+        emitter = EmitterState.from_file(in_directory(directory, "relaxed_emitter.txt"))
+    emitter = emitter.subset(~np.isin(emitter.ids, (0, 2)))
+    emitter.id_names = id_names
 
-    with open("relaxed_emitter.txt", "w") as e:
-        e.write("ASCII {} 0 0\n".format(n_nodes))
-        for line in emitter_lines + original_vacuum_lines:
-            e.write(line)
+    write_node_file(in_directory(directory, "relaxed_emitter.txt"),
+                    emitter.to_nodes(), id_names, block=block)
+    return emitter.concatenate(vacuum)
 
 
-def write_lammps_input_file(setup):
+def write_lammps_input_file(setup, fixed_indices, directory="."):
     """
     Write the input file specifying the type
-    of relaxation to perform in LAMMPS.
+    of relaxation to perform in LAMMPS. `fixed_indices`
+    are the LAMMPS IDs of the atoms held in place when
+    only the surface is relaxed; they are written as ID ranges
+    (see `id_ranges`). The relaxed structure is dumped in ID order.
+    The input file, and the files it names (by absolute path), are in
+    `directory`.
     """
 
     etol = setup["lammps"]["minimize"]["etol"]
@@ -297,20 +542,22 @@ def write_lammps_input_file(setup):
     pot = setup["lammps"]["potentials_location"]
     elts = " ".join(setup["emitter"]["elements"])
 
-    fixed_indices = [l.replace("\n", "") for l in open("fixed_indices.txt").readlines()]
-    with open("in.emitter_relax", "w") as er:
+    with open(in_directory(directory, "in.emitter_relax"), "w") as er:
         er.write("# Emitter Relaxation\n\n")
-        er.write("units real\natom_style atomic\n\nread_data data.emitter\n\n")
+        er.write("units real\natom_style atomic\n\nread_data {}\n\n".format(
+            in_directory(directory, "data.emitter")))
         er.write("pair_style eam/alloy\n")
         er.write("pair_coeff * * %s %s\n\n" % (pot, elts))
         er.write("neighbor 1.0 bin\n")
-        if setup["lammps"]["minimize"]["surface_only"] == True:
-            er.write("group inner id {}\n".format(" ".join([i for i in fixed_indices])))
+        if setup["lammps"]["minimize"]["surface_only"] == True and len(fixed_indices):
+            er.write("group inner id {}\n".format(id_ranges(fixed_indices)))
             er.write("velocity inner set 0 0 0\n")
             er.write("fix frozen inner setforce 0 0 0\n\n")
-        er.write("compute cnum all coord/atom cutoff 3.0\n")
-        er.write("dump 1 all custom 1000 cnum.dump c_cnum\n")
+        er.write("compute cnum all coord/atom cutoff {}\n".format(CN_CUTOFF))
+        er.write("dump 1 all custom 1000 {} c_cnum\n".format(
+            in_directory(directory, "cnum.dump")))
         er.write("fix 1 all nvt temp %s %s 100.0\n" % (temp, temp))
         er.write("minimize %s %s %s %s\n" % (etol, ftol, maxiter, maxeval))
-        er.write("compute 1 all coord/atom cutoff 3.0\n")
-        er.write("write_dump all custom relaxed_emitter.lmp x y z type c_cnum")
\ No newline at end of file
+        er.write("compute 1 all coord/atom cutoff {}\n".format(CN_CUTOFF))
+        er.write("write_dump all custom {} x y z type c_cnum modify sort id".format(
+            in_directory(directory, "relaxed_emitter.lmp")))
\ No newline at end of file
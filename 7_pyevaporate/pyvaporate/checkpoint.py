@@ -0,0 +1,136 @@
+# This file is part of the PyVaporate package and checkpoints the
+# evaporation loop: every finished step gets a marker file, written
+# atomically once its relaxed_emitter.txt is complete, so that an
+# interrupted run can be resumed from the last good step.
+
+from pyvaporate.cache import file_digest
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+MARKER = "checkpoint.json"
+
+
+def setup_digest(setup):
+    """
+    sha256 hex digest of a run configuration, so that a run is only
+    resumed with the configuration it was started with. The
+    post-processing settings do not change the results and are left out.
+    """
+    setup = {key: value for key, value in setup.items() if key != "postprocess"}
+    serialized = json.dumps(setup, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def sync(filename):
+    """
+    Flush `filename` to disk.
+    """
+    with open(filename, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def atomic_write(filename, text):
+    """
+    Write `text` to `filename` so that it either has the old or the new
+    contents, never a partial file, even if the process dies.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def write_checkpoint(directory, step, setup, digest, neighbors=None):
+    """
+    Mark step `step`, whose files are in `directory`, as complete: the
+    marker records the size and digest of its relaxed_emitter.txt, the
+    event counts of `setup`, the configuration `digest` and the
+    distances the `NeighborList` `neighbors` of the run was built with,
+    which a resumed run has to keep.
+    """
+    emitter = os.path.join(directory, "relaxed_emitter.txt")
+    sync(emitter)
+    marker = {
+        "step": step,
+        "emitter_size": os.path.getsize(emitter),
+        "emitter_sha256": file_digest(emitter),
+        "total_events": setup["evaporation"]["total_events"],
+        "events_per_step": setup["evaporation"]["events_per_step"],
+        "setup_sha256": digest,
+    }
+    if neighbors is not None:
+        marker["nn"] = float(neighbors.nn)
+        marker["surface_cutoff"] = float(neighbors.surface_cutoff)
+    atomic_write(os.path.join(directory, MARKER), json.dumps(marker, indent=1))
+
+
+def read_checkpoint(directory, digest):
+    """
+    The marker of the step in `directory` if it is valid: present, for
+    the configuration `digest`, and with its relaxed_emitter.txt intact.
+    None otherwise.
+    """
+    try:
+        with open(os.path.join(directory, MARKER)) as f:
+            marker = json.load(f)
+        emitter = os.path.join(directory, "relaxed_emitter.txt")
+        if marker["setup_sha256"] != digest or \
+                os.path.getsize(emitter) != marker["emitter_size"] or \
+                file_digest(emitter) != marker["emitter_sha256"]:
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return marker
+
+
+def last_checkpoint(root, digest):
+    """
+    The marker of the latest valid step below the run directory `root`
+    (see `read_checkpoint`), or None if there is none.
+    """
+    steps = sorted((int(d) for d in os.listdir(root)
+                    if d.isdigit() and os.path.isdir(os.path.join(root, d))),
+                   reverse=True)
+    for step in steps:
+        marker = read_checkpoint(os.path.join(root, str(step)), digest)
+        if marker is not None and marker["step"] == step:
+            return marker
+    return None
+
+
+def discard_steps_after(root, step):
+    """
+    Delete the directories of the steps after `step` below `root`: they
+    hold the partial output of an interrupted step, which must not be
+    mixed with the rerun.
+    """
+    for d in os.listdir(root):
+        if d.isdigit() and int(d) > step and os.path.isdir(os.path.join(root, d)):
+            shutil.rmtree(os.path.join(root, d))
+
+
+def clear_checkpoints(root):
+    """
+    Remove the step markers below `root`, left by an earlier run in the
+    same directory, before starting over there.
+    """
+    for d in os.listdir(root):
+        marker = os.path.join(root, d, MARKER)
+        if d.isdigit() and os.path.isfile(marker):
+            os.remove(marker)
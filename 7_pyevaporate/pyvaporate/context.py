@@ -0,0 +1,83 @@
+# This file is part of the PyVaporate package and holds what a single
+# simulation needs besides the emitter itself: its directory, its
+# configuration and its log. Nothing in here changes the process working
+# directory, sys.stdout or the module-global SETUP, so several runs can
+# share one interpreter (threads or asyncio).
+
+from pyvaporate import SETUP
+from pyvaporate.telemetry import Telemetry
+
+from monty.serialization import loadfn
+
+import copy
+import logging
+import os
+
+
+class RunContext:
+    """
+    A pyvaporate run rooted at `root` (made absolute; the step
+    directories 0, 1, 2, ... live below it) with its own copy of the
+    configuration, `setup`, and a logger writing to `log_file` in
+    `root` (appended to when the run is a `resume`d one, started over
+    otherwise). Pass `context.directory(step)` and `context.log` to the
+    functions of `pyvaporate.call`, which take the directory to work in
+    and a log function instead of relying on the working directory and
+    stdout, and `context.telemetry` to record the time spent in each
+    phase (see `pyvaporate.telemetry`).
+    """
+
+    def __init__(self, root=".", setup=None, log_file="pyvaporate.log", resume=False):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        os.makedirs(self.root, exist_ok=True)
+        self.setup = copy.deepcopy(SETUP) if setup is None else setup
+        self.logger = logging.getLogger("pyvaporate.run.{}".format(id(self)))
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        handler = logging.FileHandler(self.path(log_file), mode="a" if resume else "w")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(handler)
+        self.telemetry = Telemetry()
+
+    @classmethod
+    def from_yaml(cls, config_file, root=None, resume=False):
+        """
+        Context of a run configured by the yaml file `config_file`: the
+        sections it sets replace the ones of the defaults in SETUP. The
+        run is rooted in `root`, by default the working directory, and
+        with `resume` its log is continued.
+        """
+        setup = copy.deepcopy(SETUP)
+        configuration = loadfn(config_file)
+        for key in setup:
+            if key in configuration:
+                setup[key] = configuration[key]
+        return cls(os.getcwd() if root is None else root, setup, resume=resume)
+
+    def path(self, *parts):
+        """
+        Absolute path of `parts` below the run root.
+        """
+        return os.path.join(self.root, *parts)
+
+    def directory(self, step):
+        """
+        Absolute path of the directory of step `step`, created if needed.
+        """
+        directory = self.path(str(step))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def log(self, message=""):
+        """
+        Write `message` to the run's log file.
+        """
+        self.logger.info(message)
+
+    def close(self):
+        """
+        Flush and close the log file.
+        """
+        for handler in list(self.logger.handlers):
+            handler.close()
+            self.logger.removeHandler(handler)
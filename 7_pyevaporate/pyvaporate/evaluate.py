@@ -1,24 +1,96 @@
-def assign_ids_by_cn(lammps_file):
+from pyvaporate.nodes import parse_table
+
+import numpy as np
+
+# default coordination classes: CN 0, 1, ..., 8 and 9 or more
+CN_BINS = np.arange(10)
+# neighbor cutoff of the coordination numbers, Angstroms
+CN_CUTOFF = 3.0
+
+
+def cn_bins(setup):
+    """
+    Lower CN bound of each coordination class, from
+    `setup["emitter"]["cn_bins"]` (a list of increasing CNs starting
+    at 0), or `CN_BINS` if it is "none". Class k holds the atoms with
+    bins[k] <= CN < bins[k+1] and evaporates with the field of
+    e_fields key k (see `class_fields`); class 0 atoms count as lost
+    from the surface. Raises ValueError unless the bins are such a list
+    and every e_fields key of every element is one of the classes.
+    """
+    bins = setup["emitter"].get("cn_bins", "none")
+    if bins == "none":
+        bins = CN_BINS
+    else:
+        bins = np.asarray(bins)
+        if bins.ndim != 1 or len(bins) == 0 or bins.dtype.kind not in "iu" or \
+                bins[0] != 0 or np.any(np.diff(bins) <= 0):
+            raise ValueError("cn_bins must be a list of increasing integers starting "
+                             "at 0, not {}".format(setup["emitter"]["cn_bins"]))
+    for element, config in setup["emitter"]["elements"].items():
+        keys = [int(k) for k in config["e_fields"]]
+        if not keys or min(keys) < 0 or max(keys) >= len(bins):
+            raise ValueError("The e_fields keys of {} must be coordination classes "
+                             "0 to {}, not {}".format(element, len(bins)-1, sorted(keys)))
+    return bins
+
+
+def class_fields(e_fields, n_classes):
+    """
+    Evaporation field of each of the `n_classes` coordination classes
+    from the `e_fields` of an element ({class: field}). A class without
+    a key of its own takes the field of the nearest lower class that
+    has one (the lowest key for the classes below it), so a single key
+    sets the field of every class.
+    """
+    fields = {int(k): f for k, f in e_fields.items()}
+    keys = sorted(fields)
+    lower = np.searchsorted(keys, np.arange(n_classes), side="right")-1
+    return [fields[keys[max(i, 0)]] for i in lower]
+
+
+def id_stride(bins=CN_BINS):
+    """
+    Spacing of the element IDs needed to fit one ID per coordination
+    class: 10 (IDs 10, 20, ...) for up to ten classes, 100 for up to a
+    hundred, etc.
+    """
+    return 10**len(str(len(bins)-1))
+
+
+def cn_classes(cn, bins=CN_BINS):
+    """
+    Coordination class of every CN in `cn` (see `cn_bins`).
+    """
+    return np.searchsorted(bins, cn, side="right")-1
+
+
+def assign_ids_by_cn(emitter, bins=CN_BINS):
     """
     Assign ID's to distinguish between atoms of various
     coordinations.
-    1. reads a LAMMPS data file -> contains atom positions, types, and CN
+    1. takes a LAMMPS dump file (x y z type c_cnum) or an `EmitterState`
+       read from one -> contains atom positions, types, and CN
     2. for each atom, modifies the atom type (ID) based on its CN
     3. atoms with lower CN will have different IDs than atoms with higher CN.
     helpful to differentiate surface atoms (low CN) from bulk atoms (high CN)
+
+    The ID is type * `id_stride(bins)` + the coordination class (by
+    default min(CN, 9)), computed for all atoms at once. An
+    `EmitterState` is updated in memory; a dump file is rewritten.
     """
 
-    lammps_lines = open(lammps_file).readlines()
-    with open(lammps_file, "w") as l:
-        for line in lammps_lines[:9]:
-            l.write(line)
-        for line in lammps_lines[9:]:
-            sl = line.split()
-            original_atom_base = sl[-2]+"0"
-            cn = int(sl[-1])
-            if cn > 9:
-                cn = 9
-            atom_type = str(int(original_atom_base)+cn)
-            sl[3] = atom_type
-            l.write(" ".join(sl))
-            l.write("\n")
\ No newline at end of file
+    stride = id_stride(bins)
+    if not isinstance(emitter, str):
+        emitter.ids = emitter.ids*stride + cn_classes(emitter.cn, bins)
+        return emitter
+
+    with open(emitter) as l:
+        header = [l.readline() for _ in range(9)]
+        table = parse_table(l, 5)  # x y z type c_cnum
+    cn = table[:, 4].astype(int)
+    ids = table[:, 3].astype(int)*stride + cn_classes(cn, bins)
+    values = np.column_stack((table[:, :3], ids, cn))
+    with open(emitter, "w") as l:
+        l.writelines(header)
+        l.write(("%r %r %r %d %d\n"*len(values)) % tuple(values.ravel().tolist()))
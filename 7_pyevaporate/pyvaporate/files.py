@@ -0,0 +1,146 @@
+# This file is part of the PyVaporate package and handles the files of the
+# step directories: handing the emitter from one step to the next without
+# copying it where the filesystem allows, and deleting what a run no
+# longer needs according to a retention policy.
+
+import errno
+import glob
+import os
+import shutil
+
+# Linux ioctl cloning a file into another one (a reflink: copy-on-write,
+# shares the data blocks) on filesystems that support it (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# files of a step directory that a retention policy deletes from the steps
+# it does not keep; results_data, detector hits, metrics, telemetry and
+# checkpoint markers are small and stay
+BULKY = ["mesh.txt", "updated_mesh.txt", "relaxed_emitter.txt",
+         "relaxed_emitter.lmp", "data.emitter", "log.lammps", "cnum.dump",
+         "surface_data*"]
+TRAJECTORIES = ["trajectory_data.*", "dump.*", "dump", "geometry.dat"]
+
+
+def link_or_copy(src, dst):
+    """
+    Hardlink `src` to `dst`, replacing `dst`, or copy it if the two are
+    on different filesystems.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def reflink(src, dst):
+    """
+    Clone `src` into a new file `dst` sharing its data blocks. Raises
+    OSError if the platform or filesystem cannot.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, "No reflinks on this platform")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def share_file(src, dst):
+    """
+    Make `dst` (replaced if it exists) a file with the contents of
+    `src`: a hardlink if possible, else a reflink, else an in-process
+    copy. Returns "link", "reflink" or "copy". Neither file may be
+    written in place afterwards (files are only ever replaced). Errors
+    of the last resort, the copy, are raised.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    try:
+        reflink(src, dst)
+        return "reflink"
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+def remove_files(directory, patterns):
+    """
+    Delete the files of `directory` matching the glob `patterns`.
+    Returns their total size (the space is only freed for the ones not
+    linked from elsewhere).
+    """
+    freed = 0
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(directory, pattern)):
+            if os.path.isfile(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+    return freed
+
+
+def cleanup(directory):
+    """
+    Delete the TAPSim trajectory and dump files of a step directory.
+    """
+    return remove_files(directory, TRAJECTORIES)
+
+
+def retention(setup):
+    """
+    The retention policy of `setup["retention"]`: the number of most
+    recent steps to keep in full (`keep_last`) and the interval of the
+    steps kept in full beyond those (`keep_every`), each None if "none".
+    Step 0 is always kept.
+    """
+    config = setup.get("retention", {})
+    keep_last, keep_every = config.get("keep_last", "none"), config.get("keep_every", "none")
+    return (None if keep_last == "none" else max(1, int(keep_last)),
+            None if keep_every == "none" else max(1, int(keep_every)))
+
+
+def kept_steps(steps, latest, keep_last=None, keep_every=None):
+    """
+    The steps of `steps` a retention policy keeps in full when `latest`
+    is the last finished step: step 0, `latest` (the next step starts
+    from it) and the ones after it, the last `keep_last` steps and
+    every `keep_every`-th step. With neither set, all steps are kept.
+    """
+    if keep_last is None and keep_every is None:
+        return set(steps)
+    return {step for step in steps
+            if step == 0 or step >= latest
+            or (keep_last is not None and step > latest-keep_last)
+            or (keep_every is not None and step % keep_every == 0)}
+
+
+def apply_retention(root, latest, setup, ready=None):
+    """
+    Delete the `BULKY` and trajectory files of the step directories
+    below `root` that the retention policy of `setup` does not keep
+    (see `kept_steps`), once they are `ready` (a function of the step
+    directory; by default all are). Returns the number of bytes freed;
+    errors are raised.
+    """
+    steps = [int(d) for d in os.listdir(root)
+             if d.isdigit() and os.path.isdir(os.path.join(root, d))]
+    kept = kept_steps(steps, latest, *retention(setup))
+    freed = 0
+    for step in sorted(set(steps) - kept):
+        directory = os.path.join(root, str(step))
+        if ready is None or ready(directory):
+            freed += remove_files(directory, BULKY + [f + ".gz" for f in BULKY] +
+                                  TRAJECTORIES)
+    return freed
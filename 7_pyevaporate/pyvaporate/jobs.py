@@ -0,0 +1,402 @@
+# This file is part of the PyVaporate package and distributes runs over
+# several nodes through a job queue: an SQLite database on a filesystem
+# all nodes share. Workers started on any node pull runs from it, hold a
+# lease on each that they renew with heartbeats, and the runs of workers
+# that died (lease expired) go back to the queue and are resumed from
+# their last complete step by the next worker.
+#
+#     python -m pyvaporate.jobs add queue.db sweep.yaml
+#     python -m pyvaporate.jobs work queue.db      # on every node, as often as wanted
+#     python -m pyvaporate.jobs status queue.db
+
+from pyvaporate.sweep import (read_sweep, write_sweep, run_point, limit_threads,
+                              completed_steps)
+
+from contextlib import contextmanager
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    directory TEXT UNIQUE NOT NULL,
+    parameters TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 2,
+    worker TEXT,
+    lease_expires REAL,
+    heartbeat REAL,
+    started REAL,
+    finished REAL,
+    seconds REAL,
+    steps INTEGER NOT NULL DEFAULT 0,
+    error TEXT NOT NULL DEFAULT ''
+)
+"""
+
+
+def worker_name():
+    """
+    Name of the calling worker process: host:pid.
+    """
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class JobQueue:
+    """
+    Queue of pyvaporate runs (run directories holding a setup.yaml) in
+    the SQLite database `filename`. Each job is queued, running (leased
+    by a worker until `lease_expires`), done or failed.
+
+    A worker `claim`s a job for `lease` seconds and renews the lease
+    with `heartbeat`s. A job whose lease ran out goes back to the queue
+    (or fails once it has used its attempts) the next time any worker
+    looks for work, so the runs of dead workers are picked up again.
+    Every operation is a short transaction of its own (waiting up to
+    `timeout` seconds for the database lock), so the database can sit
+    on a shared filesystem with workers on several nodes.
+
+    The database uses SQLite's default rollback journal, which relies
+    on the filesystem's locks: NFS needs working locking (lockd, or
+    NFSv4). Leases compare the clocks of different nodes, so `lease`
+    should be far longer than their skew.
+    """
+
+    def __init__(self, filename, lease=300.0, timeout=60.0):
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        self.lease = float(lease)
+        self.timeout = timeout
+        with self.transaction() as db:
+            db.execute(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """
+        A connection to the database inside a write transaction, which
+        is committed at the end of the with block (rolled back on an
+        error) before the connection is closed.
+        """
+        db = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def add(self, directory, parameters=None, retries=1):
+        """
+        Queue the run in `directory` (holding its setup.yaml), to be
+        attempted up to `retries`+1 times. `parameters` (a dict) is
+        kept for `status`. Returns the job ID, or None if the directory
+        is already queued.
+        """
+        with self.transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO jobs (directory, parameters, max_attempts) "
+                "VALUES (?, ?, ?)",
+                (os.path.abspath(directory), json.dumps(parameters or {}), retries+1))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def expire(self, db, now):
+        """
+        Put the running jobs whose lease expired before `now` back in
+        the queue, or fail the ones out of attempts.
+        """
+        db.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN ? ELSE ? END, "
+            "error = 'lease of ' || worker || ' expired', worker = NULL, "
+            "lease_expires = NULL WHERE status = ? AND lease_expires < ?",
+            (QUEUED, FAILED, RUNNING, now))
+
+    def claim(self, worker):
+        """
+        Lease the oldest queued job to `worker`. Returns the job (a
+        dict of its columns), or None if there is none.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            self.expire(db, now)
+            row = db.execute("SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                             (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+                "lease_expires = ?, heartbeat = ?, started = ? WHERE id = ?",
+                (RUNNING, worker, now+self.lease, now, now, row["id"]))
+            return dict(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, job_id, worker, steps=None):
+        """
+        Renew the lease of `worker` on job `job_id` and record its
+        completed `steps`. Returns False if the worker no longer holds
+        the lease (it expired and the job was handed on).
+        """
+        now = time.time()
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ?, heartbeat = ?, steps = COALESCE(?, steps) "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (now+self.lease, now, steps, job_id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def finish(self, job_id, worker, result):
+        """
+        Record the `result` of `run_point` for job `job_id` of `worker`:
+        done, or, if it failed, queued again until it is out of
+        attempts. Returns False (and records nothing) if the worker no
+        longer holds the lease.
+        """
+        status = DONE if result["status"] == "done" else FAILED
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = CASE WHEN ? = ? AND attempts < max_attempts "
+                "THEN ? ELSE ? END, worker = NULL, lease_expires = NULL, finished = ?, "
+                "seconds = ?, steps = ?, error = ? WHERE id = ? AND worker = ? AND status = ?",
+                (status, FAILED, QUEUED, status, time.time(), result.get("seconds"),
+                 result.get("steps", 0), result.get("error", ""), job_id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def release(self, job_id, worker):
+        """
+        Put job `job_id` of `worker` back in the queue without counting
+        the attempt, e.g. when the worker is stopped.
+        """
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_expires = NULL, "
+                "attempts = attempts - 1 WHERE id = ? AND worker = ? AND status = ?",
+                (QUEUED, job_id, worker, RUNNING))
+
+    def retry_failed(self):
+        """
+        Queue the failed jobs again, with all their attempts. Returns
+        their number.
+        """
+        with self.transaction() as db:
+            return db.execute("UPDATE jobs SET status = ?, attempts = 0 WHERE status = ?",
+                              (QUEUED, FAILED)).rowcount
+
+    def jobs(self):
+        """
+        All jobs (dicts of their columns), in queue order, after
+        handing on the ones with expired leases.
+        """
+        with self.transaction() as db:
+            self.expire(db, time.time())
+            return [dict(row) for row in db.execute("SELECT * FROM jobs ORDER BY id")]
+
+    def counts(self, jobs=None):
+        """
+        Number of jobs per status.
+        """
+        counts = {status: 0 for status in [QUEUED, RUNNING, DONE, FAILED]}
+        for job in self.jobs() if jobs is None else jobs:
+            counts[job["status"]] += 1
+        return counts
+
+
+def queue_sweep(sweep_file, queue_file):
+    """
+    Write the run directories of the sweep described by `sweep_file`
+    (see `pyvaporate.sweep.yaml_sweep`) and queue them in
+    `queue_file`, with the sweep's retries. Returns the new job IDs.
+    """
+    sweep = read_sweep(sweep_file)
+    queue = JobQueue(queue_file)
+    ids = []
+    for directory, parameters in write_sweep(sweep["base"], sweep["grid"], sweep["root"]):
+        job_id = queue.add(directory, parameters, sweep.get("retries", 1))
+        if job_id is not None:
+            ids.append(job_id)
+    return ids
+
+
+def run_job(directory, connection, cpus_per_run):
+    """
+    Body of the process running a job: the run in `directory`, in a
+    process group of its own (so it can be stopped with its TAPSim and
+    LAMMPS children). Sends the `run_point` result over `connection`.
+    The group is killed if the worker dies, since its lease then runs
+    out and another worker takes the run over.
+    """
+    os.setsid()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # not the worker's handler
+    threading.Thread(target=orphan_watch, args=(os.getppid(),), daemon=True).start()
+    limit_threads(cpus_per_run)
+    connection.send(run_point(directory, retries=0))
+
+
+def orphan_watch(parent, interval=1.0):
+    """
+    Kill the calling process group once the process `parent` is gone.
+    """
+    while os.getppid() == parent:
+        time.sleep(interval)
+    os.killpg(os.getpgrp(), signal.SIGKILL)
+
+
+def exited(process, directory):
+    """
+    The `run_point` result of a job process that died without one.
+    """
+    return {"status": "failed", "steps": completed_steps(directory),
+            "error": "job process exited with code {}".format(process.exitcode)}
+
+
+def stop(process):
+    """
+    Stop the job `process` and its children.
+    """
+    for sig, wait in [(signal.SIGTERM, 10), (signal.SIGKILL, None)]:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            break
+        process.join(wait)
+        if not process.is_alive():
+            break
+    process.join()
+
+
+def work(queue_file, lease=300.0, poll=None, max_jobs=None, cpus_per_run=1,
+         log=print):
+    """
+    Run jobs of the queue in `queue_file` until there are none left to
+    claim, or `max_jobs` were run. With `poll` (seconds), wait while
+    other workers still hold leases, since their jobs come back if they
+    die, and only stop once every job is done or failed.
+
+    Each job runs in a child process (with `cpus_per_run` CPUs for its
+    binaries), while this one renews the lease every `lease`/3 seconds.
+    If the lease is lost anyway, the child is stopped, since another
+    worker now owns the run. Stopping the worker (KeyboardInterrupt)
+    stops the run and puts it back in the queue. Progress goes to
+    `log`. Returns the number of jobs run.
+    """
+    queue = JobQueue(queue_file, lease)
+    worker = worker_name()
+    context = multiprocessing.get_context("fork")
+    n_jobs = 0
+    while max_jobs is None or n_jobs < max_jobs:
+        job = queue.claim(worker)
+        if job is None:
+            counts = queue.counts()
+            if poll is None or counts[QUEUED] + counts[RUNNING] == 0:
+                break
+            time.sleep(poll)
+            continue
+        n_jobs += 1
+        log("{} running {} (attempt {} of {})".format(
+            worker, job["directory"], job["attempts"], job["max_attempts"]))
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_job, args=(job["directory"], sender, cpus_per_run))
+        process.start()
+        sender.close()
+        try:
+            result = None
+            while result is None:
+                if receiver.poll(queue.lease/3):
+                    try:
+                        result = receiver.recv()
+                    except EOFError:  # exited without a result
+                        process.join()
+                        result = exited(process, job["directory"])
+                elif not process.is_alive():
+                    result = exited(process, job["directory"])
+                elif not queue.heartbeat(job["id"], worker, completed_steps(job["directory"])):
+                    log("{} lost the lease on {}; stopping it".format(worker, job["directory"]))
+                    stop(process)
+                    break
+            process.join()
+        except BaseException:
+            stop(process)
+            queue.release(job["id"], worker)
+            log("{} stopped; {} is queued again".format(worker, job["directory"]))
+            raise
+        if result is not None and queue.finish(job["id"], worker, result):
+            log("{} finished {}: {}{}".format(
+                worker, job["directory"], result["status"],
+                " ({})".format(result["error"]) if result.get("error") else ""))
+    return n_jobs
+
+
+def status(queue_file, log=print):
+    """
+    Write the number of jobs per status and a table of the jobs of the
+    queue in `queue_file` to `log`. Returns the jobs.
+    """
+    queue = JobQueue(queue_file)
+    jobs = queue.jobs()
+    now = time.time()
+    log(", ".join("{} {}".format(n, s) for s, n in queue.counts(jobs).items()))
+    log("{:>4} {:<24} {:<8} {:>8} {:>6} {:<24} {:>9} {:>9}  {}".format(
+        "id", "run", "status", "attempts", "steps", "worker", "beat (s)", "time (s)", "error"))
+    for job in jobs:
+        beat = "{:.0f}".format(now-job["heartbeat"]) \
+            if job["status"] == RUNNING and job["heartbeat"] else "-"
+        seconds = "{:.0f}".format(job["seconds"]) if job["seconds"] is not None else "-"
+        log("{:>4} {:<24} {:<8} {:>4}/{:<3} {:>6} {:<24} {:>9} {:>9}  {}".format(
+            job["id"], os.path.basename(job["directory"]), job["status"], job["attempts"],
+            job["max_attempts"], job["steps"], job["worker"] or "-", beat, seconds,
+            job["error"]))
+    return jobs
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m pyvaporate.jobs",
+                                     description="Shared-filesystem queue of pyvaporate runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="write the runs of a sweep and queue them")
+    add.add_argument("queue")
+    add.add_argument("sweep")
+    run = commands.add_parser("work", help="run queued jobs")
+    run.add_argument("queue")
+    run.add_argument("--lease", type=float, default=300.0, help="lease in seconds")
+    run.add_argument("--poll", type=float, default=None,
+                     help="wait for the jobs of other workers, polling every POLL seconds")
+    run.add_argument("--max-jobs", type=int, default=None)
+    run.add_argument("--cpus-per-run", type=int, default=1)
+    show = commands.add_parser("status", help="show the jobs")
+    show.add_argument("queue")
+    retry = commands.add_parser("retry", help="queue the failed jobs again")
+    retry.add_argument("queue")
+    args = parser.parse_args(args)
+
+    if args.command == "add":
+        print("Queued {} runs".format(len(queue_sweep(args.sweep, args.queue))))
+    elif args.command == "work":
+        signal.signal(signal.SIGTERM, interrupt)
+        try:
+            work(args.queue, args.lease, args.poll, args.max_jobs, args.cpus_per_run)
+        except KeyboardInterrupt:
+            sys.exit(1)
+    elif args.command == "status":
+        status(args.queue)
+    else:
+        print("Queued {} failed runs again".format(JobQueue(args.queue).retry_failed()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# This file is part of the PyVaporate package and drives LAMMPS through
+# its Python library interface, keeping a single LAMMPS instance alive
+# for a whole run instead of starting the `lmp` binary for every step.
+
+from pyvaporate.call import (convert_emitter_to_lammps, fixed_first_order,
+                             id_ranges, in_directory)
+from pyvaporate.evaluate import cn_bins, id_stride, CN_CUTOFF
+from pyvaporate.state import EmitterState
+
+import numpy as np
+
+
+class LammpsLibrary:
+    """
+    Persistent in-process LAMMPS for `call_lammps`. The first `relax`
+    reads the emitter from a data file; after that the atoms stay in
+    LAMMPS between steps: atoms evaporated by TAPSim (and atoms lost in
+    the previous relaxation) are deleted by ID, and the coordinates and
+    types of the rest are scattered in place, so the potential is parsed
+    once and no dump has to be written and re-parsed.
+
+    The emitter passed to `relax` must be the `EmitterState` returned by
+    the previous `call_lammps`, with TAPSim's evaporation events applied
+    (see `pyvaporate.mesh.MeshUpdater`), or a subdomain of it (see
+    `pyvaporate.subdomain`); any other emitter is reloaded from scratch.
+
+    `lmp` is a `lammps.lammps` instance (or an object with the same
+    command/gather/scatter methods); by default one is created with its
+    log in log.lammps in `directory`. LAMMPS is always given absolute
+    paths, so it does not depend on the working directory.
+    """
+
+    def __init__(self, setup, lmp=None, directory="."):
+        if lmp is None:
+            from lammps import lammps
+            lmp = lammps(cmdargs=["-log", in_directory(directory, "log.lammps"),
+                                  "-screen", "none"])
+        self.lmp = lmp
+        self.setup = setup
+        self.tags = None  # LAMMPS ID of each emitter atom, in node order
+        self.frozen = False
+
+    def command(self, line):
+        self.lmp.command(line)
+
+    def start(self, state, surface_numbers, directory="."):
+        """
+        (Re)load the emitter atoms of `state` from a fresh data.emitter
+        in `directory`.
+        """
+        minimize = self.setup["lammps"]["minimize"]
+        convert_emitter_to_lammps(surface_numbers, self.setup, state, directory)
+        self.command("clear")
+        self.command("units real")
+        self.command("atom_style atomic")
+        self.command("atom_modify map array")
+        self.command("read_data {}".format(in_directory(directory, "data.emitter")))
+        self.command("pair_style eam/alloy")
+        self.command("pair_coeff * * {} {}".format(
+            self.setup["lammps"]["potentials_location"],
+            " ".join(self.setup["emitter"]["elements"])))
+        self.command("neighbor 1.0 bin")
+        self.command("compute cnum all coord/atom cutoff {}".format(CN_CUTOFF))
+        self.command("fix 1 all nvt temp {0} {0} 100.0".format(
+            minimize["temperature"]))
+        # data.emitter numbers the atoms to hold in place first
+        order, _ = fixed_first_order(np.count_nonzero(state.atoms), surface_numbers)
+        self.tags = np.empty(len(order), dtype=int)
+        self.tags[order] = np.arange(1, len(order)+1)
+        self.frozen = False
+
+    def delete(self, tags):
+        """
+        Delete the atoms with LAMMPS IDs `tags`, keeping the IDs of the
+        remaining atoms.
+        """
+        if len(tags) == 0:
+            return
+        self.command("group gone id {}".format(id_ranges(np.sort(tags))))
+        self.command("delete_atoms group gone compress no")
+        self.command("group gone delete")
+
+    def freeze(self, tags):
+        """
+        Hold the atoms with LAMMPS IDs `tags` in place.
+        """
+        tags = np.sort(tags)
+        if self.frozen:
+            self.command("unfix frozen")
+            self.command("group inner delete")
+            self.frozen = False
+        if len(tags) == 0:
+            return
+        self.command("group inner id {}".format(id_ranges(tags)))
+        self.command("velocity inner set 0 0 0")
+        self.command("fix frozen inner setforce 0 0 0")
+        self.frozen = True
+
+    def gather(self, name, dtype, count):
+        n, ids = len(self.tags), self.ctypes_tags()
+        if name.startswith("c_"):
+            values = self.lmp.gather_subset(name, dtype, count, n, ids)
+        else:
+            values = self.lmp.gather_atoms_subset(name, dtype, count, n, ids)
+        return np.asarray(values)[:n*count].reshape(n, count)
+
+    def scatter(self, name, dtype, count, values):
+        ctype = np.float64 if dtype == 1 else np.int32
+        values = np.ascontiguousarray(values, dtype=ctype).ravel()
+        self.lmp.scatter_atoms_subset(name, dtype, count, len(self.tags),
+                                      self.ctypes_tags(),
+                                      np.ctypeslib.as_ctypes(values))
+
+    def ctypes_tags(self):
+        return np.ctypeslib.as_ctypes(np.ascontiguousarray(self.tags, dtype=np.int32))
+
+    def relax(self, state, surface_numbers, setup=None, directory="."):
+        """
+        Relax the atoms of `state` (which is not modified), with the
+        minimization settings of `setup` (by default the one the
+        backend was created with), logging to log.lammps in
+        `directory`. Returns the relaxed atoms, in the order of `state`,
+        as an `EmitterState` in the form of
+        `pyvaporate.call.read_lammps_dump`: positions in meters, IDs
+        set to the LAMMPS atom types and the coordination numbers. The
+        atoms the caller drops from the emitter must then be removed
+        with `discard`.
+        """
+        minimize = (setup or self.setup)["lammps"]["minimize"]
+        self.command("log {}".format(in_directory(directory, "log.lammps")))
+
+        nodes = np.flatnonzero(state.atoms | state.evaporated)
+        if not state.evaporated.any() or self.tags is None or \
+                len(nodes) != len(self.tags):
+            self.start(state, surface_numbers, directory)
+        else:
+            alive = state.atoms[nodes]
+            self.delete(self.tags[~alive])
+            self.tags = self.tags[alive]
+            atoms = nodes[alive]
+            self.scatter("x", 1, 3, state.positions[atoms]*1e10)
+            self.scatter("type", 0, 1, state.ids[atoms]//id_stride(cn_bins(self.setup)))
+
+        if minimize["surface_only"] == True:
+            order, n_fixed = fixed_first_order(len(self.tags), surface_numbers)
+            self.freeze(self.tags[order[:n_fixed]])
+        self.command("minimize {} {} {} {}".format(
+            minimize["etol"], minimize["ftol"], minimize["maxiter"],
+            minimize["maxeval"]))
+
+        return EmitterState(self.gather("x", 1, 3)*1e-10,
+                            self.gather("type", 0, 1).ravel(),
+                            np.rint(self.gather("c_cnum", 1, 1).ravel()))
+
+    def discard(self, kept):
+        """
+        Delete the atoms of the last `relax` not in the mask `kept`:
+        the ones `convert_lammps_to_emitter` dropped from the emitter
+        (coordination class 0), which `call_lammps` decides.
+        """
+        if self.tags is None or len(kept) != len(self.tags):
+            self.tags = None  # reloaded by the next relax
+            return
+        self.delete(self.tags[~kept])
+        self.tags = self.tags[kept]
+
+    def drop(self, state, kept):
+        """
+        Follow a step that `call_lammps` did not relax: delete the atoms
+        evaporated from `state`, and those of the rest not in the mask
+        `kept` (coordination class 0).
+        """
+        nodes = np.flatnonzero(state.atoms | state.evaporated)
+        if self.tags is None or len(nodes) != len(self.tags):
+            self.tags = None  # reloaded by the next relax
+            return
+        alive = state.atoms[nodes]
+        self.delete(self.tags[~alive])
+        self.tags = self.tags[alive]
+        self.discard(kept)
+
+    def close(self):
+        self.lmp.close()
+
+
+def lammps_backend(setup, directory="."):
+    """
+    The persistent LAMMPS selected by `setup["lammps"]["backend"]`:
+    a `LammpsLibrary` (starting its log in `directory`) for "library",
+    or None to run the `lmp` binary every step ("binary", the default).
+    """
+    backend = setup["lammps"].get("backend", "binary")
+    if backend == "binary":
+        return None
+    if backend == "library":
+        return LammpsLibrary(setup, directory=directory)
+    raise ValueError("Unknown LAMMPS backend {}".format(backend))
@@ -0,0 +1,64 @@
+# This file is part of the PyVaporate package and keeps track of which
+# nodes of a TAPSim mesh have been evaporated, based on the results_data
+# files TAPSim writes during an evaporation run.
+
+from pyvaporate.state import EmitterState
+from pyvaporate.tapsim import read_results
+
+import os
+
+import numpy as np
+
+
+def read_evaporated_numbers(results_file):
+    """
+    Read the (1-based) node numbers of the evaporated atoms listed in a
+    TAPSim results_data file, ASCII or binary (see
+    `pyvaporate.tapsim.read_results`).
+    """
+    return np.asarray(read_results(results_file)["number"], dtype=np.int64)
+
+
+class MeshUpdater:
+    """
+    Applies TAPSim evaporation events to an `EmitterState` (or the mesh
+    file it is read from). Each `update` only parses results_data files
+    that are new (or have grown) since the previous call, and marks
+    their atoms as vacuum (ID 0, CN 0) in one vectorized pass.
+    """
+
+    def __init__(self, mesh="mesh.txt"):
+        if not isinstance(mesh, EmitterState):
+            mesh = EmitterState.from_file(mesh)
+        self.state = mesh
+        self.parsed = {}  # results file -> size when it was parsed
+
+    @property
+    def evaporated(self):
+        return self.state.evaporated
+
+    def update(self, directory="."):
+        """
+        Apply the evaporation events of the results_data files in
+        `directory` that have not been parsed yet. Returns the indices
+        of the newly evaporated nodes.
+        """
+        numbers = []
+        for f in sorted(os.listdir(directory)):
+            if "results_data" not in f:
+                continue
+            path = os.path.join(directory, f)
+            size = os.path.getsize(path)
+            if self.parsed.get(path) == size:
+                continue
+            numbers.append(read_evaporated_numbers(path))
+            self.parsed[path] = size
+        if not numbers:
+            return np.empty(0, dtype=np.int64)
+        return self.state.evaporate(np.concatenate(numbers)-1)
+
+    def write(self, filename="updated_mesh.txt"):
+        """
+        Write the mesh, with evaporated atoms turned into vacuum nodes.
+        """
+        self.state.write(filename)
@@ -0,0 +1,281 @@
+# This file is part of the PyVaporate package and keeps a neighbor list of
+# the emitter atoms alive across coupling steps. Surface detection,
+# coordination numbers and subdomain carving all query it, and it is only
+# updated around the atoms that evaporated or moved.
+
+from scipy.spatial import cKDTree
+
+import numpy as np
+
+
+def nearest_neighbor_distance(tree, positions, n_sample=1000):
+    """
+    Typical (median) nearest-neighbor distance of `positions`, estimated
+    from about `n_sample` of them.
+    """
+    sample = positions[:: max(1, len(positions)//n_sample)]
+    return np.median(tree.query(sample, k=2)[0][:, 1])
+
+
+class NeighborList:
+    """
+    Verlet neighbor list of a set of atoms (positions in Angstroms): for
+    every atom, the indices of the atoms within `radius` = `cutoff` +
+    `skin`, stored as an (n_atoms, max_neighbors) table padded with -1.
+    The list answers queries for any cutoff up to `cutoff`, which is at
+    least the first-shell cutoff (1.07 nearest-neighbor distances) used
+    for surface detection. The nearest-neighbor distance `nn` and that
+    cutoff, `surface_cutoff`, are estimated from the positions unless
+    given (e.g. those of the list a resumed run started with).
+
+    Updates are incremental. Removed (evaporated) atoms are only masked.
+    Every atom remembers the position its row was built at; rows are
+    rebuilt when an atom drifts more than skin/3 from it, together with
+    the rows of all atoms within `radius` of its new position, which
+    keeps every pair closer than `cutoff` in the table. Atoms with
+    rebuilt rows are looked up in a small k-d tree of their own, and the
+    whole list is rebuilt once they make up more than `rebuild_fraction`
+    of the atoms. Per-step work thus scales with the number of atoms
+    that evaporated or moved, not with the emitter size.
+    """
+
+    def __init__(self, positions, cutoff=None, skin=0.5, max_neighbors=16,
+                 rebuild_fraction=0.05, chunk_size=250000, nn=None,
+                 surface_cutoff=None):
+        self.positions = np.array(positions, dtype=np.float64).reshape(-1, 3)
+        self.alive = np.ones(len(self.positions), dtype=bool)
+        if nn is None:
+            nn = nearest_neighbor_distance(cKDTree(self.positions), self.positions)
+        self.nn = nn
+        self.surface_cutoff = 1.07*nn if surface_cutoff is None else surface_cutoff
+        self.cutoff = max(cutoff or 0.0, self.surface_cutoff)
+        self.skin = skin
+        self.radius = self.cutoff + skin
+        self.rebuild_fraction = rebuild_fraction
+        self.chunk_size = chunk_size
+        self.table = np.full((len(self.positions), max_neighbors), -1, dtype=np.int32)
+        self.coordination_cache = {}
+        self.build()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def build(self):
+        """
+        Rebuild the whole list from the current positions.
+        """
+        self.tree_index = np.flatnonzero(self.alive)
+        self.tree = cKDTree(self.positions[self.tree_index])
+        self.reference = self.positions.copy()
+        self.detached = np.zeros(len(self), dtype=bool)
+        self.detached_tree = None
+        self.fill(np.arange(len(self)))  # also removed atoms, see `within`
+        self.dirty = np.ones(len(self), dtype=bool)
+
+    def query_tree(self, tree, index, points, radius):
+        """
+        Indices (into the list) of up to 2 * max_neighbors points of
+        `tree` within `radius` of every point in `points`, -1 padded.
+        """
+        k = min(2*self.table.shape[1], tree.n)
+        distance, found = tree.query(points, k=k, distance_upper_bound=radius,
+                                     workers=-1)
+        distance, found = distance.reshape(len(points), k), found.reshape(len(points), k)
+        if k < tree.n and np.isfinite(distance[:, -1]).any():
+            self.grow(k)  # rows may be truncated, retry with a wider table
+            return self.query_tree(tree, index, points, radius)
+        return np.where(np.isfinite(distance), index[np.minimum(found, tree.n-1)], -1)
+
+    def candidates(self, points):
+        """
+        Alive atoms within `radius` of each of `points` (current
+        positions), as a -1 padded table, and their distances.
+        """
+        # atoms drifted up to skin/3 from where the main tree has them (the
+        # positions of its last build), and up to 2 skin/3 from where the
+        # tree of atoms with rebuilt rows has them; the ones in the latter
+        # are stale in the former
+        found = self.query_tree(self.tree, self.tree_index, points,
+                                self.radius + self.skin/3)
+        found[(found >= 0) & self.detached[np.maximum(found, 0)]] = -1
+        if self.detached_tree is not None:
+            found = np.hstack((found, self.query_tree(
+                self.detached_tree, self.detached_index, points,
+                self.radius + 2*self.skin/3)))
+        valid = found >= 0
+        found = np.where(valid, found, 0)
+        distance = np.linalg.norm(self.positions[found] - points[:, None, :], axis=2)
+        valid &= self.alive[found] & (distance <= self.radius)
+        return np.where(valid, found, -1), np.where(valid, distance, np.inf)
+
+    def fill(self, rows):
+        """
+        Rebuild the rows `rows` of the table from the current positions.
+        """
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start+self.chunk_size]
+            found, distance = self.candidates(self.positions[chunk])
+            distance[found == chunk[:, None]] = np.inf  # the atom itself
+            order = np.argsort(distance, axis=1, kind="stable")
+            found = np.take_along_axis(found, order, axis=1)
+            distance = np.take_along_axis(distance, order, axis=1)
+            n_found = np.isfinite(distance).sum(axis=1)
+            if len(chunk) and n_found.max() > self.table.shape[1]:
+                self.grow(n_found.max())
+            width = self.table.shape[1]
+            found = np.where(np.isfinite(distance), found, -1)[:, :width]
+            self.table[chunk, :found.shape[1]] = found
+            self.table[chunk, found.shape[1]:] = -1
+            self.reference[chunk] = self.positions[chunk]
+
+    def grow(self, width):
+        """
+        Widen the table to at least `width` neighbors per atom.
+        """
+        if width > self.table.shape[1]:
+            extra = np.full((len(self), width-self.table.shape[1]), -1, dtype=np.int32)
+            self.table = np.hstack((self.table, extra))
+
+    def neighbors_of(self, rows):
+        """
+        All table entries (alive or not) of the atoms `rows`.
+        """
+        found = self.table[rows].ravel()
+        return found[found >= 0]
+
+    def touch(self, rows):
+        """
+        Mark the atoms `rows` and their neighbors as changed, so their
+        coordination is recomputed on the next query.
+        """
+        self.dirty[rows] = True
+        self.dirty[self.neighbors_of(rows)] = True
+
+    def remove(self, rows):
+        """
+        Remove the atoms `rows` (e.g. evaporated ones). Their rows stay
+        in the table until `compact`, so they can still be walked from.
+        """
+        self.alive[rows] = False
+        self.touch(rows)
+
+    def move(self, rows, positions):
+        """
+        Set the positions of the atoms `rows`, and rebuild the rows
+        around the ones that drifted too far since their row was built.
+        """
+        rows = np.asarray(rows, dtype=int)
+        self.touch(rows)
+        self.positions[rows] = positions
+        drift = np.linalg.norm(self.positions[rows] - self.reference[rows], axis=1)
+        moved = rows[drift > self.skin/3]
+        if len(moved):
+            self.refresh(moved)
+        self.touch(rows)
+
+    def refresh(self, moved):
+        """
+        Rebuild the rows of the atoms `moved` and of every atom within
+        `radius` of them.
+        """
+        if np.count_nonzero(self.detached) + len(moved) > self.rebuild_fraction*len(self):
+            self.build()
+            return
+        found, _ = self.candidates(self.positions[moved])
+        rows = np.union1d(moved, found[found >= 0])
+        rows = rows[self.alive[rows]]
+        self.detached[rows] = True
+        self.detached_index = np.flatnonzero(self.detached & self.alive)
+        self.detached_tree = cKDTree(self.positions[self.detached_index])
+        self.fill(rows)
+        self.touch(rows)
+
+    def compact(self, keep):
+        """
+        Drop the atoms not in the mask `keep` and renumber the others
+        consecutively, in order (to follow the atom order of the next
+        `EmitterState`).
+        """
+        self.touch(np.flatnonzero(~keep))
+        new_index = np.full(len(self)+1, -1, dtype=np.int32)
+        new_index[:-1][keep] = np.arange(np.count_nonzero(keep))
+        self.table = new_index.take(self.table[keep])
+        self.tree_index = new_index[self.tree_index]
+        for name in ["positions", "reference", "alive", "detached", "dirty"]:
+            setattr(self, name, getattr(self, name)[keep])
+        for cutoff in self.coordination_cache:
+            cn, offset = self.coordination_cache[cutoff]
+            self.coordination_cache[cutoff] = (cn[keep], offset[keep])
+        if self.detached_tree is not None:
+            self.detached_index = new_index[self.detached_index]
+
+    def count_neighbors(self, rows, cutoff):
+        """
+        Number of alive neighbors within `cutoff` of the atoms `rows`,
+        and the length of the sum of the vectors to them.
+        """
+        found = self.table[rows]
+        valid = found >= 0
+        found = np.where(valid, found, 0)
+        vectors = self.positions[found] - self.positions[rows][:, None, :]
+        valid &= self.alive[found] & (np.linalg.norm(vectors, axis=2) <= cutoff)
+        vectors[~valid] = 0.0
+        return valid.sum(axis=1), np.linalg.norm(vectors.sum(axis=1), axis=1)
+
+    def coordination(self, cutoff=None):
+        """
+        Coordination number of every atom for `cutoff` (at most
+        `self.cutoff`; by default the first-shell `surface_cutoff`) and
+        the length of the sum of the vectors to its neighbors (0 for
+        atoms in a symmetric environment). Results are cached, and only
+        recomputed for atoms that changed since the last query.
+        """
+        cutoff = self.surface_cutoff if cutoff is None else cutoff
+        if cutoff > self.cutoff:
+            raise ValueError("Cutoff {} is beyond the neighbor list cutoff {}".format(
+                cutoff, self.cutoff))
+        if cutoff not in self.coordination_cache:
+            self.coordination_cache[cutoff] = (np.zeros(len(self), dtype=int),
+                                               np.zeros(len(self)))
+            rows = np.arange(len(self))
+            self.update_cache(cutoff, rows)
+        rows = np.flatnonzero(self.dirty)
+        for cached in self.coordination_cache:
+            self.update_cache(cached, rows)
+        self.dirty[:] = False
+        return self.coordination_cache[cutoff]
+
+    def update_cache(self, cutoff, rows):
+        """
+        Recompute the cached coordination of the atoms `rows`.
+        """
+        cn, offset = self.coordination_cache[cutoff]
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start+self.chunk_size]
+            cn[chunk], offset[chunk] = self.count_neighbors(chunk, cutoff)
+
+    def within(self, rows, radius):
+        """
+        Alive atoms within `radius` of any of the atoms `rows` (alive or
+        removed), found by walking the table outwards from them, so the
+        cost scales with the size of the region. Returns them in
+        increasing order with their distance to the nearest of `rows`.
+        """
+        rows = np.asarray(rows, dtype=int)
+        if len(rows) == 0:
+            return np.empty(0, dtype=int), np.empty(0)
+        sites = cKDTree(self.positions[rows])
+        visited = np.zeros(len(self), dtype=bool)
+        visited[rows] = True
+        frontier = rows
+        inside = []
+        while len(frontier):
+            found = np.unique(self.neighbors_of(frontier))
+            found = found[~visited[found]]
+            visited[found] = True
+            distance, _ = sites.query(self.positions[found])
+            frontier = found[distance <= radius]
+            inside.append(frontier)
+        region = np.sort(np.concatenate(inside))
+        region = region[self.alive[region]]
+        return region, sites.query(self.positions[region])[0]
@@ -0,0 +1,198 @@
+# This file is part of the PyVaporate package and reads and writes TAPSim
+# node files (emitter.txt, mesh.txt, updated_mesh.txt, relaxed_emitter.txt).
+#
+# A node file looks like
+#
+#     ASCII <n_nodes> 0 0
+#     x<TAB>y<TAB>z<TAB>id[<TAB>cn]
+#     ...
+#     # 10=W 20=Re
+#
+# with coordinates in meters, the region/element ID (0 = vacuum, 1 = top,
+# 2 = bottom, 3 = sides, 10, 20, ... = elements) and optionally the
+# coordination number pyvaporate tracks for each atom. The trailing
+# comment maps element IDs to element names.
+#
+# Coordinates are written with `COORDINATE_FORMAT`, ten significant
+# digits. The builders used to write the full repr of every coordinate,
+# so node files are not byte-identical with theirs (the coordinates agree
+# to ten significant digits). A change of this format changes the built
+# emitters: bump `pyvaporate.cache.BUILDER_VERSION` with it.
+
+import io
+import os
+import warnings
+
+import numpy as np
+
+NODE_FIELDS = [("x", np.float64), ("y", np.float64), ("z", np.float64),
+               ("id", np.int16), ("cn", np.int16)]
+COORDINATE_FORMAT = "%.9e"
+
+
+def node_dtype(n_columns=5):
+    """
+    The structured dtype of a node array with `n_columns` columns
+    (4 without, 5 with the coordination number column).
+    """
+    return np.dtype(NODE_FIELDS[:n_columns])
+
+
+def make_nodes(coords, ids, cn=None):
+    """
+    Pack an (n, 3) coordinate array (meters), the node IDs and,
+    optionally, coordination numbers into a structured node array.
+    """
+    nodes = np.empty(len(ids), dtype=node_dtype(4 if cn is None else 5))
+    nodes["x"], nodes["y"], nodes["z"] = coords[:, 0], coords[:, 1], coords[:, 2]
+    nodes["id"] = ids
+    if cn is not None:
+        nodes["cn"] = cn
+    return nodes
+
+
+def node_coords(nodes):
+    """
+    The (n, 3) coordinate array of a structured node array.
+    """
+    return np.column_stack((nodes["x"], nodes["y"], nodes["z"]))
+
+
+def add_cn_column(nodes, cn=0):
+    """
+    Return `nodes` with a coordination number column, set to `cn` if
+    the array does not already have one.
+    """
+    if "cn" in nodes.dtype.names:
+        return nodes
+    return make_nodes(node_coords(nodes), nodes["id"],
+                      np.full(len(nodes), cn))
+
+
+def parse_table(source, n_columns=0):
+    """
+    Parse whitespace separated numeric columns from `source` (a string
+    or an open text file, read from its current position) into a 2D
+    float array, using NumPy's C parser. Lines starting with "#" are
+    skipped. Rows with missing trailing columns (e.g. a mix of 4 and 5
+    column node lines) are padded with zeros, which falls back to a
+    slower line by line parse. `n_columns` only sets the shape of the
+    array returned for an empty table.
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    start = source.tell()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)  # empty input
+            table = np.loadtxt(source, comments="#", ndmin=2)
+    except ValueError:
+        source.seek(start)
+        rows = [line.split() for line in source
+                if line.strip() and not line.startswith("#")]
+        table = np.zeros((len(rows), max(len(row) for row in rows)))
+        for i, row in enumerate(rows):
+            table[i, :len(row)] = [float(v) for v in row]
+    if table.size == 0:
+        return np.empty((0, n_columns))
+    return table
+
+
+def parse_id_comment(comment):
+    """
+    Parse the trailing "# 10=W 20=Re" comment of a node file into
+    {"10": "W", "20": "Re"}.
+    """
+    id_names = {}
+    for token in comment.lstrip("#").split():
+        if "=" in token:
+            ID, name = token.split("=", 1)
+            id_names[ID] = name
+    return id_names
+
+
+def read_id_comment(filename, tail=4096):
+    """
+    Read the {"ID": "element"} map from the comment at the end of a node
+    file, looking only at its last `tail` bytes.
+    """
+    with open(filename, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell()-tail))
+        text = f.read().decode()
+    start = text.rfind("#")
+    return parse_id_comment(text[start:]) if start >= 0 else {}
+
+
+def read_node_file(filename):
+    """
+    Read a TAPSim node file. Returns `(nodes, id_names)`, where `nodes`
+    is a structured array with the fields x, y, z, id and (if the file
+    has a fifth column) cn, and `id_names` the {"ID": "element"} map
+    from the trailing comment (empty if there is none).
+    """
+    with open(filename) as f:
+        f.readline()  # ASCII <n_nodes> 0 0
+        start = f.tell()
+        first = f.readline()
+        n_columns = 4 if first.startswith("#") else min(max(len(first.split()), 4), 5)
+        f.seek(start)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)  # no nodes
+                nodes = np.loadtxt(f, comments="#", dtype=node_dtype(n_columns),
+                                   usecols=range(n_columns), ndmin=1)
+        except ValueError:
+            f.seek(start)
+            table = parse_table(f, n_columns)
+            nodes = np.zeros(len(table), dtype=node_dtype(n_columns))
+            for column, (field, _) in enumerate(NODE_FIELDS[:n_columns]):
+                if column < table.shape[1]:
+                    nodes[field] = table[:, column]
+    return nodes, read_id_comment(filename)
+
+
+def format_id_comment(id_names):
+    """
+    The "# 10=W 20=Re" comment line for an {"ID": "element"} map.
+    """
+    return " ".join(["#"]+["{}={}".format(ID, id_names[ID]) for ID in id_names])
+
+
+def format_nodes(nodes, fmt=COORDINATE_FORMAT, chunk_size=100000):
+    """
+    The lines of a structured node array in a node file, formatted in
+    bulk, `chunk_size` nodes at a time, as one string.
+    """
+    fields = nodes.dtype.names
+    row = "\t".join([fmt]*3 + ["%d"]*(len(fields)-3)) + "\n"
+    lines = []
+    for i in range(0, len(nodes), chunk_size):
+        chunk = nodes[i:i+chunk_size]
+        values = np.column_stack([chunk[field] for field in fields])
+        lines.append((row*len(chunk)) % tuple(values.ravel().tolist()))
+    return "".join(lines)
+
+
+def write_node_file(filename, nodes, id_names=None, fmt=COORDINATE_FORMAT,
+                    chunk_size=100000, block=None):
+    """
+    Write a structured node array (see `read_node_file`) to a TAPSim
+    node file, followed by the ID comment if `id_names` is given.
+
+    TAPSim requires the columns to be separated by tab characters (^I),
+    not regular spaces. Coordinates are written with `fmt` (the default
+    keeps ten significant digits, far below any interatomic distance)
+    and lines are formatted in bulk, `chunk_size` nodes at a time.
+
+    `block` is an optional `(n_nodes, lines)` pair of nodes already
+    formatted by `format_nodes`, written after `nodes` as they are.
+    """
+    n_block, lines = block if block is not None else (0, "")
+    with open(filename, "w") as f:
+        f.write("ASCII {} 0 0\n".format(len(nodes)+n_block))
+        for i in range(0, len(nodes), chunk_size):
+            f.write(format_nodes(nodes[i:i+chunk_size], fmt, chunk_size))
+        f.write(lines)
+        if id_names:
+            f.write("{}\n".format(format_id_comment(id_names)))
@@ -0,0 +1,201 @@
+# This file is part of the PyVaporate package and post-processes finished
+# coupling steps in the background: deleting or compressing the large
+# TAPSim/LAMMPS files and extracting per-step metrics happen on a small
+# worker pool while the next TAPSim/LAMMPS step runs.
+
+from pyvaporate.checkpoint import atomic_write
+from pyvaporate.files import cleanup, apply_retention
+from pyvaporate.state import EmitterState
+from pyvaporate.tapsim import read_results as tapsim_results
+from pyvaporate.telemetry import span
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import glob
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+
+import numpy as np
+
+METRICS = "metrics.json"
+
+# files of a step directory that are not read again once the step is done;
+# mesh.txt and mesh.cfg of step 0 are (by every later step), so are kept
+COMPRESSIBLE = ["mesh.txt", "updated_mesh.txt", "data.emitter",
+                "relaxed_emitter.lmp", "log.lammps", "cnum.dump"]
+
+
+def compress(filename, level=6):
+    """
+    Replace `filename` by `filename`.gz. The original is only removed
+    once the compressed copy is complete.
+    """
+    tmp = filename + ".gz.tmp"
+    with open(filename, "rb") as src, gzip.open(tmp, "wb", compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp, filename + ".gz")
+    os.remove(filename)
+
+
+def read_results(filename):
+    """
+    Node IDs and, where the file has them, detector coordinates (x, y;
+    NaN otherwise) of the ions in the results_data file `filename`,
+    ASCII or binary (see `pyvaporate.tapsim.read_results`).
+    """
+    results = tapsim_results(filename)
+    names = results.dtype.names
+    ids = np.asarray(results["type"], dtype=int) if "type" in names else \
+        np.zeros(len(results), dtype=int)
+    hits = np.full((len(results), 2), np.nan)
+    if "stop_y" in names:
+        hits[:, 0], hits[:, 1] = results["stop_x"], results["stop_y"]
+    return ids, hits
+
+
+def step_metrics(directory, step):
+    """
+    Metrics of the finished step in `directory`: the number of ions
+    TAPSim evaporated (in total and per element), the atoms left and
+    the height of the apex (nm). The detector hits are written to
+    detector_hits.txt.
+    """
+    state = EmitterState.from_file(os.path.join(directory, "relaxed_emitter.txt"))
+    names = {int(i): name for i, name in state.id_names.items()}
+    stride = min(names) if names else 10
+    atoms = state.atoms
+    metrics = {"step": step, "atoms": int(np.count_nonzero(atoms)),
+               "apex_nm": round(float(state.positions[atoms, 2].max()*1e9), 6) if atoms.any() else 0.0}
+
+    ids, hits = [], []
+    for filename in sorted(glob.glob(os.path.join(directory, "results_data.*"))):
+        step_ids, step_hits = read_results(filename)
+        ids.append(step_ids)
+        hits.append(step_hits)
+    ids = np.concatenate(ids) if ids else np.empty(0, dtype=int)
+    hits = np.vstack(hits) if hits else np.empty((0, 2))
+    metrics["evaporated"] = len(ids)
+    for base_id, name in sorted(names.items()):
+        metrics["evaporated_" + name] = int(np.count_nonzero(ids//stride*stride == base_id))
+    detected = np.isfinite(hits).all(axis=1)
+    if detected.any():
+        np.savetxt(os.path.join(directory, "detector_hits.txt"),
+                   np.column_stack((ids[detected], hits[detected])),
+                   fmt=["%d", "%.6e", "%.6e"], header="id x y")
+    return metrics
+
+
+def processed(directory):
+    """
+    Whether the step in `directory` has been post-processed.
+    """
+    return os.path.exists(os.path.join(directory, METRICS))
+
+
+class PostProcessor:
+    """
+    Background post-processing of the step directories of the run in
+    `root`, configured by the "postprocess" section of `setup`:
+
+        workers      threads working on finished steps (0: work inline)
+        max_pending  steps queued or in work before `submit` blocks
+        compress     gzip the files no later step reads
+
+    and by `setup["cleanup"]` (delete the trajectory files) and the
+    retention policy of `setup` (see `pyvaporate.files.apply_retention`),
+    applied to the processed steps. Every processed step gets a
+    metrics.json, and `close` collects them all into root/metrics.csv.
+    The work is mostly file I/O and zlib, which release the GIL, so
+    threads overlap with the simulation well enough.
+    Errors are logged to `log` and do not stop the run. The work on
+    each step is recorded as a span of `telemetry`.
+    """
+
+    def __init__(self, root, setup, log=print, telemetry=None):
+        options = setup.get("postprocess", {})
+        self.root = root
+        self.setup = setup
+        self.log = log
+        self.telemetry = telemetry
+        self.cleanup = setup.get("cleanup", False) == True
+        self.compress = options.get("compress", False) == True
+        self.workers = int(options.get("workers", 1))
+        self.max_pending = max(1, int(options.get("max_pending", 2)))
+        self.pool = ThreadPoolExecutor(self.workers) if self.workers > 0 else None
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+
+    def submit(self, directory, step):
+        """
+        Queue the finished step `step` in `directory`. Blocks while
+        `max_pending` steps are still waiting (backpressure).
+        """
+        if self.pool is None:
+            self.process(directory, step)
+            return
+        if not self.slots.acquire(blocking=False):
+            start = time.time()
+            self.slots.acquire()
+            self.log("Waited {:.1f} s for post-processing".format(time.time()-start))
+        future = self.pool.submit(self.process, directory, step)
+        future.add_done_callback(lambda f: self.slots.release())
+
+    def submit_unprocessed(self, steps):
+        """
+        Queue the steps of `steps` (numbers) that have no metrics yet,
+        e.g. the ones an interrupted run had not processed.
+        """
+        for step in steps:
+            directory = os.path.join(self.root, str(step))
+            if not processed(directory):
+                self.submit(directory, step)
+
+    def process(self, directory, step):
+        """
+        Clean up, compress and extract the metrics of one step, then
+        apply the retention policy.
+        """
+        try:
+            with span(self.telemetry, "postprocess", directory):
+                if self.cleanup:
+                    cleanup(directory)
+                metrics = step_metrics(directory, step)
+                if self.compress:
+                    for name in COMPRESSIBLE:
+                        filename = os.path.join(directory, name)
+                        if os.path.isfile(filename) and not (step == 0 and name == "mesh.txt"):
+                            compress(filename)
+                atomic_write(os.path.join(directory, METRICS), json.dumps(metrics, indent=1))
+                freed = apply_retention(self.root, step, self.setup, processed)
+            if freed:
+                self.log("Retention policy removed {:.1f} MB of step files".format(freed/1e6))
+        except Exception:
+            self.log("Post-processing of step {} failed:\n{}".format(
+                step, traceback.format_exc()))
+
+    def close(self):
+        """
+        Wait for all queued steps and write root/metrics.csv.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        rows = []
+        for d in os.listdir(self.root):
+            marker = os.path.join(self.root, d, METRICS)
+            if d.isdigit() and os.path.isfile(marker):
+                with open(marker) as f:
+                    rows.append(json.load(f))
+        if not rows:
+            return
+        rows.sort(key=lambda row: row["step"])
+        fieldnames = []
+        for row in rows:
+            fieldnames += [key for key in row if key not in fieldnames]
+        with open(os.path.join(self.root, "metrics.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -3,6 +3,8 @@
 # Gives a 2D top-down view of the detector hits - showing where atoms hit the detector surface
 # after being field evaporarted from the emitter tip.
 
+from pyvaporate.tapsim import read_results
+
 import os
 import matplotlib
 matplotlib.use("Agg")
@@ -26,16 +28,12 @@ def plot_detector_hits(filename="detector_hits.png", xlim=(-0.15, 0.15),
 
     for f in results_files:
         try:
-            # reads each result file line by line containing information
+            # reads each result file (ASCII or binary) containing information
             # about a detected atom - its x and y coordinates on the detector
-            tapsim_results = open(f).readlines()
-            for line in tapsim_results[2:]:
-                split_line = line.split()
-                if not "#" in split_line[0] and not split_line[0]=="ASCII":
-                    ids.append(split_line[0])
-                    detector_hits.append(
-                        (float(split_line[7]), float(split_line[8]))
-                    )
+            tapsim_results = read_results(f)
+            ids += list(tapsim_results["type"])
+            detector_hits += list(zip(tapsim_results["stop_x"],
+                                      tapsim_results["stop_y"]))
         except Exception as e:
             print(e)
 
@@ -6,154 +6,297 @@
 4. Relaxation steps using LAMMPS
 5. Iterative stepwise simulation until the emitter is fully evaporated
 """
-from monty.serialization import loadfn
-
 from pyvaporate.build import build_emitter_from_scratch, build_emitter_from_file
-from pyvaporate.call import call_meshgen, call_tapsim, call_lammps
-from pyvaporate import SETUP
+from pyvaporate.call import call_meshgen, call_tapsim, call_lammps, write_mesh_cfg
+from pyvaporate.md import lammps_backend
+from pyvaporate.cache import emitter_cache, cache_key, detach
+from pyvaporate.checkpoint import (setup_digest, write_checkpoint, last_checkpoint,
+                                   discard_steps_after, clear_checkpoints)
+from pyvaporate.context import RunContext
+from pyvaporate.files import share_file
+from pyvaporate.pipeline import PostProcessor
+from pyvaporate.schedule import RelaxationScheduler
+from pyvaporate.state import EmitterState
+from pyvaporate.store import RunStore, store_file
+from pyvaporate.tapsim import binary_output
+from pyvaporate.evaluate import cn_bins, id_stride, CN_CUTOFF
+from pyvaporate.neighbors import NeighborList
 
 import os
-import sys
-from contextlib import contextmanager
+import shutil
 
 import numpy as np
 import math
 
 
-@contextmanager
-def redirected(stdout):
-    saved_stdout = sys.stdout
-    sys.stdout = open(stdout, 'a')
-    yield
-    sys.stdout = saved_stdout
-
-
-def yaml_run(config_file):
+def yaml_run(config_file, root=None, resume=False):
     """
     The main wrapper function for calling Pyvaporate
     based on a yaml input file (`config_file`).
 
-    The stdout is written to pyvaporate.log in the
-    head directory (same location as the yaml file).
+    The run lives in `root` (by default the working directory, which
+    is never changed), and its output is written to pyvaporate.log
+    there. Several runs can go on at once in one process as long as
+    their roots differ.
+
+    With `resume`, a run interrupted in `root` continues after its last
+    complete step (see `pyvaporate.checkpoint`), if it was started with
+    the same configuration; otherwise it starts over.
     """
 
     # --------- STEP 1: Load the configuration --------- #
-    CONFIGURATION = loadfn(config_file)
-    for key in SETUP:
-        if key in CONFIGURATION:
-            SETUP[key] = CONFIGURATION[key]
-    with open("pyvaporate.log", "w") as log: # logging setup
-        log.write("")
-    # retriving executable paths    
-    lammps = SETUP["lammps"]["bin"]
-    tapsim = SETUP["evaporation"]["meshgen_bin"]
-    meshgen = SETUP["evaporation"]["tapsim_bin"]
-    n_events_total = SETUP["evaporation"]["total_events"]
-    n_events_per_step = SETUP["evaporation"]["events_per_step"]
+    context = RunContext.from_yaml(config_file, root, resume)
+    try:
+        run(context, resume)
+    finally:
+        context.close()
+
+
+def run(context, resume=False):
+    """
+    Build the emitter and run the coupled TAPSim/LAMMPS evaporation
+    described by the `RunContext` `context`, or with `resume`, pick an
+    interrupted run up after its last checkpointed step. Every step is
+    checkpointed once its relaxed_emitter.txt is written, appended to
+    the run store if one is configured (see `pyvaporate.store`), and
+    then post-processed in the background (see
+    `pyvaporate.pipeline.PostProcessor`) while the next one runs.
+    """
+
+    setup = context.setup
+    log = context.log
+    digest = setup_digest(setup)
+    binary_output(setup)  # refuses binary TAPSim output without a confirmed layout
+
+    setup["id_dict"] = {}
+    stride = id_stride(cn_bins(setup))  # one ID per coordination class
+    n = stride
+    for e in setup["emitter"]["elements"]:
+        setup["id_dict"][str(n)] = e
+        n += stride
+
+    checkpoint = last_checkpoint(context.root, digest) if resume else None
+    pipeline = PostProcessor(context.root, setup, log, context.telemetry)
+    store = open_store(context, checkpoint)
+    md = None
+    try:
+        md = lammps_backend(setup, context.directory(
+            0 if checkpoint is None else checkpoint["step"]))
+        run_steps(context, checkpoint, digest, stride, pipeline, store, md)
+    finally:
+        if md is not None:
+            md.close()
+        pipeline.close()
+        if store is not None:
+            store.close()
+    log("\n------\nEvaporation complete.")
+
+
+def open_store(context, checkpoint):
+    """
+    The `RunStore` configured for the run of `context`, or None. It is
+    started over, or cut back to the step of `checkpoint`.
+    """
+    filename = store_file(context.setup, context.root)
+    if filename is None:
+        return None
+    config = context.setup["store"]
+    if checkpoint is None and os.path.exists(filename):
+        os.remove(filename)
+    store = RunStore(filename, "a", config.get("keyframe_every", 20),
+                     config.get("compression", 4))
+    if checkpoint is not None:
+        store.truncate(checkpoint["step"])
+    return store
+
+
+def run_steps(context, checkpoint, digest, stride, pipeline, store=None, md=None):
+    """
+    The evaporation loop of `run`, starting over or after `checkpoint`.
+    Every finished step is appended to `store` and handed to `pipeline`.
+    The relaxations run in the persistent LAMMPS `md` if one is given
+    (see `pyvaporate.md.lammps_backend`); `run` closes it.
+    """
+
+    setup = context.setup
+    log = context.log
+    telemetry = context.telemetry
+    if checkpoint is None:
+        clear_checkpoints(context.root)
+        state = initial_state(context, stride)
+        # --------- STEP 4: LAMMPS Relaxation ------------- #
+        with telemetry.span("step", context.directory(0)):
+            log("Running LAMMPS")
+            state = call_lammps(np.count_nonzero(state.atoms), setup, state, md,
+                                context.directory(0), log, telemetry=telemetry)
+            with telemetry.span("checkpoint", context.directory(0)):
+                write_checkpoint(context.directory(0), 0, setup, digest,
+                                 state.neighbors)
+            if store is not None:
+                with telemetry.span("store", context.directory(0)):
+                    store.append(0, state, context.directory(0))
+        pipeline.submit(context.directory(0), 0)
+        step_number = 1
+    else:
+        last = checkpoint["step"]
+        log("Resuming after step {}".format(last))
+        discard_steps_after(context.root, last)
+        setup["evaporation"]["total_events"] = checkpoint["total_events"]
+        setup["evaporation"]["events_per_step"] = checkpoint["events_per_step"]
+        with telemetry.span("resume", context.directory(last)):
+            state = EmitterState.from_file(context.path(str(last), "relaxed_emitter.txt"))
+            state.id_names = setup["id_dict"]
+            # with the distances of the list the run started with
+            state.neighbors = NeighborList(state.positions[state.atoms]*1e10,
+                                           cutoff=CN_CUTOFF, nn=checkpoint.get("nn"),
+                                           surface_cutoff=checkpoint.get("surface_cutoff"))
+        pipeline.submit_unprocessed(range(last+1))
+        step_number = last + 1
+
+    # --------- STEP 5: Main Evaporation Loop --------- #
+    first = context.directory(0)
+    scheduler = RelaxationScheduler(setup, log)
+    scheduler.reset(state)
+    events_per_step = setup["evaporation"]["events_per_step"]
+    total_events = setup["evaporation"]["total_events"]
+    handoff = None
+    while step_number * events_per_step <= total_events:
+        directory = context.directory(step_number)
+        log("\nSTEP {}\n------".format(step_number))
+        with telemetry.span("step", directory):
+            with telemetry.span("handoff", directory):
+                # linked, not copied, where possible; never written in place
+                method = share_file(context.path(str(step_number-1), "relaxed_emitter.txt"),
+                                    os.path.join(directory, "mesh.txt"))
+                share_file(os.path.join(first, "mesh.cfg"),
+                           os.path.join(directory, "mesh.cfg"))
+            if method != handoff:
+                log("Handing the emitter on by {}".format(method))
+                handoff = method
+
+            log("Running TAPSim")
+            n_atoms = np.count_nonzero(state.atoms)
+            call_tapsim(setup, state, directory, telemetry)
+            with telemetry.span("schedule", directory):
+                relax = scheduler.should_relax(
+                    state, final=(step_number+1) * events_per_step > total_events)
+            if relax:
+                log("Running LAMMPS")
+            state = call_lammps(n_atoms, setup, state, md, directory, log, relax,
+                                telemetry)
+            if relax:
+                scheduler.reset(state)
+            with telemetry.span("checkpoint", directory):
+                write_checkpoint(directory, step_number, setup, digest,
+                                 state.neighbors)
+            if store is not None:
+                with telemetry.span("store", directory):
+                    store.append(step_number, state, directory)
+        pipeline.submit(directory, step_number)
+
+        step_number += 1
+    if scheduler.adaptive:
+        log("Relaxed after {} of {} steps".format(scheduler.relaxations,
+                                                  scheduler.steps))
+
+
+def initial_state(context, stride):
+    """
+    Build (or take from the cache) the emitter and its mesh in step
+    directory 0 and resolve percentages in the event counts. Returns
+    the `EmitterState` of the emitter, before its first relaxation.
+    """
+
+    setup = context.setup
+    log = context.log
+    telemetry = context.telemetry
+    n_events_total = setup["evaporation"]["total_events"]
+    n_events_per_step = setup["evaporation"]["events_per_step"]
 
     # setting up alloy composition
-    elements = [e for e in SETUP["emitter"]["elements"]]
+    elements = [e for e in setup["emitter"]["elements"]]
     alloy = {}
-    SETUP["id_dict"] = {}
-    n = 10
-    for e in elements:
-        SETUP["id_dict"][str(n)] = e
-        n += 10
+    sro = {}
     if len(elements) > 1:
         for e in elements[1:]:
-            alloy[e] = SETUP["emitter"]["elements"][e]["fract_occ"]
-
-    if not os.path.isdir("0"):
-        os.mkdir("0")
-    os.chdir("0")
-
-    # --------- STEP 2: Emitter creation --------- #
-    if SETUP["emitter"]["source"]["node_file"] == "none" and SETUP["emitter"]["source"]["uc_file"] == "none":
-        with redirected(stdout="../pyvaporate.log"):
-            print("Building initial emitter")
-        basis = SETUP["emitter"]["basis"]
-        emitter_radius = SETUP["emitter"]["radius"]
-        emitter_side_height = SETUP["emitter"]["side_height"]
-        z_axis = SETUP["emitter"]["orientation"]["z"]
-        y_axis = SETUP["emitter"]["orientation"]["y"]
-        x_axis = SETUP["emitter"]["orientation"]["x"]
-        build_emitter_from_scratch(
-            element=elements[0], basis=basis, z_axis=z_axis,
-            filename="emitter.txt", emitter_radius=emitter_radius,
-            emitter_side_height=emitter_side_height, alloy=alloy
-        )
-    elif SETUP["emitter"]["source"]["node_file"] != "none":
-        with redirected(stdout="pyvaporate.log"):
-            print("Importing emitter from {}".format(SETUP["emitter"]["source"]["node_file"]))
-        os.system("cp {} ./emitter.txt".format(SETUP["emitter"]["source"]["node_file"]))
-
-    elif SETUP["emitter"]["source"]["uc_file"] != "none":
-        with redirected(stdout="../pyvaporate.log"):
-            print("Building emitter based on {}".format(SETUP["emitter"]["source"]["uc_file"]))
-        emitter_radius = SETUP["emitter"]["radius"]
-        emitter_side_height = SETUP["emitter"]["side_height"]
-        z_axis = SETUP["emitter"]["orientation"]["z"]
-        y_axis = SETUP["emitter"]["orientation"]["y"]
-        x_axis = SETUP["emitter"]["orientation"]["x"]
-        build_emitter_from_file(
-            SETUP["emitter"]["source"]["uc_file"], z_axis=z_axis,
-            filename="emitter.txt", emitter_radius=emitter_radius,
-            emitter_side_height=emitter_side_height
-        )
-    # --------- STEP 3: Mesh Generation --------- #    
-    with redirected(stdout="../pyvaporate.log"):
-        print("Running Meshgen")
-        call_meshgen(SETUP, "emitter.txt")
-    n_atoms = len([l for l in open("emitter.txt").readlines()[1:-1] if
-                   l.split()[3] not in ["0", "1", "2", "3"]])
+            alloy[e] = setup["emitter"]["elements"][e]["fract_occ"]
+            # "none" or null: no short-range-order target, no fixed seed
+            if setup["emitter"]["elements"][e].get("sro", "none") not in ("none", None):
+                sro[e] = setup["emitter"]["elements"][e]["sro"]
+    seed = setup["emitter"].get("seed", "none")
+    seed = None if seed in ("none", None) else int(seed)
+
+    first = context.directory(0)
+    emitter_file = os.path.join(first, "emitter.txt")
+
+    # reuse the emitter and mesh of an earlier run with the same build inputs
+    cache = emitter_cache(setup)
+    if cache is not None:
+        key = cache_key(setup)
+        with telemetry.span("cache", first):
+            cache_hit = cache.restore(key, first)
+    else:
+        cache_hit = False
+
+    if cache_hit:
+        log("Reusing cached emitter and mesh {}".format(key))
+        write_mesh_cfg(setup, first)
+    else:
+        # step 0 of an earlier run may hold hardlinks into the cache
+        detach(first)
+        # --------- STEP 2: Emitter creation --------- #
+        with telemetry.span("build", first, ["emitter.txt"]):
+            source = setup["emitter"]["source"]
+            if source["node_file"] == "none" and source["uc_file"] == "none":
+                log("Building initial emitter")
+                basis = setup["emitter"]["basis"]
+                emitter_radius = setup["emitter"]["radius"]
+                emitter_side_height = setup["emitter"]["side_height"]
+                z_axis = setup["emitter"]["orientation"]["z"]
+                y_axis = setup["emitter"]["orientation"]["y"]
+                x_axis = setup["emitter"]["orientation"]["x"]
+                build_emitter_from_scratch(
+                    element=elements[0], basis=basis, z_axis=z_axis,
+                    filename=emitter_file, emitter_radius=emitter_radius,
+                    emitter_side_height=emitter_side_height, alloy=alloy,
+                    seed=seed, sro=sro, log=log
+                )
+            elif source["node_file"] != "none":
+                log("Importing emitter from {}".format(source["node_file"]))
+                shutil.copyfile(os.path.expanduser(source["node_file"]), emitter_file)
+
+            elif source["uc_file"] != "none":
+                log("Building emitter based on {}".format(source["uc_file"]))
+                emitter_radius = setup["emitter"]["radius"]
+                emitter_side_height = setup["emitter"]["side_height"]
+                z_axis = setup["emitter"]["orientation"]["z"]
+                y_axis = setup["emitter"]["orientation"]["y"]
+                x_axis = setup["emitter"]["orientation"]["x"]
+                build_emitter_from_file(
+                    source["uc_file"], z_axis=z_axis,
+                    filename=emitter_file, emitter_radius=emitter_radius,
+                    emitter_side_height=emitter_side_height
+                )
+        # --------- STEP 3: Mesh Generation --------- #
+        log("Running Meshgen")
+        with telemetry.span("meshgen", first, ["mesh.txt"]):
+            call_meshgen(setup, emitter_file, first)
+        if cache is not None:
+            cache.store(key, first)
+    # the emitter is carried in memory from here on
+    state = EmitterState.from_file(emitter_file)
+    state.id_names = setup["id_dict"]
+    if stride != 10:  # the builders number elements 10, 20, ...
+        state.ids[state.atoms] = state.ids[state.atoms]//10*stride
+    n_atoms = np.count_nonzero(state.atoms)
+    # neighbor list of the atoms, updated around the changes every step
+    state.neighbors = NeighborList(state.positions[state.atoms]*1e10,
+                                   cutoff=CN_CUTOFF)
 
     if "%" in str(n_events_total):
         total_percent = float(n_events_total.replace("%",""))/100.
-        SETUP["evaporation"]["total_events"] = math.ceil(total_percent * n_atoms)
+        setup["evaporation"]["total_events"] = math.ceil(total_percent * n_atoms)
     if "%" in str(n_events_per_step):
         step_percent = float(n_events_per_step.replace("%",""))/100.
-        SETUP["evaporation"]["events_per_step"] = math.ceil(step_percent * n_atoms)
-
-    lines = open("emitter.txt").readlines()
-    with open("updated_mesh.txt", "w") as f:
-        f.write(lines[0])
-        for l in lines[1:]:
-            split_line = l.split()
-            split_line.append("0\n")
-            f.write(" ".join(split_line))
-        f.write("# 10=Al")
-    # --------- STEP 4: LAMMPS Relaxation ------------- #
-    with redirected(stdout="../pyvaporate.log"):
-        print("Running LAMMPS")
-        call_lammps(n_atoms, SETUP)
-    os.chdir("../")
-
-    # --------- STEP 5: Main Evaporation Loop --------- #
-    step_number = 1
-    while step_number * SETUP["evaporation"]["events_per_step"] <= SETUP["evaporation"]["total_events"]:
-        if not os.path.isdir(str(step_number)):
-            os.mkdir(str(step_number))
-        os.chdir(str(step_number))
-        with redirected(stdout="../pyvaporate.log"):
-            print("\nSTEP {}\n------".format(step_number))
-        os.system("cp ../{}/relaxed_emitter.txt mesh.txt".format(step_number-1))
-        os.system("cp ../0/mesh.cfg .")
-
-        with redirected(stdout="../pyvaporate.log"):
-            print("Running TAPSim")
-        call_tapsim(SETUP)
-        n_atoms = len([l for l in open("mesh.txt").readlines()[1:-1] if
-                       l.split()[3] not in ["0", "1", "2", "3"]])
-        with redirected(stdout="../pyvaporate.log"):
-            print("Running LAMMPS")
-            call_lammps(n_atoms, SETUP)
-        if SETUP["cleanup"] == True:
-            os.system("rm trajectory_data.*")
-            os.system("rm dump.*")
-            os.system("rm dump")
-            os.system("rm geometry.dat")
-
-        step_number += 1
-        os.chdir("../")
-    with redirected(stdout="pyvaporate.log"):
-        print("\n------\nEvaporation complete.")
\ No newline at end of file
+        setup["evaporation"]["events_per_step"] = math.ceil(step_percent * n_atoms)
+    return state
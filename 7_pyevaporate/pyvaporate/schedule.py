@@ -0,0 +1,136 @@
+# This file is part of the PyVaporate package and decides after which
+# TAPSim steps the emitter is relaxed. LAMMPS is the expensive half of a
+# coupling step, so with an adaptive schedule it is only called once the
+# evaporated atoms have disturbed the surface enough, measured cheaply
+# from the atom positions.
+
+from pyvaporate.evaluate import CN_CUTOFF
+
+from scipy.spatial import cKDTree
+
+import numpy as np
+
+
+def schedule_setting(config, key, default="none"):
+    """
+    Value of `key` in the schedule section `config`, None if "none".
+    """
+    value = config.get(key, default)
+    return None if value == "none" else float(value)
+
+
+class RelaxationScheduler:
+    """
+    Decides, after every TAPSim step, whether `call_lammps` relaxes the
+    emitter or only takes the evaporated atoms out of it, following
+    `setup["lammps"]["schedule"]`:
+
+        adaptive        false: relax after every step
+        min_events      events since the last relaxation before the next
+                        one may happen ...
+        max_events      ... and after which it always happens
+                        ("none": 10 steps)
+        max_cn_drop     relax once an atom lost this many neighbors
+        broken_bonds    relax once this many bonds of surviving atoms
+                        to evaporated ones were broken
+        apex_recession  relax once the highest atom is this far
+                        (Angstroms) below the one of the last relaxation
+
+    The measures cover all evaporations since the last relaxation.
+    Atoms do not move between relaxations, so they are kept as the
+    positions of the evaporated sites and of the atoms next to them.
+    Every decision goes to `log`.
+    """
+
+    def __init__(self, setup, log=print):
+        config = setup["lammps"].get("schedule", {})
+        events_per_step = int(setup["evaporation"]["events_per_step"])
+        self.adaptive = config.get("adaptive", False) == True
+        self.min_events = schedule_setting(config, "min_events", 0) or 0
+        self.max_events = schedule_setting(config, "max_events") or 10*events_per_step
+        self.thresholds = {
+            "max_cn_drop": schedule_setting(config, "max_cn_drop", 2),
+            "broken_bonds": schedule_setting(config, "broken_bonds"),
+            "apex_recession": schedule_setting(config, "apex_recession"),
+        }
+        self.log = log
+        self.steps = 0
+        self.relaxations = 0
+        self.reset()
+
+    def reset(self, state=None):
+        """
+        Forget the evaporations so far (after a relaxation of `state`).
+        """
+        self.events = 0
+        self.sites = np.empty((0, 3))
+        self.disturbed = np.empty((0, 3))
+        self.apex = None
+        if state is not None and state.atoms.any():
+            self.apex = state.positions[state.atoms, 2].max()*1e10
+
+    def measure(self, state):
+        """
+        Add the atoms TAPSim evaporated from `state` to the sites and
+        return the disturbance measures since the last relaxation.
+        """
+        sites = state.positions[state.evaporated]*1e10
+        self.events += len(sites)
+        self.sites = np.vstack((self.sites, sites))
+        nodes = np.flatnonzero(state.atoms | state.evaporated)
+        neighbors = state.neighbors
+        if neighbors is not None and len(neighbors) == len(nodes) and len(sites):
+            rows, _ = neighbors.within(np.flatnonzero(state.evaporated[nodes]), CN_CUTOFF)
+            near = neighbors.positions[rows]
+        elif len(sites):
+            atoms = state.positions[state.atoms]*1e10
+            near = atoms[np.unique(np.concatenate(
+                cKDTree(atoms).query_ball_point(sites, CN_CUTOFF)).astype(int))]
+        else:
+            near = np.empty((0, 3))
+        self.disturbed = np.unique(np.vstack((self.disturbed, near)), axis=0)
+
+        measures = {"max_cn_drop": 0, "broken_bonds": 0, "apex_recession": 0.0}
+        if len(self.sites):
+            sites = cKDTree(self.sites)
+            # atoms evaporated since they were disturbed sit on a site
+            gone = np.isfinite(sites.query(self.disturbed, distance_upper_bound=1e-6)[0])
+            self.disturbed = self.disturbed[~gone]
+            lost = sites.query_ball_point(self.disturbed, CN_CUTOFF, return_length=True)
+            if len(lost):
+                measures["max_cn_drop"] = int(lost.max())
+                measures["broken_bonds"] = int(lost.sum())
+        if self.apex is not None and state.atoms.any():
+            measures["apex_recession"] = max(
+                0.0, self.apex - state.positions[state.atoms, 2].max()*1e10)
+        return measures
+
+    def should_relax(self, state, final=False):
+        """
+        Whether to relax `state` after the TAPSim step that evaporated
+        the atoms flagged in it. The `final` step is always relaxed.
+        """
+        self.steps += 1
+        if not self.adaptive:
+            self.relaxations += 1
+            return True
+        measures = self.measure(state)
+        reached = [name for name, threshold in self.thresholds.items()
+                   if threshold is not None and measures[name] >= threshold]
+        if final:
+            reason = "last step"
+        elif self.events >= self.min_events and reached:
+            reason = ", ".join(reached)
+        elif self.events >= self.max_events:
+            reason = "max_events"
+        else:
+            reason = None
+        self.log("{} after {} events (max CN drop {}, broken bonds {}, "
+                 "apex recession {:.2f} A){}".format(
+                     "Relaxing" if reason else "Not relaxing", self.events,
+                     measures["max_cn_drop"], measures["broken_bonds"],
+                     measures["apex_recession"],
+                     ": " + reason if reason else ""))
+        if reason:
+            self.relaxations += 1
+        return reason is not None
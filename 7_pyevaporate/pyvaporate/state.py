@@ -0,0 +1,120 @@
+# This file is part of the PyVaporate package and holds the emitter in
+# memory between the TAPSim and LAMMPS halves of a coupling step, so that
+# it only has to be written out in the formats the external binaries read.
+
+from pyvaporate.nodes import (read_node_file, write_node_file, make_nodes,
+                              node_coords)
+
+import numpy as np
+
+# regions of the mesh, as returned by `EmitterState.region`
+VACUUM, TOP, BOTTOM, SIDES, ATOM = 0, 1, 2, 3, 4
+
+
+class EmitterState:
+    """
+    The nodes of a TAPSim mesh as NumPy arrays:
+
+        positions  (n, 3) float, meters
+        ids        int, node ID (0 = vacuum, 1 = top, 2 = bottom,
+                   3 = sides, 10, 20, ... = elements, plus the CN tag)
+        cn         int, coordination number of atoms
+        evaporated bool, atoms removed by TAPSim during this step
+
+    and `id_names`, the {"ID": "element"} map of the node file comment.
+    `neighbors` can hold the `pyvaporate.neighbors.NeighborList` of the
+    atoms, carried from step to step by `call_lammps`; its rows are the
+    atoms and the atoms evaporated during this step, in node order.
+    After `call_lammps`, `parents` holds the row of each atom among the
+    atoms (and evaporated atoms) of the state the step started from,
+    since atoms are only ever removed, never reordered.
+    """
+
+    def __init__(self, positions, ids, cn=None, evaporated=None,
+                 id_names=None):
+        n = len(ids)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(n, 3)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.cn = np.zeros(n, dtype=np.int64) if cn is None else \
+            np.asarray(cn, dtype=np.int64)
+        self.evaporated = np.zeros(n, dtype=bool) if evaporated is None else \
+            np.asarray(evaporated, dtype=bool)
+        self.id_names = dict(id_names or {})
+        self.neighbors = None
+        self.parents = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_nodes(cls, nodes, id_names=None):
+        """
+        State of a structured node array (see `pyvaporate.nodes`).
+        """
+        cn = nodes["cn"] if "cn" in nodes.dtype.names else None
+        return cls(node_coords(nodes), nodes["id"], cn, id_names=id_names)
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        State of a TAPSim node file.
+        """
+        return cls.from_nodes(*read_node_file(filename))
+
+    def to_nodes(self):
+        """
+        Structured node array (with CN column) of the state.
+        """
+        return make_nodes(self.positions, self.ids, self.cn)
+
+    def write(self, filename):
+        """
+        Write the state to a TAPSim node file.
+        """
+        write_node_file(filename, self.to_nodes(), self.id_names)
+
+    @property
+    def atoms(self):
+        """
+        Mask of the (not evaporated) atoms, i.e. nodes with ID > 3.
+        """
+        return self.ids > SIDES
+
+    @property
+    def region(self):
+        """
+        VACUUM, TOP, BOTTOM, SIDES or ATOM for every node.
+        """
+        return np.minimum(self.ids, ATOM)
+
+    def subset(self, mask):
+        """
+        New state with only the nodes in `mask` (boolean or indices).
+        """
+        return EmitterState(self.positions[mask], self.ids[mask],
+                            self.cn[mask], self.evaporated[mask],
+                            self.id_names)
+
+    def concatenate(self, other):
+        """
+        New state with the nodes of `other` appended.
+        """
+        return EmitterState(
+            np.concatenate((self.positions, other.positions)),
+            np.concatenate((self.ids, other.ids)),
+            np.concatenate((self.cn, other.cn)),
+            np.concatenate((self.evaporated, other.evaporated)),
+            self.id_names or other.id_names
+        )
+
+    def evaporate(self, indices):
+        """
+        Turn the atoms at `indices` into vacuum nodes (ID 0, CN 0).
+        Returns the indices that had not already been evaporated.
+        """
+        indices = np.unique(indices)
+        indices = indices[~self.evaporated[indices]]
+        self.evaporated[indices] = True
+        self.ids[indices] = VACUUM
+        self.cn[indices] = 0
+        return indices
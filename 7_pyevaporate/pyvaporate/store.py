@@ -0,0 +1,270 @@
+# This file is part of the PyVaporate package and keeps a whole run in one
+# HDF5 file: per step, the evaporation events, the atom positions (stored
+# as float32 changes since the previous step, with full keyframes every
+# few steps), the CN-tagged IDs and the timing, in chunked, compressed
+# datasets with random access by step. It needs h5py, which is only
+# imported when a store is used.
+
+from pyvaporate.pipeline import read_results
+from pyvaporate.telemetry import TELEMETRY
+
+import glob
+import json
+import os
+
+import numpy as np
+
+# index datasets, one entry per stored step
+INDEX = ["step", "n_atoms", "keyframe", "atom_offset", "position_offset",
+         "removed_offset", "n_removed", "event_offset", "n_events"]
+# appendable data: dtype (None: string) and row shape
+DATA = {
+    "ids": (np.int32, ()),            # CN-tagged IDs of the atoms
+    "keyframes": (np.float64, (3,)),  # positions (A) of keyframe steps
+    "deltas": (np.float32, (3,)),     # position changes (A) of the others
+    "removed": (np.int32, ()),        # rows of the previous step's atoms removed
+    "events": (np.float64, (3,)),     # TAPSim ID and detector x, y of each ion
+    "timing": (None, ()),             # telemetry spans of the step (JSON)
+}
+
+
+def store_file(setup, root):
+    """
+    Path of the run store of the run in `root` configured by
+    `setup["store"]`, or None if it is disabled (format: none).
+    """
+    config = setup.get("store", {})
+    if config.get("format", "none") == "none":
+        return None
+    if config["format"] != "hdf5":
+        raise ValueError("Unknown run store format {}".format(config["format"]))
+    return os.path.join(root, os.path.expanduser(config.get("file", "run.h5")))
+
+
+def step_events(directory):
+    """
+    TAPSim ID and detector x, y (NaN if not reported) of the ions in
+    the results_data files of `directory`, as an (n, 3) array.
+    """
+    events = [np.empty((0, 3))]
+    for filename in sorted(glob.glob(os.path.join(directory, "results_data.*"))):
+        ids, hits = read_results(filename)
+        events.append(np.column_stack((ids, hits)))
+    return np.vstack(events)
+
+
+class RunStore:
+    """
+    Run store in the HDF5 file `filename`, opened for reading ("r") or
+    appending ("a"). Steps are appended in order with `append` and read
+    back by step number with `positions`, `ids`, `removed`, `events` and
+    `timing`.
+
+    Positions (Angstroms) are stored in full for the first step, every
+    `keyframe_every`-th step and any step not following the one before
+    it, and otherwise as float32 changes of the atoms carried on from
+    the previous step (see `EmitterState.parents`). The writer keeps
+    the positions the way a reader reconstructs them and stores the
+    changes relative to those, so rounding errors do not add up.
+
+    The index of a step is only written once all its data is, and the
+    file is flushed after every step; data of a step cut short is
+    overwritten by the next `append`. `truncate` drops the steps after
+    a given one, e.g. when a run is resumed.
+    """
+
+    def __init__(self, filename, mode="r", keyframe_every=20, compression=4):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("The run store needs h5py (pip install h5py)")
+        self.filename = filename
+        self.file = h5py.File(filename, mode)
+        self.keyframe_every = keyframe_every
+        if mode != "r" and "index" not in self.file:
+            index = self.file.create_group("index")
+            for name in INDEX:
+                index.create_dataset(name, (0,), dtype=np.int64, maxshape=(None,),
+                                     chunks=(4096,))
+            data = self.file.create_group("data")
+            for name, (dtype, shape) in DATA.items():
+                string = dtype is None
+                data.create_dataset(
+                    name, (0,) + shape, maxshape=(None,) + shape,
+                    dtype=h5py.string_dtype() if string else dtype,
+                    chunks=(256 if string else 65536,) + shape,
+                    compression="gzip", compression_opts=compression,
+                    shuffle=not string)
+        self.previous = None  # positions of the last step, as read back
+        if mode != "r" and len(self):
+            self.previous = self.positions(self.steps[-1])
+
+    def __len__(self):
+        return len(self.file["index/step"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def steps(self):
+        """
+        The stored step numbers, in order.
+        """
+        return self.file["index/step"][:]
+
+    def index(self, step):
+        """
+        The index entries of step `step`.
+        """
+        rows = np.flatnonzero(self.steps == step)
+        if len(rows) == 0:
+            raise KeyError("Step {} is not in {}".format(step, self.filename))
+        return {name: int(self.file["index"][name][rows[0]]) for name in INDEX}
+
+    def used(self, name):
+        """
+        Number of rows of the data set `name` that belong to the
+        indexed steps.
+        """
+        if name == "timing":
+            return len(self)
+        index = {n: self.file["index"][n][:] for n in INDEX}
+        if name == "ids":
+            ends = index["atom_offset"] + index["n_atoms"]
+        elif name in ("keyframes", "deltas"):
+            rows = index["keyframe"] == (name == "keyframes")
+            ends = (index["position_offset"] + index["n_atoms"])[rows]
+        elif name == "removed":
+            ends = index["removed_offset"] + index["n_removed"]
+        else:
+            ends = index["event_offset"] + index["n_events"]
+        return int(ends.max()) if len(ends) else 0
+
+    def extend(self, name, values):
+        """
+        Append `values` to the data set `name` (after its used rows).
+        Returns the offset they start at.
+        """
+        dataset = self.file["data"][name]
+        offset = self.used(name)
+        dataset.resize(offset + len(values), axis=0)
+        if len(values):
+            dataset[offset:] = values
+        return offset
+
+    def append(self, step, state, directory=None):
+        """
+        Append step `step`: the emitter `state` returned by
+        `call_lammps`, the evaporation events of the results_data files
+        in the step `directory` and its telemetry.
+        """
+        positions = state.positions[state.atoms]*1e10
+        parents = state.parents
+        keyframe = self.previous is None or parents is None or \
+            len(self) % self.keyframe_every == 0 or \
+            self.steps[-1] != step-1 or len(parents) != len(positions) or \
+            (len(parents) and parents.max() >= len(self.previous))
+
+        timing = "[]"
+        if directory is not None and os.path.isfile(os.path.join(directory, TELEMETRY)):
+            with open(os.path.join(directory, TELEMETRY)) as f:
+                timing = "[" + ",".join(line.strip() for line in f if line.strip()) + "]"
+        events = step_events(directory) if directory is not None else np.empty((0, 3))
+
+        entry = {"step": step, "n_atoms": len(positions), "keyframe": int(keyframe)}
+        entry["atom_offset"] = self.extend("ids", state.ids[state.atoms])
+        if keyframe:
+            removed = np.empty(0, dtype=np.int32)
+            entry["position_offset"] = self.extend("keyframes", positions)
+            previous = positions
+        else:
+            removed = np.setdiff1d(np.arange(len(self.previous)), parents)
+            delta = (positions - self.previous[parents]).astype(np.float32)
+            entry["position_offset"] = self.extend("deltas", delta)
+            previous = self.previous[parents] + delta
+        entry["removed_offset"] = self.extend("removed", removed)
+        entry["n_removed"] = len(removed)
+        entry["event_offset"] = self.extend("events", events)
+        entry["n_events"] = len(events)
+        self.extend("timing", [timing])
+
+        n = len(self)
+        for name in INDEX:
+            self.file["index"][name].resize(n+1, axis=0)
+            self.file["index"][name][n] = entry[name]
+        self.file.flush()
+        self.previous = previous
+
+    def truncate(self, step):
+        """
+        Drop the steps after `step`.
+        """
+        n = int(np.count_nonzero(self.steps <= step))
+        for name in INDEX:
+            self.file["index"][name].resize(n, axis=0)
+        for name in DATA:
+            self.file["data"][name].resize(self.used(name), axis=0)
+        self.file.flush()
+        self.previous = self.positions(self.steps[-1]) if n else None
+
+    def positions(self, step):
+        """
+        Positions (Angstroms) of the atoms after step `step`, starting
+        from the keyframe before it.
+        """
+        steps = self.steps
+        row = int(np.flatnonzero(steps == step)[0]) if step in steps else None
+        if row is None:
+            raise KeyError("Step {} is not in {}".format(step, self.filename))
+        keyframes = self.file["index/keyframe"][:row+1]
+        start = int(np.flatnonzero(keyframes)[-1])
+        entry = self.index(steps[start])
+        offset, n = entry["position_offset"], entry["n_atoms"]
+        positions = self.file["data/keyframes"][offset:offset+n]
+        for r in range(start+1, row+1):
+            entry = self.index(steps[r])
+            parents = np.setdiff1d(np.arange(len(positions)), self.removed(steps[r]))
+            offset, n = entry["position_offset"], entry["n_atoms"]
+            positions = positions[parents] + self.file["data/deltas"][offset:offset+n]
+        return positions
+
+    def ids(self, step):
+        """
+        CN-tagged IDs of the atoms after step `step`.
+        """
+        entry = self.index(step)
+        offset = entry["atom_offset"]
+        return self.file["data/ids"][offset:offset+entry["n_atoms"]]
+
+    def removed(self, step):
+        """
+        Rows, among the atoms of the step before, of the atoms step
+        `step` removed (evaporated or lost). Empty for keyframe steps.
+        """
+        entry = self.index(step)
+        offset = entry["removed_offset"]
+        return self.file["data/removed"][offset:offset+entry["n_removed"]]
+
+    def events(self, step):
+        """
+        TAPSim IDs and detector x, y ((n, 2), NaN if not reported) of
+        the ions of step `step`.
+        """
+        entry = self.index(step)
+        offset = entry["event_offset"]
+        events = self.file["data/events"][offset:offset+entry["n_events"]]
+        return events[:, 0].astype(int), events[:, 1:]
+
+    def timing(self, step):
+        """
+        Telemetry spans (see `pyvaporate.telemetry`) of step `step`.
+        """
+        row = int(np.flatnonzero(self.steps == step)[0])
+        timing = self.file["data/timing"][row]
+        return json.loads(timing.decode() if isinstance(timing, bytes) else timing)
@@ -0,0 +1,84 @@
+# This file is part of the PyVaporate package and selects the part of the
+# emitter that needs to be relaxed after an evaporation step: the atoms
+# near the freshly evaporated sites, plus a frozen buffer shell around
+# them. Everything else is left where the previous relaxation put it.
+
+from pyvaporate.state import EmitterState
+
+from scipy.spatial import cKDTree
+
+import numpy as np
+
+
+def carve_subdomain(positions, sites, radius, buffer):
+    """
+    Indices of the `positions` within `radius` + `buffer` of any of the
+    `sites` (same units), in increasing order, and a mask of the ones
+    within `radius` (the core; the rest is the buffer shell).
+    """
+    if len(sites) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=bool)
+    near = cKDTree(positions).query_ball_point(sites, radius+buffer)
+    region = np.unique(np.concatenate([np.asarray(n, dtype=int) for n in near]))
+    distance, _ = cKDTree(sites).query(positions[region],
+                                       distance_upper_bound=radius)
+    return region, np.isfinite(distance)
+
+
+def local_subdomain(state, surface_numbers, setup):
+    """
+    The region to relax after TAPSim evaporated the atoms flagged in
+    `state`, if `setup["lammps"]["subdomain"]["radius"]` (Angstroms) is
+    set: the atoms within `radius` of an evaporated site can move, the
+    ones in the surrounding `buffer` shell are held in place. With
+    surface_only, only surface atoms (`surface_numbers`, 1-based atom
+    numbers) of the core can move. The region is found by walking the
+    neighbor list of `state` if it has one.
+
+    Returns the node indices of the region (None to relax the whole
+    emitter) and the 1-based numbers of its mobile atoms.
+    """
+    config = setup["lammps"].get("subdomain", {})
+    radius = config.get("radius", "none")
+    if radius == "none" or not state.evaporated.any():
+        return None, surface_numbers
+
+    atoms = np.flatnonzero(state.atoms)
+    radius, buffer = float(radius), float(config.get("buffer", 6.0))
+    if state.neighbors is not None:
+        nodes = np.flatnonzero(state.atoms | state.evaporated)
+        rows, distance = state.neighbors.within(
+            np.flatnonzero(state.evaporated[nodes]), radius+buffer)
+        region, core = np.searchsorted(atoms, nodes[rows]), distance <= radius
+    else:
+        region, core = carve_subdomain(
+            state.positions[atoms]*1e10, state.positions[state.evaporated]*1e10,
+            radius, buffer
+        )
+    if len(region) == 0:
+        return None, surface_numbers
+    mobile = core
+    if setup["lammps"]["minimize"]["surface_only"] == True:
+        mobile = core & np.isin(region+1, np.array(surface_numbers, dtype=int))
+    return atoms[region], np.flatnonzero(mobile)+1
+
+
+def merge_subdomain(state, region, kept, emitter):
+    """
+    Merge the relaxed atoms of a subdomain back into the emitter.
+    `region` are the node indices of the subdomain in `state`, `kept`
+    the mask of those atoms that survived the relaxation and `emitter`
+    their relaxed `EmitterState` (see `convert_lammps_to_emitter`).
+    Returns the `EmitterState` of all emitter atoms, in the order of
+    `state`, with the IDs of `emitter` for the relaxed atoms and their
+    IDs in `state` for the others.
+    """
+    atoms = np.flatnonzero(state.atoms)
+    positions = state.positions[atoms]
+    ids = state.ids[atoms]
+    rows = np.searchsorted(atoms, region)
+    positions[rows[kept]] = emitter.positions
+    ids[rows[kept]] = emitter.ids
+    keep = np.ones(len(atoms), dtype=bool)
+    keep[rows[~kept]] = False
+    return EmitterState(positions[keep], ids[keep])
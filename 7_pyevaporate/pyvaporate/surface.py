@@ -0,0 +1,90 @@
+# This file is part of the PyVaporate package and finds the surface atoms
+# of an emitter directly from its coordinates, so that surface-only
+# relaxations do not depend on TAPSim's surface_data dumps.
+
+from pyvaporate.neighbors import nearest_neighbor_distance
+
+from scipy.spatial import cKDTree
+
+import numpy as np
+
+
+def find_surface(positions, cutoff=None, min_cn=None, asymmetry=0.5,
+                 exclude_bottom=True, max_neighbors=16, chunk_size=250000,
+                 tree=None):
+    """
+    Indices of the surface atoms among `positions` (Angstroms).
+
+    Neighbors are the atoms closer than `cutoff` (by default 1.07 times
+    the nearest-neighbor distance, i.e. the first shell of BCC and FCC
+    lattices). An atom is at the surface if it has fewer than `min_cn`
+    neighbors (by default the most common coordination number, the bulk
+    one), or if its neighborhood is lopsided: the sum of the vectors to
+    its neighbors is longer than `asymmetry` nearest-neighbor distances,
+    meaning there is a half-space around it with (nearly) no atoms.
+    Atoms within `cutoff` of the lowest z, which sit on the emitter's
+    bottom boundary rather than facing the vacuum, are left out if
+    `exclude_bottom`.
+
+    The neighbor query is done `chunk_size` atoms at a time (at most
+    `max_neighbors` neighbors each) on all cores, so that memory stays
+    bounded for 10^7 atoms. An existing cKDTree of `positions` can be
+    passed as `tree`. To follow an emitter over several steps, use a
+    `pyvaporate.neighbors.NeighborList` and `surface_from_neighbors`.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    if len(positions) == 0:
+        return np.empty(0, dtype=int)
+    if tree is None:
+        tree = cKDTree(positions)
+    nn = nearest_neighbor_distance(tree, positions)
+    if cutoff is None:
+        cutoff = 1.07*nn
+
+    cn = np.empty(len(positions), dtype=int)
+    offset = np.empty(len(positions))
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start:start+chunk_size]
+        distance, index = tree.query(chunk, k=max_neighbors+1,
+                                     distance_upper_bound=cutoff, workers=-1)
+        # drop the atom itself (distance 0) and missing neighbors
+        distance, index = distance[:, 1:], index[:, 1:]
+        found = np.isfinite(distance)
+        index[~found] = 0
+        vectors = positions[index] - chunk[:, None, :]
+        vectors[~found] = 0.0
+        cn[start:start+chunk_size] = found.sum(axis=1)
+        offset[start:start+chunk_size] = np.linalg.norm(vectors.sum(axis=1), axis=1)
+
+    return classify_surface(positions, cn, offset, nn, cutoff, min_cn,
+                            asymmetry, exclude_bottom)
+
+
+def surface_from_neighbors(neighbors, min_cn=None, asymmetry=0.5,
+                           exclude_bottom=True):
+    """
+    `find_surface` on the atoms of the `NeighborList` `neighbors` with
+    its first-shell cutoff, reusing the coordination it keeps up to
+    date. Returns indices counted over its alive atoms.
+    """
+    cn, offset = neighbors.coordination()
+    alive = neighbors.alive
+    return classify_surface(neighbors.positions[alive], cn[alive], offset[alive],
+                            neighbors.nn, neighbors.surface_cutoff, min_cn,
+                            asymmetry, exclude_bottom)
+
+
+def classify_surface(positions, cn, offset, nn, cutoff, min_cn=None,
+                     asymmetry=0.5, exclude_bottom=True):
+    """
+    Indices of the surface atoms given their coordination numbers `cn`
+    and neighbor vector sums `offset` (see `find_surface`).
+    """
+    if len(positions) == 0:
+        return np.empty(0, dtype=int)
+    if min_cn is None:
+        min_cn = np.bincount(cn).argmax()
+    surface = (cn < min_cn) | (offset > asymmetry*nn)
+    if exclude_bottom:
+        surface &= positions[:, 2] >= positions[:, 2].min() + cutoff
+    return np.flatnonzero(surface)
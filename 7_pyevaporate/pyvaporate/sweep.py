@@ -0,0 +1,193 @@
+# This file is part of the PyVaporate package and runs parameter sweeps:
+# a base setup.yaml plus a grid of parameter values is expanded into one
+# run directory per grid point, and the runs are executed in parallel on
+# a process pool.
+
+from pyvaporate.run import yaml_run
+
+from monty.serialization import loadfn, dumpfn
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import copy
+import csv
+import itertools
+import os
+import time
+import traceback
+
+# environment variables capping the threads of the TAPSim/LAMMPS children
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+
+def expand_grid(grid):
+    """
+    List of the {parameter: value} dicts of all combinations of the
+    values in `grid` ({parameter: [values]}), in order, with the last
+    parameter varying fastest.
+    """
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[n] for n in names))]
+
+
+def set_parameter(setup, parameter, value):
+    """
+    Set the nested entry of `setup` named by the dotted path
+    `parameter` (e.g. "lammps.minimize.maxiter", or
+    "emitter.elements.W.e_fields.3" for the field of CN class 3).
+    """
+    keys = parameter.split(".")
+    entry = setup
+    for key in keys[:-1]:
+        entry = entry[dict_key(entry, key)]
+    entry[dict_key(entry, keys[-1])] = value
+
+
+def dict_key(entry, key):
+    """
+    `key`, or its integer value if `entry` is keyed by integers (as the
+    e_fields are).
+    """
+    if key not in entry and key.lstrip("-").isdigit() and int(key) in entry:
+        return int(key)
+    return key
+
+
+def write_sweep(base_config, grid, root):
+    """
+    Create one run directory below `root` per point of `grid` (see
+    `expand_grid`), holding the setup.yaml of `base_config` with the
+    point's parameters set. Returns the list of (run directory,
+    parameters).
+    """
+    base = loadfn(base_config)
+    runs = []
+    for i, parameters in enumerate(expand_grid(grid)):
+        setup = copy.deepcopy(base)
+        for parameter, value in parameters.items():
+            set_parameter(setup, parameter, value)
+        directory = os.path.join(os.path.abspath(root), "run_{:03d}".format(i))
+        os.makedirs(directory, exist_ok=True)
+        dumpfn(setup, os.path.join(directory, "setup.yaml"))
+        runs.append((directory, parameters))
+    return runs
+
+
+def limit_threads(cpus_per_run):
+    """
+    Pool worker initializer: let the binaries started by the worker use
+    `cpus_per_run` threads.
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(cpus_per_run)
+
+
+def completed_steps(directory):
+    """
+    Number of steps of a run with a relaxed emitter.
+    """
+    return sum(1 for d in os.listdir(directory) if d.isdigit() and
+               os.path.isfile(os.path.join(directory, d, "relaxed_emitter.txt")))
+
+
+def run_point(directory, retries=1):
+    """
+    Run the setup.yaml of `directory` there, resuming after its last
+    complete step (so that a failed attempt is retried up to `retries`
+    times from where it stopped, and a sweep that was itself
+    interrupted picks up its runs where they were). Never raises;
+    returns a summary dict with the status ("done" or "failed"), the
+    number of attempts, the wall time in seconds, the completed steps
+    and the last error. The tracebacks of failed attempts are kept in
+    error.log.
+    """
+    start = time.time()
+    error = ""
+    if os.path.exists(os.path.join(directory, "error.log")):
+        os.remove(os.path.join(directory, "error.log"))
+    for attempt in range(1, retries+2):
+        try:
+            yaml_run(os.path.join(directory, "setup.yaml"), directory, resume=True)
+            status = "done"
+            break
+        except Exception:
+            status = "failed"
+            error = traceback.format_exc().strip().splitlines()[-1]
+            with open(os.path.join(directory, "error.log"), "a") as f:
+                f.write("attempt {}\n{}\n".format(attempt, traceback.format_exc()))
+    return {"status": status, "attempts": attempt,
+            "seconds": round(time.time()-start, 1),
+            "steps": completed_steps(directory), "error": error}
+
+
+def run_sweep(base_config, grid, root="sweep", cpus=None, cpus_per_run=1,
+              retries=1):
+    """
+    Expand `base_config` and `grid` into run directories below `root`
+    (see `write_sweep`) and run them on a process pool. Every run gets
+    `cpus_per_run` CPUs for its TAPSim/LAMMPS children, and as many
+    runs as fit in `cpus` (by default all CPUs) go on at once. A failed
+    run is retried `retries` times and then marked failed, without
+    stopping the others. Runs resume from their last complete step, so
+    calling `run_sweep` again after an interruption finishes the sweep.
+
+    Writes the summary table, one row per run with its parameters and
+    the `run_point` results, to root/summary.csv and returns its rows.
+    """
+    runs = write_sweep(base_config, grid, root)
+    cpus = cpus or os.cpu_count() or 1
+    workers = max(1, min(len(runs), cpus//cpus_per_run))
+
+    rows = {}
+    with ProcessPoolExecutor(workers, initializer=limit_threads,
+                             initargs=(cpus_per_run,)) as pool:
+        futures = {pool.submit(run_point, directory, retries): (directory, parameters)
+                   for directory, parameters in runs}
+        for future in as_completed(futures):
+            directory, parameters = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:  # the worker process itself died
+                result = {"status": "failed", "attempts": 0, "seconds": 0,
+                          "steps": completed_steps(directory), "error": repr(e)}
+            row = {"run": os.path.basename(directory)}
+            row.update((p, str(v)) for p, v in parameters.items())
+            row.update(result)
+            rows[directory] = row
+
+    rows = [rows[directory] for directory, _ in runs]
+    with open(os.path.join(os.path.abspath(root), "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def yaml_sweep(sweep_file):
+    """
+    Run the sweep described by the yaml file `sweep_file`:
+
+        base: setup.yaml       # base configuration (relative to sweep_file)
+        root: sweep            # run directories (relative to sweep_file)
+        cpus: 16               # total CPU budget (default: all)
+        cpus_per_run: 2        # CPUs of each TAPSim/LAMMPS child
+        retries: 1
+        grid:
+          emitter.orientation.z: [[1, 1, 0], [1, 0, 0]]
+          evaporation.events_per_step: ["5%", "10%"]
+    """
+    sweep = read_sweep(sweep_file)
+    return run_sweep(sweep["base"], sweep["grid"], sweep["root"], sweep.get("cpus"),
+                     sweep.get("cpus_per_run", 1), sweep.get("retries", 1))
+
+
+def read_sweep(sweep_file):
+    """
+    The sweep described by the yaml file `sweep_file` (see
+    `yaml_sweep`), with the base and root paths made absolute.
+    """
+    sweep = loadfn(sweep_file)
+    here = os.path.dirname(os.path.abspath(sweep_file))
+    sweep["base"] = os.path.join(here, os.path.expanduser(sweep["base"]))
+    sweep["root"] = os.path.join(here, os.path.expanduser(sweep.get("root", "sweep")))
+    return sweep
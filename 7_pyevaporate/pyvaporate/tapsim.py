@@ -0,0 +1,257 @@
+# This file is part of the PyVaporate package and reads the output files of
+# TAPSim (results_data, grid_data, surface_data, trajectory_data) in either
+# of its output modes, the text written with --write-ascii or the binary
+# one selected by the *_BINARY_OUTPUT switches of tapsim.ini, into NumPy
+# structured arrays. Binary files are memory-mapped, not parsed.
+#
+# Both modes start with a text header ending in a line "ASCII" or
+# "BINARY". The records are described by the field lists below, in the
+# column order of the ASCII files (the one the analysis scripts of this
+# repository read). Binary records are taken to hold the same fields,
+# packed, little-endian, with 32-bit integers and 64-bit floats. That
+# layout is not documented with TAPSim, so check it against ASCII output
+# of the same run before relying on it:
+#
+#     python -m pyvaporate.tapsim results results_data.ascii results_data.bin
+#
+# and pass `fields`/`byteorder` to the readers if it differs. A run only
+# has TAPSim write binary output once that check has passed for its
+# results_data and was recorded with --confirm=FILE (see `binary_output`).
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from pyvaporate.nodes import parse_table
+
+I, F = np.int32, np.float64
+
+# one line per evaporated ion
+RESULTS_FIELDS = [
+    ("index", I), ("type", I), ("number", I), ("voltage", F),
+    ("x", F), ("y", F), ("z", F),                    # position on the emitter
+    ("stop_x", F), ("stop_y", F), ("stop_z", F),     # detector hit
+    ("tof", F), ("probability", F),
+    ("potential_before", F), ("field_before_x", F), ("field_before_y", F),
+    ("field_before_z", F), ("potential_after", F), ("field_after_x", F),
+    ("field_after_y", F), ("field_after_z", F),
+    ("normal_x", F), ("normal_y", F), ("normal_z", F),
+    ("apex_x", F), ("apex_y", F), ("apex_z", F),
+]
+# one line per mesh node
+GRID_FIELDS = [
+    ("id", I), ("number", I), ("x", F), ("y", F), ("z", F), ("charge", F),
+    ("potential_x", F), ("potential_y", F), ("potential_z", F),
+    ("field_x", F), ("field_y", F), ("field_z", F),
+]
+# one line per surface node; the ASCII position is written as "(x, y, z)"
+SURFACE_FIELDS = [
+    ("number", I), ("x", F), ("y", F), ("z", F), ("charge", F),
+    ("field_x", F), ("field_y", F), ("field_z", F),
+    ("normal_x", F), ("normal_y", F), ("normal_z", F),
+]
+# one line per integration step of an ion
+TRAJECTORY_FIELDS = [
+    ("index", I), ("time", F), ("x", F), ("y", F), ("z", F),
+    ("vx", F), ("vy", F), ("vz", F),
+]
+FIELDS = {"results": RESULTS_FIELDS, "grid": GRID_FIELDS,
+          "surface": SURFACE_FIELDS, "trajectory": TRAJECTORY_FIELDS}
+
+
+def read_header(filename, limit=1000):
+    """
+    The header lines of the TAPSim output file `filename`, its mode
+    ("ASCII" or "BINARY") and the byte offset its records start at. A
+    file without a mode line (within `limit` lines) is taken as ASCII
+    with its records starting at the first line that starts with a
+    number.
+    """
+    lines = []
+    first_number = None
+    with open(filename, "rb") as f:
+        while len(lines) < limit:
+            line = f.readline()
+            if not line:
+                break
+            text = line.decode("latin-1").strip()
+            words = text.split()
+            if words[:1] == ["ASCII"] and len(words) == 1:
+                return lines, "ASCII", f.tell()
+            if words[:1] == ["BINARY"]:
+                return lines, "BINARY", f.tell()
+            if first_number is None and words and not words[0].startswith("#"):
+                try:
+                    float(words[0])
+                    first_number = (len(lines), f.tell()-len(line))
+                except ValueError:
+                    pass
+            lines.append(text)
+    if first_number is None:
+        return lines, "ASCII", os.path.getsize(filename)
+    return lines[:first_number[0]], "ASCII", first_number[1]
+
+
+def record_dtype(fields, byteorder="<"):
+    """
+    The structured dtype of binary records with `fields` in `byteorder`.
+    """
+    return np.dtype([(name, np.dtype(t).newbyteorder(byteorder)) for name, t in fields])
+
+
+def read_tapsim_file(filename, fields, byteorder="<"):
+    """
+    The records of the TAPSim output file `filename` as a structured
+    array with `fields` (a list of (name, dtype)). Binary files are
+    memory-mapped read-only with the records in `byteorder`; ASCII
+    files are parsed, and only get the fields of the columns they have.
+    Raises ValueError if the size of the binary records does not divide
+    the data, i.e. `fields` does not describe the file.
+    """
+    _, mode, offset = read_header(filename)
+    if mode == "BINARY":
+        dtype = record_dtype(fields, byteorder)
+        size = os.path.getsize(filename) - offset
+        if size % dtype.itemsize:
+            raise ValueError("{}: {} bytes of data are not a whole number of {} byte "
+                             "records".format(filename, size, dtype.itemsize))
+        if size == 0:
+            return np.zeros(0, dtype)
+        return np.memmap(filename, dtype, "r", offset, (size//dtype.itemsize,))
+
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        text = f.read().decode("latin-1")
+    # surface positions are written as "(x, y, z)"
+    table = parse_table(text.translate(str.maketrans("(),", "   ")), len(fields))
+    n_columns = min(table.shape[1], len(fields))
+    records = np.empty(len(table), np.dtype(fields[:n_columns]))
+    for column, (name, _) in enumerate(fields[:n_columns]):
+        records[name] = table[:, column]
+    return records
+
+
+def read_results(filename, fields=RESULTS_FIELDS, byteorder="<"):
+    """
+    The evaporated ions of a results_data file (see `RESULTS_FIELDS`).
+    """
+    return read_tapsim_file(filename, fields, byteorder)
+
+
+def read_grid(filename, fields=GRID_FIELDS, byteorder="<"):
+    """
+    The mesh nodes of a grid_data file (see `GRID_FIELDS`).
+    """
+    return read_tapsim_file(filename, fields, byteorder)
+
+
+def read_surface(filename, fields=SURFACE_FIELDS, byteorder="<"):
+    """
+    The surface nodes of a surface_data file (see `SURFACE_FIELDS`).
+    """
+    return read_tapsim_file(filename, fields, byteorder)
+
+
+def read_trajectory(filename, fields=TRAJECTORY_FIELDS, byteorder="<"):
+    """
+    The ion trajectory points of a trajectory_data file (see
+    `TRAJECTORY_FIELDS`).
+    """
+    return read_tapsim_file(filename, fields, byteorder)
+
+
+def compare_outputs(ascii_file, binary_file, fields, rtol=1e-5, byteorder="<"):
+    """
+    Check the binary TAPSim output `binary_file` against the ASCII
+    output `ascii_file` of the same run, both read with `fields`.
+    Returns the largest relative difference of each field the ASCII
+    file has; raises ValueError if the record counts differ or any
+    difference is above `rtol` (the ASCII files round to about seven
+    significant digits).
+    """
+    text = read_tapsim_file(ascii_file, fields)
+    binary = read_tapsim_file(binary_file, fields, byteorder)
+    if len(text) != len(binary):
+        raise ValueError("{} has {} records, {} has {}".format(
+            ascii_file, len(text), binary_file, len(binary)))
+    differences = {}
+    for name in text.dtype.names:
+        a, b = text[name].astype(float), binary[name].astype(float)
+        scale = np.maximum(np.abs(a), np.abs(b))
+        difference = np.divide(np.abs(a-b), scale, out=np.zeros(len(a)), where=scale > 0)
+        differences[name] = float(difference.max()) if len(a) else 0.0
+    wrong = [name for name, d in differences.items() if not d <= rtol]
+    if wrong:
+        raise ValueError("{} does not match {} in {}".format(
+            binary_file, ascii_file, ", ".join(wrong)))
+    return differences
+
+
+def layout(fields, byteorder="<"):
+    """
+    Description of the binary record layout `fields` in `byteorder`,
+    as recorded by `confirm_layout`.
+    """
+    return {"fields": [[name, np.dtype(t).str[1:]] for name, t in fields],
+            "byteorder": byteorder}
+
+
+def confirm_layout(ascii_file, binary_file, filename, fields=RESULTS_FIELDS,
+                   byteorder="<"):
+    """
+    Check the binary results_data `binary_file` against the ASCII
+    `ascii_file` of the same TAPSim run (see `compare_outputs`) and, if
+    they match, record the layout in the JSON file `filename`, for the
+    binary_layout setting of runs with `binary_output`.
+    """
+    differences = compare_outputs(ascii_file, binary_file, fields, byteorder=byteorder)
+    confirmed = dict(layout(fields, byteorder), ascii_file=os.path.abspath(ascii_file),
+                     binary_file=os.path.abspath(binary_file), differences=differences)
+    with open(filename, "w") as f:
+        json.dump(confirmed, f, indent=1)
+    return differences
+
+
+def binary_output(setup):
+    """
+    Whether TAPSim writes binary output in the run of `setup`:
+    `binary_output` in its evaporation section. Binary runs need the
+    `binary_layout` setting to name a file written by `confirm_layout`
+    for the layout the results are read with (`RESULTS_FIELDS`,
+    little-endian); otherwise a ValueError is raised, as a wrong layout
+    could still divide the data evenly and mark the wrong atoms
+    evaporated.
+    """
+    config = setup["evaporation"]
+    if config.get("binary_output", False) != True:
+        return False
+    filename = config.get("binary_layout", "none")
+    if filename == "none":
+        raise ValueError("binary_output needs a binary_layout confirmed against ASCII "
+                         "output (python -m pyvaporate.tapsim results ASCII_FILE "
+                         "BINARY_FILE --confirm=FILE)")
+    with open(os.path.expanduser(filename)) as f:
+        confirmed = json.load(f)
+    if {key: confirmed.get(key) for key in ["fields", "byteorder"]} != layout(RESULTS_FIELDS):
+        raise ValueError("{} does not confirm the results_data layout pyvaporate "
+                         "reads".format(filename))
+    return True
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--confirm=")]
+    confirm = [a.split("=", 1)[1] for a in sys.argv[1:] if a.startswith("--confirm=")]
+    if len(args) != 3 or args[0] not in FIELDS or (confirm and args[0] != "results"):
+        sys.exit("usage: python -m pyvaporate.tapsim {} ASCII_FILE BINARY_FILE "
+                 "[--confirm=FILE (results only)]".format("|".join(FIELDS)))
+    if confirm:
+        differences = confirm_layout(args[1], args[2], confirm[0])
+    else:
+        differences = compare_outputs(args[1], args[2], FIELDS[args[0]])
+    for name, difference in differences.items():
+        print("{:<18} {:.2e}".format(name, difference))
+    print("{} matches {}".format(args[2], args[1]))
+    if confirm:
+        print("Layout confirmed in {}".format(confirm[0]))
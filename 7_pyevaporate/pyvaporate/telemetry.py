@@ -0,0 +1,172 @@
+# This file is part of the PyVaporate package and records where the time
+# of a run goes: every phase of a step (TAPSim, LAMMPS, conversions, ...)
+# is a span with its wall and CPU time, the CPU time of the binaries it
+# ran, peak memory and I/O, written as JSON lines to the step directory.
+# `telemetry_report` (or python -m pyvaporate.telemetry ROOT) adds them up
+# for a run or a whole sweep.
+
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+TELEMETRY = "telemetry.jsonl"
+BLOCK = 512  # bytes per ru_inblock/ru_oublock block
+
+
+def usage():
+    """
+    Resource usage of the process and of its finished children so far.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu": own.ru_utime + own.ru_stime,
+        "child_cpu": children.ru_utime + children.ru_stime,
+        "read": (own.ru_inblock + children.ru_inblock)*BLOCK,
+        "written": (own.ru_oublock + children.ru_oublock)*BLOCK,
+        # kilobytes on Linux, bytes on macOS
+        "peak_rss": own.ru_maxrss*(1 if sys.platform == "darwin" else 1024),
+        "child_peak_rss": children.ru_maxrss*(1 if sys.platform == "darwin" else 1024),
+    }
+
+
+class Telemetry:
+    """
+    Span recorder of a run. Each `span` appends one JSON line to
+    telemetry.jsonl in the directory it is given (the step directory),
+    so the spans of a step go away with it (e.g. when a resumed run
+    discards a partial step). Spans can be recorded from several
+    threads.
+
+    CPU times and I/O are process-wide, so spans that overlap (the
+    background post-processing) also count each other's work; child
+    usage only counts binaries that finished within the span.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, directory=".", files=()):
+        """
+        Record the block in the with statement as the span `name` of
+        the step in `directory`, with the sizes of `files` (paths
+        relative to `directory`) at its end.
+        """
+        start, wall = usage(), time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            end, wall = usage(), time.perf_counter()-wall
+            record = {"span": name, "step": os.path.basename(os.path.abspath(directory)),
+                      "thread": threading.current_thread().name,
+                      "time": round(time.time(), 3), "wall": round(wall, 6)}
+            for key in ["cpu", "child_cpu"]:
+                record[key] = round(end[key]-start[key], 6)
+            for key in ["read", "written"]:
+                record[key] = end[key]-start[key]
+            for key in ["peak_rss", "child_peak_rss"]:
+                record[key] = end[key]
+            sizes = {}
+            for f in files:
+                path = os.path.join(directory, f)
+                if os.path.isfile(path):
+                    sizes[f] = os.path.getsize(path)
+            if sizes:
+                record["files"] = sizes
+            if error is not None:
+                record["error"] = error
+            self.write(directory, record)
+
+    def write(self, directory, record):
+        with self.lock:
+            with open(os.path.join(directory, TELEMETRY), "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+def span(telemetry, name, directory=".", files=()):
+    """
+    `telemetry.span(name, directory, files)`, or a context that records
+    nothing if `telemetry` is None.
+    """
+    if telemetry is None:
+        return contextlib.nullcontext()
+    return telemetry.span(name, directory, files)
+
+
+def read_spans(root):
+    """
+    All spans recorded below `root` (a run or a sweep directory), each
+    with the "run" directory (relative to `root`) it belongs to.
+    """
+    spans = []
+    for directory, _, filenames in sorted(os.walk(root)):
+        if TELEMETRY in filenames:
+            run = os.path.relpath(os.path.dirname(directory), root)
+            with open(os.path.join(directory, TELEMETRY)) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # line cut short by an interruption
+                    record["run"] = run
+                    spans.append(record)
+    return spans
+
+
+def summarize(spans):
+    """
+    Per-span totals of `spans` (see `read_spans`): count, wall, CPU and
+    child CPU time, bytes read and written and peak memory. Returns
+    rows sorted by total wall time.
+    """
+    rows = {}
+    for record in spans:
+        row = rows.setdefault(record["span"], {
+            "span": record["span"], "count": 0, "wall": 0.0, "max_wall": 0.0,
+            "cpu": 0.0, "child_cpu": 0.0, "read": 0, "written": 0,
+            "peak_rss": 0, "child_peak_rss": 0, "errors": 0})
+        row["count"] += 1
+        row["max_wall"] = max(row["max_wall"], record["wall"])
+        for key in ["wall", "cpu", "child_cpu", "read", "written"]:
+            row[key] += record[key]
+        for key in ["peak_rss", "child_peak_rss"]:
+            row[key] = max(row[key], record[key])
+        row["errors"] += "error" in record
+    return sorted(rows.values(), key=lambda row: -row["wall"])
+
+
+def telemetry_report(root=".", log=print):
+    """
+    Write the per-span totals (see `summarize`) of the run or sweep in
+    `root` to `log` as a table, with each span's share of the wall
+    time of the top-level "step" spans. Returns the rows.
+    """
+    spans = read_spans(root)
+    rows = summarize(spans)
+    total = sum(r["wall"] for r in spans if r["span"] == "step") or \
+        sum(r["wall"] for r in rows) or 1.0
+    runs = len(set(r["run"] for r in spans))
+    log("{} spans from {} run(s) in {}".format(len(spans), runs, os.path.abspath(root)))
+    log("{:<14} {:>6} {:>10} {:>6} {:>10} {:>10} {:>10} {:>9} {:>9} {:>9}".format(
+        "span", "count", "wall (s)", "%", "max (s)", "cpu (s)", "child (s)",
+        "read MB", "write MB", "peak MB"))
+    for row in rows:
+        log("{:<14} {:>6d} {:>10.2f} {:>6.1f} {:>10.3f} {:>10.2f} {:>10.2f} "
+            "{:>9.1f} {:>9.1f} {:>9.0f}".format(
+                row["span"], row["count"], row["wall"], 100*row["wall"]/total,
+                row["max_wall"], row["cpu"], row["child_cpu"], row["read"]/1e6,
+                row["written"]/1e6, max(row["peak_rss"], row["child_peak_rss"])/1e6))
+    return rows
+
+
+if __name__ == "__main__":
+    telemetry_report(sys.argv[1] if len(sys.argv) > 1 else ".")